@@ -0,0 +1,174 @@
+# On-disk cache of parsed programs, the .sfr counterpart of Python's .pyc files.  The tree
+# parsed from foo.sfr is stored in __sfrcache__/foo.sfa next to it, together with a hash of the
+# source; as long as the source is unchanged, run and use load the tree from there and skip the
+# lexer and parser.  Files that are stale, from another cache version or unreadable in any way
+# are simply ignored and rewritten after a normal parse.
+
+import gc
+import hashlib
+import marshal
+import os
+import zlib
+
+import parser
+from lexer import FileSource, Lexer, Location, SourceToken, StrippedToken, Token
+from parser import ParseResult, Parser, setfield
+
+CACHE_DIR = '__sfrcache__'
+# bump whenever the parser's node classes or the encoding below change
+CACHE_VERSION = 3
+CACHE_HEADER = b'SFRAST' + bytes([CACHE_VERSION, marshal.version])
+
+# tags of the encoded values; None, bools, strings and lists are stored as they are, and a bare
+# int is a position in the source (nodes hold numbers only inside their tokens)
+NODE, TOKEN, STRIPPED, TUPLE, DICT = range(5)
+
+
+def cache_path(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, CACHE_DIR, os.path.splitext(name)[0] + '.sfa')
+
+
+def source_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+# turn a tree of parser nodes into nested tuples and lists that marshal can store: a node
+# becomes (NODE, class name, attribute, value, attribute, value, ...), a token its type, value
+# and offsets, and a position just its offset
+def encode(value):
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, float)):
+        raise TypeError('Cannot cache numbers outside of tokens')
+    if isinstance(value, list):
+        return [encode(v) for v in value]
+    if isinstance(value, tuple):
+        return (TUPLE,) + tuple(encode(v) for v in value)
+    if isinstance(value, dict):
+        return (DICT, [encode(k) for k in value], [encode(v) for v in value.values()])
+    if isinstance(value, StrippedToken):
+        return (STRIPPED, value.type, value.value)
+    if isinstance(value, Token):
+        return (TOKEN, value.type, value.value, value.pos_start.idx, value.pos_end.idx)
+    if isinstance(value, Location):
+        return value.idx
+    cls = type(value).__name__
+    if getattr(parser, cls, None) is not type(value):
+        raise TypeError(f'Cannot cache {cls} objects')
+    fields = [NODE, cls]
+    for name in type(value).__slots__:
+        if hasattr(value, name):
+            fields += [name, encode(getattr(value, name))]
+    return tuple(fields)
+
+
+# rebuild a tree from encode's output; tokens and positions refer to source.  This is the
+# hot path of a cache hit, so node classes are looked up once per name and plain values are
+# recognised by their exact type before anything else is tried.
+def decode(value, source, classes=None):
+    classes = {} if classes is None else classes
+
+    def build(value):
+        kind = type(value)
+        if kind is list:
+            return [build(v) for v in value]
+        if kind is int:
+            return Location(source if value >= 0 else None, value)
+        if kind is not tuple:
+            return value
+        tag = value[0]
+        if tag == NODE:
+            cls = classes.get(value[1])
+            if cls is None:
+                cls = classes[value[1]] = node_class(value[1])
+            node = cls.__new__(cls)
+            for i in range(2, len(value), 2):
+                setfield(node, value[i], build(value[i + 1]))
+            return node
+        if tag == TOKEN:
+            return SourceToken(value[1], value[2], source, value[3], value[4])
+        if tag == STRIPPED:
+            return StrippedToken(value[1], value[2])
+        if tag == TUPLE:
+            return tuple(map(build, value[1:]))
+        if tag == DICT:
+            return dict(zip(build(value[1]), build(value[2])))
+        raise ValueError(f'Unknown tag {tag}')
+
+    return build(value)
+
+
+def node_class(name):
+    cls = getattr(parser, name, None)
+    if not isinstance(cls, type) or not issubclass(cls, parser.Node) or cls is parser.Node:
+        raise ValueError(f'Unknown node class {name}')
+    return cls
+
+
+# trees parsed lazily are kept apart from complete ones, as they only match in behaviour
+def header(digest, stripped, lazy):
+    return CACHE_HEADER + bytes([stripped | lazy << 1]) + digest
+
+
+# the cached tree for a source with the given hash, or None if there is no usable entry
+def read_cache(path, digest, stripped, lazy, source):
+    try:
+        with open(cache_path(path), 'rb') as f:
+            data = f.read()
+        head = header(digest, stripped, lazy)
+        if not data.startswith(head):
+            return None
+        # the rebuilt tree only ever grows, so collection passes over it cannot free anything
+        # and only slow the load down
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return decode(marshal.loads(zlib.decompress(data[len(head):])), source)
+        finally:
+            if enabled:
+                gc.enable()
+    except (OSError, EOFError, ValueError, TypeError, zlib.error):
+        # missing, stale, truncated or otherwise corrupt: parse the source instead
+        return None
+
+
+# store a tree; the file is written under a temporary name and moved into place, so a reader
+# never sees half of it.  Failing to write (read-only directory, a tree too deep for marshal)
+# only means the next run parses again.
+def write_cache(path, digest, stripped, lazy, node):
+    target = cache_path(path)
+    temp = f'{target}.{os.getpid()}.tmp'
+    try:
+        # the encoding is very repetitive; even the fastest zlib level shrinks it several times
+        data = header(digest, stripped, lazy) + zlib.compress(marshal.dumps(encode(node)), 1)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, target)
+    except (OSError, ValueError, TypeError, RecursionError, zlib.error):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# parse the .sfr file at path, streaming its tokens from lexer into a Parser, unless the cache
+# holds the tree for its current contents.  Returns a ParseResult either way; trees that failed
+# to parse are never cached.  Without use_cache the cache is neither read nor written.  lazy is
+# passed on to the Parser.
+def parse_file(path, lexer=None, symbol_table=None, use_cache=False, lazy=False):
+    lexer = lexer or Lexer()
+    if use_cache:
+        digest = source_hash(path)
+        node = read_cache(path, digest, lexer.strip_debug, lazy, FileSource(path, lexer.name))
+        if node is not None:
+            return ParseResult().success(node)
+
+    with open(path, 'r') as f:
+        res = Parser(lexer.iter_tokens(f), symbol_table, lazy=lazy).parse()
+    if use_cache and not res.error:
+        write_cache(path, digest, lexer.strip_debug, lazy, res.node)
+    return res
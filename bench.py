@@ -0,0 +1,791 @@
+# Benchmarks for the Safyr toolchain.
+# usage: python bench.py [name ...]   (runs every benchmark when no name is given)
+
+import contextlib
+import gc
+import io
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import astcache
+import sfc
+from bytecode import Compiler
+from closures import ClosureEngine
+from direct import DirectInterpreter
+from feedback import load_profile, profile_path, save_profile
+from vm import VM
+from interpreter import BuiltInFunction, Context, Interpreter, Number, RTResult, Struct, SymbolTable
+from lexer import Lexer, Token, build_rules, read_rules, write_rules
+from optimizer import OPT_FOLD, OPT_HOIST, OPT_INLINE, OPT_NONE, optimize
+from parser import BinOpNode, Parser
+from quicken import GENERIC
+
+
+# generate a synthetic .sfr program with roughly the given number of lines
+def synthetic_source(lines=10000):
+    chunk = ['; generated benchmark source',
+             'a = 1',
+             'b = "some string value"',
+             'c = [1 2 3 4 5 6 7 8]',
+             '.add [x y] <~ x + y',
+             'd = add(a 2.5) * 3 - a',
+             'e = c @ 2',
+             'for i = 0 .. 10:',
+             '  a = a + i % 3',
+             '  ? a >= 1 & b != "x": a += 1',
+             'end']
+    reps = max(1, lines // len(chunk))
+    return '\n'.join(chunk * reps) + '\n'
+
+
+# a single long line, which is where the legacy engine's per-character line slicing hurts most
+def long_line_source(elements=5000):
+    return 'x = [' + ' '.join(str(i) for i in range(elements)) + ']\n'
+
+
+# run func once and return the elapsed wall time in seconds
+def timed(func, *args):
+    t0 = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t0
+
+
+# run func once and return the peak traced memory in bytes along with its result
+def traced(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, result
+
+
+# compare the table-driven scanner against the legacy transition engine
+def bench_lexer_engines(lines=2000, elements=5000):
+    for label, src in (('many lines', synthetic_source(lines)), ('long line', long_line_source(elements))):
+        table = Lexer().tokenize(src)
+        t_legacy = timed(Lexer(legacy=True).tokenize, src)
+        t_table = timed(Lexer().tokenize, src)
+        print(f'lexer engines, {label} ({len(table)} tokens): '
+              f'legacy {t_legacy:.3f}s  table {t_table:.3f}s  speedup {t_legacy / t_table:.1f}x')
+
+
+# cost of constructing a Lexer, which the shell and `use` do for every file they run, and
+# of building the transition table the first one builds, compared with reading it back from
+# an export
+def bench_lexer_construction(count=10000):
+    Lexer()
+    t_new = timed(lambda: [Lexer() for _ in range(count)]) / count
+    t_build = timed(lambda: [build_rules() for _ in range(100)]) / 100
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'lexer.rules')
+        write_rules(build_rules(), path)
+        t_read = timed(lambda: [read_rules(path) for _ in range(100)]) / 100
+    print(f'lexer construction: Lexer() {t_new * 1e6:.2f}us  '
+          f'build_rules {t_build * 1e6:.0f}us  read_rules {t_read * 1e6:.0f}us')
+
+
+# memory held by the token list with full Positions, with offsets only, and with debug info stripped
+def bench_token_memory(lines=2000):
+    src = synthetic_source(lines)
+    for label, lexer in (('positions', Lexer(legacy=True)),
+                         ('offsets', Lexer()),
+                         ('stripped', Lexer(strip_debug=True))):
+        peak, tokens = traced(lexer.tokenize, src)
+        print(f'token memory, {label}: {peak / 1024:.0f} KiB peak, {peak / len(tokens):.0f} bytes/token')
+
+
+# peak memory of reading and parsing a file whole versus streaming its tokens into the parser,
+# for a file of top-level statements and for one whose statements are all in a single block
+def bench_streaming(lines=5000):
+    block = 'for i = 0 .. 1:\n' + ''.join(f'  a{k} = {k} + 2 * b\n' for k in range(lines)) + 'end\n'
+    for shape, text in (('statements', synthetic_source(lines)), ('one block', block)):
+        with tempfile.NamedTemporaryFile('w', suffix='.sfr', delete=False) as f:
+            f.write(text)
+        try:
+            def whole():
+                with open(f.name) as src:
+                    return Parser(Lexer().tokenize(src.read())).parse()
+
+            def streamed():
+                with open(f.name) as src:
+                    return Parser(Lexer().iter_tokens(src)).parse()
+
+            for label, func in (('whole file', whole), ('streamed', streamed)):
+                t0 = time.perf_counter()
+                peak, _ = traced(func)
+                print(f'parse {lines} lines of {shape}, {label}: {peak / 1024 / 1024:.1f} MiB peak, '
+                      f'{time.perf_counter() - t0:.2f}s (traced)')
+        finally:
+            os.remove(f.name)
+
+
+# serial tokenization versus the process pool
+def bench_parallel(lines=100000):
+    src = synthetic_source(lines)
+    t_serial = timed(Lexer().tokenize, src)
+    print(f'tokenize {lines} lines: serial {t_serial:.2f}s ({os.cpu_count()} cpus)')
+    for processes in (2, 4, 8):
+        t_parallel = timed(Lexer().tokenize_parallel, src, processes)
+        print(f'  {processes} processes {t_parallel:.2f}s  speedup {t_serial / t_parallel:.2f}x')
+
+
+# re-tokenizing a large file after a one-line edit: from scratch versus incrementally
+def bench_relex(lines=100000):
+    src = synthetic_source(lines)
+    at = src.index('a = 1', len(src) // 2)
+    edit = (at, at + len('a = 1'), 'a = 12 + a')
+    new = src[:at] + edit[2] + src[edit[1]:]
+
+    t_full = timed(Lexer().tokenize, new)
+    tokens = Lexer().tokenize(src)
+    t_inc = timed(Lexer().retokenize, tokens, *edit)
+    print(f'one-line edit in {lines} lines: full {t_full:.3f}s  incremental {t_inc * 1000:.2f}ms')
+
+
+# parser throughput on a large synthetic file, from a ready token list
+def bench_parser(lines=20000):
+    tokens = Lexer().tokenize(synthetic_source(lines))
+    t = best_time(lambda: Parser(tokens).parse())
+    print(f'parse {lines} lines ({len(tokens)} tokens): {t:.3f}s  {len(tokens) / t / 1000:.0f}k tokens/s')
+
+
+# time to get the tree of a file by lexing and parsing it versus loading it from the AST cache
+def bench_ast_cache(lines=20000):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'bench.sfr')
+    with open(path, 'w') as f:
+        f.write(synthetic_source(lines))
+    try:
+        t_parse = best_time(astcache.parse_file, path)
+        astcache.parse_file(path, use_cache=True)
+        t_load = best_time(lambda: astcache.parse_file(path, use_cache=True))
+        size = os.path.getsize(astcache.cache_path(path))
+        print(f'ast cache, {lines} lines: parse {t_parse:.3f}s  cached load {t_load:.3f}s  '
+              f'({t_parse / t_load:.1f}x, {size / 1024:.0f} KiB cache file '
+              f'for {os.path.getsize(path) / 1024:.0f} KiB of source)')
+    finally:
+        shutil.rmtree(folder)
+
+
+# memory held by the parsed tree, over the tokens it is built from, per 10k top-level statements
+def bench_ast_memory(lines=20000):
+    tokens = Lexer().tokenize(synthetic_source(lines))
+    gc.collect()
+    tracemalloc.start()
+    tree = Parser(tokens).parse().node
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    statements = len(tree.elements)
+    print(f'ast memory, {statements} statements: {size / 1024 / 1024:.1f} MiB, '
+          f'{size / statements * 10000 / 1024 / 1024:.2f} MiB per 10k statements')
+
+
+# a library of many multi-line functions of which a program calls only a few: parsing it whole
+# versus lazily, plus the bodies that are then actually called
+def bench_lazy_parse(functions=2000, called=20):
+    src = ''.join(f'.f{i} [x y] <~\n'
+                  f'  z = x * {i} + y\n'
+                  f'  for k = 0 .. 10:\n'
+                  f'    ? z > k: z -= k\n'
+                  f'  end\n'
+                  f'  return [z x y]\n'
+                  f'end\n' for i in range(functions))
+    tokens = Lexer().tokenize(src)
+
+    def lazy():
+        tree = Parser(tokens, lazy=True).parse().node
+        for node in tree.elements[:called]:
+            node.body_node.parse()
+
+    t_eager = best_time(lambda: Parser(tokens).parse())
+    t_lazy = best_time(lambda: Parser(tokens, lazy=True).parse())
+    t_used = best_time(lazy)
+    print(f'lazy parse, {functions} functions ({len(tokens)} tokens): eager {t_eager:.3f}s  '
+          f'lazy {t_lazy:.3f}s  lazy + {called} bodies {t_used:.3f}s  ({t_eager / t_used:.1f}x)')
+
+
+# a global context like the shell's, with the builtins programs print and change lists with
+# if asked for
+def program_context(opt_level=OPT_NONE, builtins=False):
+    symbol_table = SymbolTable()
+    for name, value in (('null', Number(0)), ('T', Number(1)), ('F', Number(0)),
+                        ('static-typing', Number(0)), ('opt-level', Number(opt_level))):
+        symbol_table.set(name, value)
+    if builtins:
+        for name, value in (('print', BuiltInFunction.print), ('APPEND', BuiltInFunction.append),
+                            ('POP', BuiltInFunction.pop), ('EXTEND', BuiltInFunction.extend)):
+            symbol_table.set(name, value)
+    symbol_table.globals = list(symbol_table.symbols)
+    context = Context('<program>')
+    context.symbol_table = symbol_table
+    return context
+
+
+# parse src, optimize it at opt_level and run it, returning the value of the program
+def run_program(src, opt_level=OPT_NONE):
+    tree = optimize(Parser(Lexer().tokenize(src)).parse().node, opt_level)
+    res = Interpreter().visit(tree, program_context(opt_level))
+    if res.error:
+        raise AssertionError(str(res.error))
+    return res.value
+
+
+# a loop full of constant arithmetic, run as parsed and with constants folded
+def bench_constant_folding(iterations=20000):
+    src = (f'total = 0\n'
+           f'for i = 0 .. {iterations}:\n'
+           f'  total = total + 2 * 3 + 1 - 10 / 5 + (4 ^ 2) % 7\n'
+           f'  ? i % 2 == 0 & 1 < 2: total = total - (3 * -1)\n'
+           f'end\n'
+           f'total\n')
+    plain = best_time(run_program, src, OPT_NONE)
+    folded = best_time(run_program, src, OPT_FOLD)
+    print(f'constant folding, {iterations} iterations: as parsed {plain:.3f}s  '
+          f'folded {folded:.3f}s  ({plain / folded:.1f}x)')
+
+
+# a loop of invariant work, run with constants folded and with invariants hoisted
+def bench_hoisting(iterations=20000):
+    src = (f'n = 12\nm = 5\ntotal = 0\n'
+           f'for i = 0 .. {iterations}:\n'
+           f'  total = total + (n * m + n / m) % 7 + (i + n * m) * (i + n * m)\n'
+           f'end\n'
+           f'total\n')
+    folded = best_time(run_program, src, OPT_FOLD)
+    hoisted = best_time(run_program, src, OPT_HOIST)
+    print(f'hoisting, {iterations} iterations: folded {folded:.3f}s  '
+          f'hoisted {hoisted:.3f}s  ({folded / hoisted:.1f}x)')
+
+
+# a loop of small calls, run called and inlined
+def bench_inlining(iterations=20000):
+    src = (f'.add [x y] <~ x + y\n.scale [x] <~ x * 3 - 1\ntotal = 0\n'
+           f'for i = 0 .. {iterations}:\n'
+           f'  total = add(total scale(i % 10))\n'
+           f'end\n'
+           f'total\n')
+    hoisted = best_time(run_program, src, OPT_HOIST)
+    inlined = best_time(run_program, src, OPT_INLINE)
+    print(f'inlining, {iterations} iterations of 2 calls: called {hoisted:.3f}s  '
+          f'inlined {inlined:.3f}s  ({hoisted / inlined:.1f}x)')
+
+
+# the engines that run trees besides the Interpreter; each has run(tree, context) -> RTResult
+ENGINES = {'closures': ClosureEngine, 'vm': VM, 'direct': DirectInterpreter}
+
+# programs for checking the engines against the Interpreter, one for each part of the language
+ENGINE_PROGRAMS = {
+    'numbers': 'a = 7\nb = 2.5\nprint(a + b * 2 - a / 4 % 3)\nprint(a ^ 2)\nprint(-a)\nprint(~a)\n'
+               'print(a > b & b <= 2.5 | a == 3)\nprint((a !& 0) + (a !| 0) + (a >< 0))\nprint(a @ 0)\na / 0\n',
+    'strings': 's = "abc"\nt = s + "def"\nprint(t - "b")\nprint(s * 3)\nprint(t @ 4)\nprint(t </ 2)\nprint(s == "abc")\n',
+    'lists': 'a = [1 2 3]\na = a + 4\na = a - 2\na += [7 8]\nprint(a @ 2)\nprint(a </ 3)\nAPPEND(a 9)\n'
+             'print(POP(a 0))\nEXTEND(a [5 6])\nprint(a)\nprint(a @ 99)\n',
+    'maps': 'm = {1: "a" 2: "b"}\nprint(m)\n',
+    'static types': 'int b = 7\nb = 6.5\nprint(b)\nflt c = 2\nprint(c)\nvar d = 1\nd = "x"\nprint(d)\nb = "s"\n',
+    'constants': 'const k = 5\nprint(k + 1)\nk = 6\n',
+    'when triggers': 'a = 0\nb = 0\nwhen a == 5:\n  b = b + 12\nend\nwhile b < 12:\n  a += 1\nend\n'
+                     'a = 5\nprint(a)\nprint(b)\n',
+    'loops': 't = 0\nfor i = 10 .. 0:\n  t = t + i\nend\nfor i = 0 .. 20 .. 3:\n  ? i == 9: continue\n'
+             '  ? i == 15: break\n  t = t * 2 + i\nend\nk = 0\nr = while k < 5:\n  k = k + 1\n  k * k\nend\nprint(r)\nt\n',
+    'functions': '.add [x y] <~ x + y\n.f [n] <~\n  s = 0\n  for i = 0 .. n:\n    ? i == 4: return s\n    s = add(s i)\n'
+                 '  end\n  return s\nend\n.apply [g x] <~ g(g(x 1) 2)\nprint(f(3) + f(10))\nprint(apply(add 5))\n'
+                 'add(1)\n',
+    'recursion': '.fact [self n] <~ ? n < 2: 1 ! n * self(self n - 1)\nprint(fact(fact 10))\n',
+    'break in a function': '.stop [] <~\n  break\nend\nt = 0\nfor i = 0 .. 5:\n  t = t + 1\n  stop()\nend\nt\n',
+    'structs': ':Point [x y] {\n  a = x\n  b = y * 2\n  .norm [] <~ a + b\n}\np = Point(3 4)\nprint(p)\n'
+               'print(p.a + p.b)\n.id [s] <~ s\nq = id(p)\nprint(q.b)\n',
+    'errors in functions': '.inv [x] <~ 1 / x\n.g [x] <~\n  return inv(x - 1)\nend\ng(1)\n',
+    'undefined variable': 't = 1\nprint(t + u)\n',
+    'return at the top': 't = 1\nreturn t + 1\nt = 5\n',
+    'locals shadowing globals': '.f [x] <~\n  p = print\n  p(x)\n  print = 3\n  return print + x\nend\nprint(f(2))\n',
+    'unbound locals': '.f [] <~\n  for i = 0 .. 0:\n    q = 1\n  end\n  return q\nend\nf()\n',
+    'when on locals': '.f [a] <~\n  b = 1\n  when a == 3:\n    b = 5\n  end\n  for i = 0 .. 5:\n    a = i\n  end\n'
+                      '  return b\nend\nprint(f(1))\n',
+    'static locals': 'use static\n.f [x] <~\n  int y = 2.5\n  y = 4.5\n  return y + x\nend\nprint(f(1))\n',
+    'calls two deep': '.g [] <~\n  y = 1\n  return y\nend\n.f [g] <~\n  z = g()\n  return z\nend\nprint(f(g))\n',
+    'empty return in a loop': '.f [] <~\n  for i = 0 .. 2:\n    y = 1\n    return ? y == 9: 1\n  end\n'
+                              '  print("after")\n  return 0\nend\nprint(f())\n',
+    'empty return at the top': 'y = 1\nreturn ? y == 9: 1\ny = 2\n',
+    'container access': 'xs = [1 [2 3] "ab"]\nys = xs @ 1\nprint(ys @ 0)\nprint(xs @ 1 @ 1)\n'
+                        'print((xs @ 0) + (ys @ 1))\nprint(xs @ 2)\n.g [k] <~ k - 1\nprint(xs @ g(2))\n'
+                        't = 0\nfor i = 0 .. 2:\n  t = t + (ys @ i)\nend\nprint(t)\nprint(xs @ 5)\n',
+    'property access': ':Pair [x y] {\n  ys = [x y]\n  s = x + y\n}\np = Pair(3 4)\nprint(p.s)\n'
+                       'print(p.ys @ 1)\nprint((p.s) * 2)\nprint(p.q)\n',
+}
+
+
+# random loop programs for checking the engines against each other: assignments, prints,
+# branches, loops with break and continue, calls and triggers over a few variables
+def random_program(r):
+    names = ['a', 'b', 'c', 'n', 'm']
+
+    def expr(depth=0):
+        if depth > 2 or r.random() < 0.3:
+            return r.choice(['0', '1', '2', '3', '0.5', '-1', '~0', 'i', 'j'] + names * 3)
+        k = r.random()
+        if k < 0.15: return '(' + expr(depth + 1) + ')'
+        if k < 0.22: return '-' + expr(depth + 1)
+        if k < 0.3: return f'f({expr(depth + 1)})'
+        if k < 0.36: return f'(xs @ {r.randrange(0, 2)})'
+        return expr(depth + 1) + ' ' + r.choice(['+', '-', '*', '/', '%', '==', '!=', '<', '>', '<=',
+                                                 '>=', '&', '|', '><']) + ' ' + expr(depth + 1)
+
+    def statements(depth, indent, in_loop):
+        lines = []
+        for _ in range(r.randrange(1, 4 if depth else 10)):
+            k = r.random()
+            if k < 0.3: lines.append(f'{indent}{r.choice(names)} = ({expr()}) % 1000')
+            elif k < 0.38: lines.append(f'{indent}{r.choice(names)} {r.choice(["+=", "-="])} {expr()}')
+            elif k < 0.55: lines.append(f'{indent}print({expr()})')
+            elif k < 0.6: lines.append(f'{indent}? {expr()}: print({expr()})')
+            elif k < 0.65 and in_loop: lines.append(f'{indent}? {expr()}: {r.choice(["break", "continue"])}')
+            elif k < 0.7: lines.append(f'{indent}APPEND(xs {expr()})')
+            elif k < 0.78:
+                lines.append(f'{indent}? {expr()}:')
+                lines += statements(depth + 1, indent + '  ', in_loop)
+                lines.append(f'{indent}end')
+            elif depth < 2 and k < 0.9:
+                lines.append(f'{indent}for {"ij"[depth]} = 0 .. {r.randrange(0, 4)}:')
+                lines += statements(depth + 1, indent + '  ', True)
+                lines.append(f'{indent}end')
+            elif depth < 2:
+                counter = f'w{depth}'
+                lines.append(f'{indent}{counter} = 0')
+                lines.append(f'{indent}while ({counter} < {r.randrange(0, 4)}) & ({expr()} != 99):')
+                lines.append(f'{indent}  {counter} = {counter} + 1')
+                lines += statements(depth + 1, indent + '  ', True)
+                lines.append(f'{indent}end')
+        return lines
+
+    lines = ['a = 1', 'b = 2', 'c = 5', 'n = 3', 'm = 2', 'i = 0', 'j = 0', 'xs = [1 2]',
+             '.f [x] <~ x * 2 + 1']
+    for _ in range(r.randrange(0, 3)):
+        lines += [f'when {r.choice(names)} == {r.randrange(0, 6)}:', f'  {r.choice(names)} = {expr()}', 'end']
+    return '\n'.join(lines + statements(0, '', False)) + '\n'
+
+
+# run src at opt_level on engine, or on the Interpreter, and return everything the program
+# shows: what it printed, how it ended and the variables it left.  compiled, the tree and code
+# loaded from a .sfc, stands in for src.  profiled, the .sfr file holding src, has the
+# profile (see feedback.py) a tiered run starts from and updates.
+def program_outcome(src, opt_level, engine=None, compiled=None, profiled=None):
+    context = program_context(opt_level, builtins=True)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            if compiled:
+                tree, code = compiled
+            else:
+                tree = optimize(Parser(Lexer().tokenize(src)).parse().node, opt_level)
+            if compiled and engine is VM:
+                res = VM().run_code(code, context)
+            elif profiled and Interpreter.tiering:
+                tiers = Interpreter.tiering
+                tiers.profile = load_profile(profiled, tree, opt_level)
+                try:
+                    res = Interpreter().visit(tree, context)
+                finally:
+                    if tiers.profile:
+                        save_profile(profiled, tiers.profile)
+                    tiers.profile = None
+            else:
+                res = engine().run(tree, context) if engine else Interpreter().visit(tree, context)
+            ending = (repr(res.value), res.error and str(res.error), repr(res.func_return_value),
+                      res.loop_should_continue, res.loop_should_break)
+        except RecursionError:
+            # the message tells whether the limit was met calling Python code from Python or from
+            # C, which depends on the engine's own calls
+            ending = ('RecursionError',)
+        except Exception as e:
+            ending = (type(e).__name__, str(e))
+    variables = {name: (repr(value), value.type, value.static, value.const, len(value.triggers))
+                 for name, value in context.symbol_table.symbols.items()}
+    return out.getvalue(), ending, variables
+
+
+# the loop-heavy program the engines are timed on, optimized at OPT_INLINE
+def loop_program(iterations):
+    src = (f'.f [n] <~\n  s = 0\n  for k = 0 .. n:\n    s = s + k * 2\n  end\n  return s\nend\n'
+           f'total = 0\ni = 0\n'
+           f'while i < {iterations}:\n'
+           f'  i = i + 1\n'
+           f'  total = total + i * 2 - 1\n'
+           f'  ? i % 3 == 0:\n    total = total - f(3)\n  end\n'
+           f'end\n'
+           f'total\n')
+    return optimize(Parser(Lexer().tokenize(src)).parse().node, OPT_INLINE)
+
+
+# a loop-heavy program run by the Interpreter and by the closure engine
+def bench_closures(iterations=20000):
+    tree = loop_program(iterations)
+    walked = best_time(lambda: Interpreter().visit(tree, program_context(OPT_INLINE)))
+    compiled = best_time(lambda: ClosureEngine().run(tree, program_context(OPT_INLINE)))
+    assert repr(Interpreter().visit(tree, program_context(OPT_INLINE)).value) == \
+        repr(ClosureEngine().run(tree, program_context(OPT_INLINE)).value)
+    print(f'closures, {iterations} loop iterations: Interpreter {walked:.3f}s  '
+          f'closures {compiled:.3f}s  ({walked / compiled:.1f}x)')
+
+
+# the time per node evaluated by the Interpreter and by the DirectInterpreter, for the
+# loop-heavy program and for a long run of assignments of small expressions
+def bench_direct(iterations=20000, lines=5000):
+    r = random.Random(0)
+    names = ['a', 'b', 'c', 'd']
+    src = ''.join(f'{n} = {r.randrange(1, 9)}\n' for n in names) + ''.join(
+        f'{r.choice(names)} = {r.choice(names)} {r.choice("+-*")} {r.randrange(1, 9)} < '
+        f'{r.choice(names)} + {r.randrange(1, 9)}\n' for _ in range(lines))
+    programs = {f'{iterations} loop iterations': loop_program(iterations),
+                f'{lines} assignments': optimize(Parser(Lexer().tokenize(src)).parse().node, OPT_NONE)}
+
+    visit = Interpreter.visit
+    for label, tree in programs.items():
+        # every node the Interpreter visits, in function bodies too
+        visits = 0
+
+        def counted(self, node, context):
+            nonlocal visits
+            visits += 1
+            return visit(self, node, context)
+        Interpreter.visit = counted
+        try:
+            Interpreter().visit(tree, program_context(OPT_INLINE))
+        finally:
+            Interpreter.visit = visit
+
+        walked = best_time(lambda: Interpreter().visit(tree, program_context(OPT_INLINE)))
+        direct = best_time(lambda: DirectInterpreter().run(tree, program_context(OPT_INLINE)))
+        print(f'direct, {label} ({visits} nodes): Interpreter {walked:.3f}s '
+              f'{walked / visits * 1e9:.0f}ns/node  direct {direct:.3f}s {direct / visits * 1e9:.0f}ns/node  '
+              f'({walked / direct:.2f}x)')
+
+
+# one operation for each kind of quickened handler, and two left to the Value methods
+BINOP_CASES = {'INT + INT': 'a + b', 'INT - INT': 'a - b', 'INT * INT': 'a * b', 'INT ^ INT': 'a ^ 2',
+               'INT / INT': 'a / b', 'INT % INT': 'a % b', 'INT == INT': 'a == b', 'INT < INT': 'a < b',
+               'INT & INT': 'a & b', 'FLT * FLT': 'x * y', 'STR + STR': 's + t', 'STR @ INT': 's @ 1',
+               'LST @ INT': 'xs @ 2', 'INT @ INT': 'a @ 0', 'STR </ INT': 's </ 1'}
+BINOP_VARIABLES = 'a = 12\nb = 30\nx = 2.5\ny = 4.0\ns = "ab"\nt = "cd"\nxs = [1 2 3]\n'
+
+
+# each operation above by its quickened handler and by the generic one calling the Value method:
+# the operation alone, on its operands evaluated once, and the whole node run by the Interpreter
+def bench_binops(count=100000):
+    context = program_context(OPT_NONE)
+    Interpreter().visit(Parser(Lexer().tokenize(BINOP_VARIABLES)).parse().node, context)
+    interpreter = Interpreter()
+
+    def repeated(func, *args):
+        for _ in range(count):
+            func(*args)
+
+    for label, src in BINOP_CASES.items():
+        node = Parser(Lexer().tokenize(src)).parse().node.elements[0]
+        # an @ in the source is a container access, which quickens the BinOpNode it makes each
+        # time; the operation is timed as a BinOpNode of its own
+        if not isinstance(node, BinOpNode):
+            node = BinOpNode(node.head.root_var, Token('AT', '@'), node.head.specifier)
+        left = interpreter.visit(node.left_node, context).value
+        right = interpreter.visit(node.right_node, context).value
+        op = node.op_tok.type
+        handlers = Interpreter.quickened
+
+        quickened = repr(interpreter.visit(node, context).value)
+        handler = handlers[node]
+        fast = best_time(repeated, handler, left, right)
+        fast_node = best_time(repeated, interpreter.visit, node, context)
+
+        handlers[node] = GENERIC[op]
+        assert repr(interpreter.visit(node, context).value) == quickened
+        slow = best_time(repeated, GENERIC[op], left, right)
+        slow_node = best_time(repeated, interpreter.visit, node, context)
+        handlers.pop(node)
+
+        kind = 'generic' if handler is GENERIC[op] else 'specialized'
+        print(f'binops, {label:<10} {kind:<11}  operation {slow / count * 1e9:4.0f} -> '
+              f'{fast / count * 1e9:4.0f}ns ({slow / fast:.2f}x)  node {slow_node / count * 1e9:5.0f} -> '
+              f'{fast_node / count * 1e9:5.0f}ns ({slow_node / fast_node:.2f}x)')
+
+
+# time a read of a variable, which lends out the value the variable holds, against a read
+# copying it as reads did before copy-on-write (test.py pins down what a read shares)
+def bench_reads(count=100000):
+    context = program_context(OPT_NONE, builtins=True)
+    Interpreter().visit(Parser(Lexer().tokenize(
+        'n = 12\ns = "abc"\nxs = [' + ' '.join(map(str, range(100))) + ']\n')).parse().node, context)
+
+    # reads as they were: the value's copy(), placed where it is read
+    class Copying(Interpreter):
+        def visit_VarAccessNode(self, node, context):
+            value = context.symbol_table.get(node.var_name_tok.value)
+            if isinstance(value, Struct):
+                value = value.copy().set_pos(node.pos_start, node.pos_end)
+            elif context.display_name.startswith('struct'):
+                value = value.set_pos(node.pos_start, node.pos_end)
+            else:
+                value = value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+            return RTResult().success(value)
+
+    def repeated(func, *args):
+        for _ in range(count):
+            func(*args)
+
+    for label, name in (('Number', 'n'), ('String', 's'), ('List', 'xs')):
+        node = Parser(Lexer().tokenize(name)).parse().node.elements[0]
+        fast = best_time(repeated, Interpreter().visit, node, context)
+        slow = best_time(repeated, Copying().visit, node, context)
+        print(f'reads, of a {label:<7} {slow / count * 1e9:5.0f}ns copied -> '
+              f'{fast / count * 1e9:5.0f}ns lent ({slow / fast:.2f}x)')
+
+    # a list copied and appended to on each iteration: the copy keeps the elements it was made
+    # with, so each APPEND copies the list of them once more
+    for iterations in (2500, 5000, 10000):
+        tree = Parser(Lexer().tokenize(f'xs = []\nfor i = 0 .. {iterations}:\n  ys = xs\n  APPEND(xs i)\nend\n'
+                                       )).parse().node
+        ran = best_time(lambda: Interpreter().visit(tree, program_context(OPT_NONE, builtins=True)))
+        print(f'reads, copied then appended to {iterations:>5} times {ran:.3f}s')
+
+
+# the loop-heavy program run by the Interpreter and by the bytecode VM (its time includes
+# compiling), and a recursion deeper than the Interpreter can go
+def bench_vm(iterations=20000, depth=5000):
+    tree = loop_program(iterations)
+    code = Compiler().compile(tree)
+    walked = best_time(lambda: Interpreter().visit(tree, program_context(OPT_INLINE)))
+    ran = best_time(lambda: VM().run(tree, program_context(OPT_INLINE)))
+    print(f'vm, {iterations} loop iterations: Interpreter {walked:.3f}s  vm {ran:.3f}s  '
+          f'({walked / ran:.1f}x), {len(code)} instructions')
+
+    src = f'.down [self n] <~ ? n == 0: 0 ! self(self n - 1) + 1\ndown(down {depth})\n'
+    tree = Parser(Lexer().tokenize(src)).parse().node
+    try:
+        Interpreter().visit(tree, program_context(OPT_NONE))
+        walked = 'finishes'
+    except RecursionError:
+        walked = 'RecursionError'
+    VM().run(tree, program_context(OPT_NONE))
+    print(f'vm, recursion {depth} calls deep: Interpreter {walked}, vm finishes')
+
+
+# programs whose hot loops and functions change under the compiled code: the types the code
+# was specialized on, the function a call was specialized on, static and constant variables
+# and triggers
+TIERING_PROGRAMS = {
+    'number becomes a string': 'x = 0\ny = 1\nfor i = 0 .. 40:\n  x = x + y * 2\n  ? i == 20:\n    x = "s"\n'
+                               '    y = "t"\n  end\nend\nx\n',
+    'string becomes a number': 's = "a"\nt = "b"\nfor i = 0 .. 40:\n  s = s + t\n  ? i == 30:\n    s = 5\n'
+                               '    t = 1\n  end\nend\ns\n',
+    'float counter': 't = 0.5\nfor i = 0.5 .. 30 .. 1.5:\n  t = t * 1.01 + i / 3\nend\nt\n',
+    'division by zero later': 't = 0\nfor i = 0 .. 30:\n  t = t + 10 / (20 - i)\nend\nt\n',
+    'callee redefined': '.f [x] <~ x + 1\nt = 0\nfor i = 0 .. 40:\n  t = t + f(i)\n  ? i == 20:\n'
+                        '    .f [x] <~ x * 2\n  end\nend\nt\n',
+    'callee replaced by a builtin': '.f [x] <~ x + 1\nt = 0\nfor i = 0 .. 40:\n  t = t + f(i)\n  ? i == 35:\n'
+                                    '    f = print\n  end\nend\nt\n',
+    'hot function': '.g [n] <~\n  s = 0\n  k = 0\n  while k < n:\n    k = k + 1\n    s = s + k % 7\n'
+                    '  end\n  return s\nend\nt = 0\nfor i = 0 .. 30:\n  t = t + g(i)\nend\nt\n',
+    'function turning to strings': '.h [a b] <~ a + b\nt = []\nfor i = 0 .. 30:\n'
+                                   '  ? i > 15: t = t + h("x" "y") ! t = t + h(i 1)\nend\nt\n',
+    'static in a hot loop': 'use static\nint k = 0\nflt f = 1\nfor i = 0 .. 30:\n  k = k + 1.5\n'
+                            '  f = f + i\nend\nprint(k)\nprint(f)\nk = "s"\n',
+    'constant in a hot loop': 'const c = 2\nt = 0\nfor i = 0 .. 30:\n  t = t + c\n  ? i == 25: c = 3\nend\nt\n',
+    'trigger in a hot loop': 'a = 0\nb = 0\nwhen a == 17:\n  b = b + 100\nend\nfor i = 0 .. 30:\n'
+                             '  a = i\n  b = b + 1\nend\nprint(b)\nb\n',
+    'return from a hot loop': '.find [n] <~\n  for i = 0 .. 100:\n    s = i\n    ? i * i > n: return i\n  end\n'
+                              '  return 0\nend\nt = 0\nfor j = 0 .. 30:\n  t = t + find(j * 10)\nend\nt\n',
+    'break from a called function': '.stop [] <~\n  break\nend\nt = 0\nfor i = 0 .. 30:\n  t = t + 1\n'
+                                    '  ? i == 25: stop()\nend\nt\n',
+}
+
+
+# a loop-heavy program run by the Interpreter alone and with hot loops and functions compiled
+def bench_tiering(iterations=20000):
+    from tiering import Tiers
+    try:
+        tree = loop_program(iterations)
+        walked = best_time(lambda: Interpreter().visit(tree, program_context(OPT_INLINE)))
+        Interpreter.tiering = Tiers()
+        tiered = best_time(lambda: Interpreter().visit(tree, program_context(OPT_INLINE)))
+        Interpreter.tiering = None
+        print(f'tiering, {iterations} loop iterations: Interpreter {walked:.3f}s  '
+              f'tiered {tiered:.3f}s  ({walked / tiered:.1f}x)')
+    finally:
+        Interpreter.tiering = None
+
+
+# a short program run many times, tiered without a profile (see feedback.py) and
+# warm-started from one
+FEEDBACK_PROGRAM = """.f [x] <~ x * 3 + 1
+t = 0
+for i = 0 .. 150:
+  t = t + f(i) % 7 - i / 2
+end
+"""
+
+
+def bench_feedback(runs=50):
+    from tiering import Tiers
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'short.sfr')
+        with open(path, 'w') as f:
+            f.write(FEEDBACK_PROGRAM)
+        tree = optimize(Parser(Lexer().tokenize(FEEDBACK_PROGRAM)).parse().node, OPT_INLINE)
+
+        def run(profiled):
+            tiers = Interpreter.tiering = Tiers()
+            tiers.profile = load_profile(path, tree, OPT_INLINE) if profiled else None
+            Interpreter().visit(tree, program_context(OPT_INLINE))
+            if tiers.profile:
+                save_profile(path, tiers.profile)
+
+        times = {}
+        for profiled in (False, True):
+            start = time.perf_counter()
+            for _ in range(runs):
+                run(profiled)
+            times[profiled] = time.perf_counter() - start
+        print(f'feedback, {runs} runs of a 150 iteration loop: cold {times[False]:.3f}s  '
+              f'warm-started {times[True]:.3f}s  ({times[False] / times[True]:.1f}x)')
+    finally:
+        Interpreter.tiering = None
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# time loading a large program from its .sfc against parsing, optimizing and compiling it
+def bench_sfc(lines=20000):
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'big.sfr')
+        with open(path, 'w') as f:
+            f.write(synthetic_source(lines))
+        build = lambda: Compiler().compile(optimize(astcache.parse_file(path).node, OPT_INLINE))
+        t_build = best_time(build)
+        sfc.compile_file(path, Lexer(), 0, OPT_INLINE)
+        t_load = best_time(sfc.load_sfc, path, Lexer(), 0, OPT_INLINE)
+        size = os.path.getsize(sfc.sfc_path(path))
+        print(f'sfc, {lines} lines: parse, optimize and compile {t_build:.3f}s  load {t_load:.3f}s  '
+              f'({t_build / t_load:.1f}x, {size / 1024:.0f} KiB .sfc)')
+    finally:
+        shutil.rmtree(folder)
+
+
+# loops in function bodies and recursive calls run by the VM with the functions' variables in
+# slots and in dicts; the two are within noise of each other (see resolver.py)
+def bench_slots(calls=400, recursions=40, depth=100):
+    programs = {'loops in functions': f'.f [n] <~\n  s = 0\n  for k = 0 .. n:\n    t = k * 2\n'
+                                      f'    s = s + t - k\n  end\n  return s\nend\n'
+                                      f'total = 0\nfor i = 0 .. {calls}:\n  total = total + f(50)\nend\n',
+                'recursion': f'.down [self n] <~ ? n == 0: 0 ! self(self n - 1) + 1\nt = 0\n'
+                             f'for i = 0 .. {recursions}:\n  t = t + down(down {depth})\nend\n'}
+    for label, src in programs.items():
+        tree = optimize(Parser(Lexer().tokenize(src)).parse().node, OPT_INLINE)
+        codes = [Compiler(resolved=resolved).compile(tree) for resolved in (False, True)]
+        t_dict, t_slots = (best_time(lambda: VM().run_code(code, program_context(OPT_INLINE)), repeat=5)
+                           for code in codes)
+        print(f'slots, {label}: dict frames {t_dict:.3f}s  slot frames {t_slots:.3f}s  ({t_dict / t_slots:.2f}x)')
+
+
+# program shapes for the scaling suite; each builds a program whose size grows linearly with n
+SHAPES = {
+    'long line': lambda n: 'x = ' + ' + '.join(str(i) for i in range(n)) + '\n',
+    'nested blocks': lambda n: ''.join(f'? a > {i}:\n' for i in range(n)) + 'a = 1\n' + 'end\n' * n,
+    'nested parens': lambda n: 'x = ' + '(' * n + '1' + ')' * n + '\n',
+    'many functions': lambda n: ''.join(f'.f{i} [x y] <~\n  z = x + y * {i}\n  return z\nend\n' for i in range(n)),
+    'list literal': lambda n: 'x = [' + ' '.join(str(i) for i in range(n)) + ']\n',
+    'map literal': lambda n: 'x = {' + ' '.join(f'{i}: "v{i}"' for i in range(n)) + '}\n',
+    'access chain': lambda n: 'x = a' + ''.join(f'.b @ {i} ' for i in range(n)) + '\n',
+    'nested access': lambda n: 'x = ' + 'a.b @ (' * n + '1' + ')' * n + '\n',
+}
+
+
+# best of a few runs of func, with a clean heap before each
+def best_time(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        times.append(timed(func, *args))
+    return min(times)
+
+
+# least-squares slope of log(time) against log(size): ~1 for linear growth, ~2 for quadratic
+def growth_exponent(sizes, times):
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(t) for t in times]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+
+
+# time Lexer.tokenize and Parser.parse separately on programs of each shape at doubling sizes,
+# fit how their run time grows with the number of tokens, and fail if any phase grows faster
+# than limit (i.e. noticeably superlinear)
+def bench_scaling(sizes=(250, 500, 1000, 2000, 4000), limit=1.3):
+    recursion_limit = sys.getrecursionlimit()
+    # nested shapes recurse through the parser once per level
+    sys.setrecursionlimit(max(recursion_limit, 60 * max(sizes)))
+    failures = []
+    try:
+        for shape, generate in SHAPES.items():
+            counts, lex_times, parse_times = [], [], []
+            for n in sizes:
+                src = generate(n)
+                tokens = Lexer().tokenize(src)
+                res = Parser(tokens).parse()
+                if res.error:
+                    raise AssertionError(f'{shape} program of size {n} does not parse: {res.error}')
+                counts.append(len(tokens))
+                lex_times.append(best_time(lambda: Lexer().tokenize(src)))
+                parse_times.append(best_time(lambda: Parser(tokens).parse()))
+
+            for phase, times in (('tokenize', lex_times), ('parse', parse_times)):
+                k = growth_exponent(counts, times)
+                flag = '  SUPERLINEAR' if k > limit else ''
+                print(f'{shape:>15} {phase:>8}: {counts[0]}..{counts[-1]} tokens  '
+                      f'{times[0] * 1000:.1f}..{times[-1] * 1000:.1f}ms  exponent {k:.2f}{flag}')
+                if flag:
+                    failures.append(f'{phase} of {shape} (exponent {k:.2f})')
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    if failures:
+        raise AssertionError('superlinear scaling: ' + ', '.join(failures))
+
+
+BENCHMARKS = {'lexer': bench_lexer_engines,
+              'lexer-init': bench_lexer_construction,
+              'token-memory': bench_token_memory,
+              'stream': bench_streaming,
+              'parallel': bench_parallel,
+              'relex': bench_relex,
+              'scaling': bench_scaling,
+              'parse': bench_parser,
+              'ast-cache': bench_ast_cache,
+              'ast-memory': bench_ast_memory,
+              'lazy': bench_lazy_parse,
+              'fold': bench_constant_folding,
+              'hoist': bench_hoisting,
+              'inline': bench_inlining,
+              'closures': bench_closures,
+              'direct': bench_direct,
+              'binops': bench_binops,
+              'reads': bench_reads,
+              'vm': bench_vm,
+              'sfc': bench_sfc,
+              'slots': bench_slots,
+              'tiering': bench_tiering,
+              'feedback': bench_feedback}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
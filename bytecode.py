@@ -0,0 +1,355 @@
+# Compiles parsed (and optimized) trees into bytecode for the virtual machine in vm.py.
+#
+# A CodeObject holds the code of one program or function body as a flat list of ints, three
+# per instruction: the opcode, its argument and the index in the node pool of the node the
+# instruction stands for (-1 for none), whose positions it gives its values and errors.
+# Arguments index the constant pool (numbers, strings and operator names), the names table,
+# the node pool or the list of function bodies, or are an instruction number to jump to or a
+# count of values.  Every node compiles to code that leaves exactly one value on the stack,
+# None for statements without one, as Interpreter.visit returns one.
+#
+# A function body is compiled with its parameters' names, and the variables resolver.py gives
+# slots are read and written by LOAD_FAST and STORE_FAST, whose argument is the slot.
+#
+# Nodes without an instruction of their own (maps, assignments through references, use, and
+# assignments to keywords, which fail) compile to EVAL, which has an Interpreter run them.
+# Container and property reads compile to the instructions the Interpreter's walk of them
+# amounts to: `name @ i` is the BINARY for '@' it builds a BinOpNode for, and a property is read
+# by PROPERTY in the context of the value it belongs to.
+#
+# usage: Compiler().compile(tree) -> CodeObject;  print(disassemble(code))
+
+from lexer import KWDS
+from parser import (ContainerAccessNode, LazyBlockNode, NumberNode, PropertyAccessNode, StringNode,
+                    VarAccessNode)
+from resolver import resolve
+
+(NUMBER, STRING, NONE, LOAD_NAME, STORE, BINARY, STRUCT_OPERAND, UNARY, LIST, CAPSULE, JUMP,
+ JUMP_IF_FALSE, SETUP_LOOP, FOR_SETUP, FOR_ITER, LOOP_APPEND, END_LOOP, BREAK, CONTINUE, RETURN,
+ END, MAKE_FUNCTION, MAKE_STRUCT, LOAD_CALLEE, CALL, CALL_NAME, INLINE_GUARD, INLINE_CALL,
+ INVARIANT, INVARIANT_STORE, RESET, WHEN, EVAL, LOAD_FAST, LOAD_CALLEE_FAST, STORE_FAST,
+ FOR_ITER_FAST, LIST_OPERAND, PROPERTY, REFERENCE, END_REFERENCE) = range(41)
+
+OPCODES = ['NUMBER', 'STRING', 'NONE', 'LOAD_NAME', 'STORE', 'BINARY', 'STRUCT_OPERAND', 'UNARY',
+           'LIST', 'CAPSULE', 'JUMP', 'JUMP_IF_FALSE', 'SETUP_LOOP', 'FOR_SETUP', 'FOR_ITER',
+           'LOOP_APPEND', 'END_LOOP', 'BREAK', 'CONTINUE', 'RETURN', 'END', 'MAKE_FUNCTION',
+           'MAKE_STRUCT', 'LOAD_CALLEE', 'CALL', 'CALL_NAME', 'INLINE_GUARD', 'INLINE_CALL',
+           'INVARIANT', 'INVARIANT_STORE', 'RESET', 'WHEN', 'EVAL', 'LOAD_FAST', 'LOAD_CALLEE_FAST',
+           'STORE_FAST', 'FOR_ITER_FAST', 'LIST_OPERAND', 'PROPERTY', 'REFERENCE', 'END_REFERENCE']
+
+# the opcodes whose argument is a constant, a name, a slot, an instruction or a function body
+CONST_ARGS = {NUMBER, STRING, BINARY, UNARY}
+NAME_ARGS = {LOAD_NAME, LOAD_CALLEE, PROPERTY}
+SLOT_ARGS = {LOAD_FAST, LOAD_CALLEE_FAST, STORE_FAST}
+JUMP_ARGS = {JUMP, JUMP_IF_FALSE, SETUP_LOOP, FOR_SETUP, FOR_ITER, FOR_ITER_FAST, STRUCT_OPERAND,
+             INLINE_GUARD, INVARIANT, REFERENCE}
+FUNCTION_ARGS = {MAKE_FUNCTION, INLINE_CALL}
+
+
+class CodeObject:
+    def __init__(self, name):
+        self.name = name
+        self.code = []
+        self.consts = []
+        self.names = []
+        self.nodes = []
+        self.functions = []
+        self.set_slots([])
+        # the instructions as the VM runs them, built on their first run (see vm.link)
+        self.linked = None
+
+    # give the variables in names the slots they are listed in; a code object without slots
+    # runs with a SymbolTable, one with them with a SlotTable
+    def set_slots(self, names):
+        self.slots = names
+        self.layout = {name: i for i, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.code) // 3
+
+    def __repr__(self):
+        return f'<code {self.name}, {len(self)} instructions>'
+
+
+class Compiler:
+    # resolved=False keeps every variable in the frame's dict, as before resolver.py
+    def __init__(self, bodies=None, resolved=True):
+        # function body node -> its CodeObject, shared with the compilers of nested bodies
+        self.bodies = {} if bodies is None else bodies
+        self.resolved = resolved
+        self.code = None
+        self.pools = None
+
+    # arg_names are the parameters of the function node is the body of, if it is one
+    def compile(self, node, name='<program>', arg_names=None):
+        self.code = CodeObject(name)
+        if arg_names is not None and self.resolved:
+            self.code.set_slots(resolve(node, arg_names))
+        # value -> index for each pool; constants are told apart by type, as 1 == 1.0 == True,
+        # element by element for tuples
+        self.pools = ({}, {}, {}, {})
+        self.visit(node)
+        self.emit(END)
+        return self.code
+
+    # the CodeObject for a function body, compiled once however often it is defined or inlined
+    def body(self, node, name, arg_names):
+        code = self.bodies.get(node)
+        if code is None:
+            code = self.bodies[node] = Compiler(self.bodies, self.resolved).compile(node, name, arg_names)
+        return self.pool(3, self.code.functions, code, code)
+
+    def pool(self, which, items, key, item):
+        index = self.pools[which].get(key)
+        if index is None:
+            index = self.pools[which][key] = len(items)
+            items.append(item)
+        return index
+
+    def const(self, value):
+        items = value if isinstance(value, tuple) else (value,)
+        return self.pool(0, self.code.consts, tuple((type(v), v) for v in items), value)
+
+    def name(self, name):
+        return self.pool(1, self.code.names, name, name)
+
+    # nodes hash by identity
+    def node(self, node):
+        return self.pool(2, self.code.nodes, node, node)
+
+    # append an instruction and return its number
+    def emit(self, op, arg=0, node=None):
+        self.code.code += [op, arg, -1 if node is None else self.node(node)]
+        return len(self.code) - 1
+
+    def here(self):
+        return len(self.code)
+
+    def patch(self, instruction, target):
+        self.code.code[instruction * 3 + 1] = target
+
+    def visit(self, node):
+        method = getattr(self, f'visit_{type(node).__name__}', self.visit_other)
+        method(node)
+
+    # a node the VM has an Interpreter run
+    def visit_other(self, node):
+        self.emit(EVAL, 0, node)
+
+    ###################################
+
+    def visit_NumberNode(self, node):
+        self.emit(NUMBER, self.const((node.tok.value, node.tok.type)), node)
+
+    def visit_StringNode(self, node):
+        self.emit(STRING, self.const(node.tok.value), node)
+
+    def visit_CapsuleNode(self, node):
+        for el in node.elements:
+            self.visit(el)
+        self.emit(CAPSULE, len(node.elements), node)
+
+    def visit_ListNode(self, node):
+        for el in node.elements:
+            self.visit(el)
+        self.emit(LIST, len(node.elements), node)
+
+    # a struct on the left makes the right operand a property, read in the struct's context;
+    # STRUCT_OPERAND reads it so and jumps over the code reading it as usual.  Either way it
+    # leaves a value under the right operand for BINARY: where any other left operand was read
+    def visit_BinOpNode(self, node):
+        self.visit(node.left_node)
+        check = None
+        if not isinstance(node.left_node, (NumberNode, StringNode)):
+            check = self.emit(STRUCT_OPERAND, 0, node)
+        self.visit(node.right_node)
+        binary = self.emit(BINARY, self.const(node.op_tok.type), node)
+        if check is not None:
+            self.patch(check, binary)
+
+    def visit_UnaryOpNode(self, node):
+        self.visit(node.node)
+        self.emit(UNARY, self.const(node.op_tok.type), node)
+
+    def visit_VarAccessNode(self, node):
+        slot = self.code.layout.get(node.var_name_tok.value)
+        if slot is None:
+            self.emit(LOAD_NAME, self.name(node.var_name_tok.value), node)
+        else:
+            self.emit(LOAD_FAST, slot, node)
+
+    def visit_VarAssignNode(self, node):
+        if node.var_name_tok.value in KWDS + ['T', 'F']:
+            return self.visit_other(node)
+        self.visit(node.value_node)
+        slot = self.code.layout.get(node.var_name_tok.value)
+        if slot is None:
+            self.emit(STORE, 0, node)
+        else:
+            self.emit(STORE_FAST, slot, node)
+
+    def visit_IfNode(self, node):
+        exits = []
+        for condition, expr, ret in node.cases:
+            self.visit(condition)
+            skip = self.emit(JUMP_IF_FALSE)
+            self.visit(expr)
+            exits.append(self.emit(JUMP))
+            self.patch(skip, self.here())
+        if node.else_case:
+            self.visit(node.else_case[0])
+        else:
+            self.emit(NONE)
+        for instruction in exits:
+            self.patch(instruction, self.here())
+
+    # A loop keeps a block while it runs: the stack height to go back to, the list of its body's
+    # values, and the instructions break and continue jump to, END_LOOP and the one after the
+    # block's setup.
+    def visit_ForNode(self, node):
+        self.visit(node.start_value_node)
+        self.visit(node.end_value_node)
+        if node.step_value_node:
+            self.visit(node.step_value_node)
+        setup = self.emit(FOR_SETUP, 0, node)
+        step = self.emit(FOR_ITER_FAST if node.var_name_tok.value in self.code.layout else FOR_ITER)
+        self.visit(node.body_node)
+        self.emit(LOOP_APPEND)
+        self.emit(JUMP, step)
+        end = self.emit(END_LOOP, 0, node)
+        self.patch(setup, end)
+        self.patch(step, end)
+
+    def visit_WhileNode(self, node):
+        setup = self.emit(SETUP_LOOP, 0, node)
+        condition = self.here()
+        self.visit(node.condition_node)
+        done = self.emit(JUMP_IF_FALSE)
+        self.visit(node.body_node)
+        self.emit(LOOP_APPEND)
+        self.emit(JUMP, condition)
+        end = self.emit(END_LOOP, 0, node)
+        self.patch(setup, end)
+        self.patch(done, end)
+
+    def visit_WhenNode(self, node):
+        self.emit(WHEN, 0, node)
+
+    def visit_ContinueNode(self, node):
+        self.emit(CONTINUE, 0, node)
+
+    def visit_BreakNode(self, node):
+        self.emit(BREAK, 0, node)
+
+    def visit_ReturnNode(self, node):
+        if node.return_node:
+            self.visit(node.return_node)
+        self.emit(RETURN, 1 if node.return_node else 0, node)
+
+    # bodies a lazy parse skipped over are compiled when the function is first called
+    def visit_FunctionDefinitionNode(self, node):
+        body = -1
+        if not isinstance(node.body_node, LazyBlockNode):
+            name = node.var_name_tok.value if node.var_name_tok else '<anonymous>'
+            body = self.body(node.body_node, name, [a.value for a in node.arg_name_toks])
+        self.emit(MAKE_FUNCTION, body, node)
+
+    def visit_StructDefinitionNode(self, node):
+        self.emit(MAKE_STRUCT, 0, node)
+
+    # a function held in a variable is called without the copy reading the variable makes
+    def visit_CallNode(self, node):
+        callee = node.node_to_call
+        if isinstance(callee, VarAccessNode):
+            slot = self.code.layout.get(callee.var_name_tok.value)
+            if slot is None:
+                self.emit(LOAD_CALLEE, self.name(callee.var_name_tok.value), callee)
+            else:
+                self.emit(LOAD_CALLEE_FAST, slot, callee)
+        else:
+            self.visit(callee)
+        for a in node.arg_nodes:
+            self.visit(a)
+        self.emit(CALL_NAME if isinstance(callee, VarAccessNode) else CALL, len(node.arg_nodes), node)
+
+    # INLINE_GUARD jumps to the plain call when the variable no longer holds the function
+    def visit_InlineCallNode(self, node):
+        guard = self.emit(INLINE_GUARD, 0, node)
+        for a in node.call.arg_nodes:
+            self.visit(a)
+        self.emit(INLINE_CALL, self.body(node.body, node.name, list(node.arg_names)), node)
+        done = self.emit(JUMP)
+        self.patch(guard, self.here())
+        self.visit(node.call)
+        self.patch(done, self.here())
+
+    # INVARIANT jumps over the expression when the value stored for it can be used
+    def visit_InvariantNode(self, node):
+        check = self.emit(INVARIANT, 0, node)
+        self.visit(node.expr)
+        self.emit(INVARIANT_STORE, 0, node)
+        self.patch(check, self.here())
+
+    # root @ specifier.  A name or a string is the left operand of '@' as in visit_BinOpNode; a
+    # value read by another access must be a list, which LIST_OPERAND checks.  Any other root
+    # reads as nothing, without being run.
+    def visit_ContainerAccessNode(self, node):
+        root = node.root_var
+        if isinstance(root, (ContainerAccessNode, PropertyAccessNode)):
+            self.visit(root)
+            self.emit(LIST_OPERAND, 0, node)
+        elif isinstance(root, VarAccessNode):
+            self.visit(root)
+            check = self.emit(STRUCT_OPERAND, 0, node)
+        elif isinstance(root, StringNode):
+            self.visit(root)
+        else:
+            return self.emit(NONE)
+        self.visit(node.specifier)
+        binary = self.emit(BINARY, self.const('AT'), node)
+        if isinstance(root, VarAccessNode):
+            self.patch(check, binary)
+
+    # root.name, read in the context of the value root gives
+    def visit_PropertyAccessNode(self, node):
+        if not isinstance(node.specifier, VarAccessNode):
+            return self.visit_other(node)
+        self.visit(node.root_var)
+        self.emit(PROPERTY, self.name(node.specifier.var_name_tok.value), node)
+
+    def visit_ReferenceAccessNode(self, node):
+        if not isinstance(node.head, (ContainerAccessNode, PropertyAccessNode)):
+            return self.visit_other(node)
+        # the Interpreter reads the head and keeps its value, dropping an error for nothing
+        reference = self.emit(REFERENCE, 0, node)
+        self.visit(node.head)
+        self.emit(END_REFERENCE)
+        self.patch(reference, self.here())
+
+    def visit_ResetNode(self, node):
+        self.emit(RESET, 0, node)
+        self.visit(node.node)
+
+
+# a listing of code and of the function bodies it holds, one instruction per line: number,
+# opcode, argument and what the argument stands for; >> marks the instructions jumped to
+def disassemble(code):
+    lines = [f'{code.name}:']
+    targets = {code.code[i * 3 + 1] for i in range(len(code)) if code.code[i * 3] in JUMP_ARGS}
+    for i in range(len(code)):
+        op, arg, node = code.code[i * 3:i * 3 + 3]
+        if op in CONST_ARGS: detail = repr(code.consts[arg])
+        elif op in NAME_ARGS: detail = code.names[arg]
+        elif op in SLOT_ARGS: detail = code.slots[arg]
+        elif op in FUNCTION_ARGS: detail = code.functions[arg].name if arg >= 0 else 'lazy body'
+        elif op == STORE: detail = code.nodes[node].var_name_tok.value
+        elif op in (EVAL, WHEN, MAKE_STRUCT): detail = type(code.nodes[node]).__name__
+        else: detail = ''
+        mark = '>>' if i in targets else ''
+        lines.append(f'{mark:>2}{i:>6}  {OPCODES[op]:<16}{arg:>5}  {detail}'.rstrip())
+    seen = set()
+    for function in code.functions:
+        if id(function) not in seen:
+            seen.add(id(function))
+            lines += [''] + disassemble(function).split('\n')
+    return '\n'.join(lines)
@@ -0,0 +1,454 @@
+# An execution engine that compiles each tree node once into a Python closure and runs the
+# closures, in place of Interpreter.visit.  The node's kind and fields are looked at when it is
+# compiled; running it is then a plain call, with no visit_ name to build and look up, and
+# values are returned directly rather than in an RTResult.  Errors, break, continue and return
+# are raised as the signals in interpreter.py and caught by the loop, call or program they stop.
+#
+# The engine computes exactly what Interpreter does: the closures create, copy and position
+# values the same way, and the nodes that are rare or run elsewhere (structs, maps, references,
+# property and container access, use, when) are handed to an Interpreter and their RTResult
+# unwrapped.  Assignments share Interpreter.assign, and when triggers run in the Interpreter.
+#
+# usage: ClosureEngine().run(tree, context) -> RTResult, like Interpreter().visit(tree, context)
+
+from errors import BuiltinViolationError, VariableAccessError
+from interpreter import (BreakSignal, Context, ContinueSignal, ErrorSignal, Function, Interpreter,
+                         ReturnSignal, SymbolTable, settle)
+from lexer import KWDS
+from parser import LazyBlockNode, NumberNode, VarAccessNode
+from quicken import (ARITHMETIC_OPS, DIVISION_OPS, OPERATOR_METHODS, TEST_OPS, apart, derived, fresh,
+                     fresh_list, lent, placed, read_at)
+from typedef import List, Number, String, Struct, kept
+
+
+# the variable name in a symbol table, as SymbolTable.get finds it; nothing stored compares
+# equal to None, so its test of the table's own symbols is an identity test
+def lookup(symbol_table, name):
+    value = symbol_table.symbols.get(name)
+    if value is None and symbol_table.parent:
+        return symbol_table.get(name)
+    return value
+
+
+class ClosureEngine:
+    def __init__(self):
+        # runs the nodes without a closure of their own; its invariants are the stored values
+        # of the function body running at the moment, which the closures share
+        self.walker = Interpreter()
+        self.closures = {}
+
+    def run(self, node, context):
+        return settle(self.compiled(node), context)
+
+    # the closure for node, compiled on first use; function bodies are compiled when first called
+    def compiled(self, node):
+        closure = self.closures.get(node)
+        if closure is None:
+            method = getattr(self, f'compile_{type(node).__name__}', self.compile_other)
+            closure = self.closures[node] = method(node)
+        return closure
+
+    # a node the walker runs
+    def compile_other(self, node):
+        visit = self.walker.visit
+
+        def run(context):
+            return visit(node, context).unwrap()
+        return run
+
+    ###################################
+
+    def compile_NumberNode(self, node):
+        value, t = node.tok.value, node.tok.type
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            return fresh(Number, value, t, context, pos_start, pos_end)
+        return run
+
+    def compile_StringNode(self, node):
+        value = node.tok.value
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            return fresh(String, value, 'STR', context, pos_start, pos_end)
+        return run
+
+    def compile_CapsuleNode(self, node):
+        elements = [self.compiled(el) for el in node.elements]
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            values = [el(context) for el in elements]
+            if len(values) == 1:
+                return values[0].set_context(context).set_pos(pos_start, pos_end)
+            return fresh_list(values, context, pos_start, pos_end)
+        return run
+
+    def compile_ListNode(self, node):
+        elements = [self.compiled(el) for el in node.elements]
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            return fresh_list([kept(el(context)) for el in elements], context, pos_start, pos_end)
+        return run
+
+    def compile_BinOpNode(self, node):
+        left, right = self.compiled(node.left_node), self.compiled(node.right_node)
+        op = node.op_tok.type
+        method = OPERATOR_METHODS.get(op)
+        pos_start, pos_end = node.pos_start, node.pos_end
+        right_node = node.right_node
+
+        # the operation once the left operand is known, as visit_BinOpNode does it
+        def apply(lhs, context):
+            if isinstance(lhs, Struct):
+                try: rhs = right(lhs.context)
+                except VariableAccessError:
+                    raise VariableAccessError(pos_start, pos_end,
+                                              f"Struct has no property '{right_node.var_name_tok}'")
+            else:
+                at = read_at(lhs)
+                rhs = right(context)
+                lhs = apart(lhs, at)
+            if op == 'DOT':
+                return rhs
+            result, error = getattr(lhs, method)(rhs)
+            if error: raise ErrorSignal(error)
+            return result
+
+        # Two Numbers are combined without the Value methods.  An operand that is a variable
+        # holding a Number, or a number literal, is read where it is stored, without the
+        # closure of the variable or the Number of the literal; as a read only moves the value
+        # it lends out, it is read properly only when the fast path turns out not to apply.
+        left_name = node.left_node.var_name_tok.value if isinstance(node.left_node, VarAccessNode) else None
+        left_start, left_end = node.left_node.pos_start, node.left_node.pos_end
+        peek = self.peek_number(node.right_node)
+
+        if op in ARITHMETIC_OPS or op in DIVISION_OPS or op in TEST_OPS:
+            compute = ARITHMETIC_OPS.get(op) or DIVISION_OPS.get(op) or TEST_OPS[op]
+            test = op in TEST_OPS
+            division = op in DIVISION_OPS
+
+            # the operation on an evaluated left operand
+            def combine(lhs, context):
+                if type(lhs) is not Number:
+                    return apply(lhs, context)
+                b = peek(context) if peek else None
+                if b is None or division and b == 0:
+                    at = read_at(lhs)
+                    rhs = right(context)
+                    lhs = apart(lhs, at)
+                    if type(rhs) is not Number or division and rhs.value == 0:
+                        result, error = getattr(lhs, method)(rhs)
+                        if error: raise ErrorSignal(error)
+                        return result
+                    b = rhs.value
+                if test:
+                    return fresh(Number, int(compute(lhs.value, b)), 'INT', lhs.context)
+                return derived(lhs, compute(lhs.value, b))
+
+            def run(context):
+                if left_name is not None and not context.display_name.startswith('struct'):
+                    stored = lookup(context.symbol_table, left_name)
+                    if type(stored) is Number:
+                        b = peek(context) if peek else None
+                        if b is None or division and b == 0:
+                            return combine(lent(stored, context, left_start, left_end), context)
+                        if test:
+                            return fresh(Number, int(compute(stored.value, b)), 'INT', context)
+                        return fresh(Number, compute(stored.value, b), 'INT', context, left_start, left_end,
+                                     stored.static, stored.const, stored.triggers)
+                return combine(left(context), context)
+            return run
+
+        def run(context):
+            return apply(left(context), context)
+        return run
+
+    # a function giving the Python number node evaluates to, read without making a Number, or
+    # None when it is not a Number or cannot be read that way; None for nodes it cannot read
+    def peek_number(self, node):
+        if isinstance(node, NumberNode):
+            value = node.tok.value
+            return lambda context: value
+        if isinstance(node, VarAccessNode):
+            name = node.var_name_tok.value
+
+            def peek(context):
+                value = lookup(context.symbol_table, name)
+                if type(value) is Number and not context.display_name.startswith('struct'):
+                    return value.value
+                return None
+            return peek
+        return None
+
+    def compile_UnaryOpNode(self, node):
+        operand = self.compiled(node.node)
+        op = node.op_tok.type
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            number = operand(context)
+            if type(number) is Number:
+                if op == 'MNS':
+                    return derived(number, number.value * -1).set_pos(pos_start, pos_end)
+                if op == 'NOT':
+                    return fresh(Number, 1 if number.value == 0 else 0, 'INT', number.context,
+                                 pos_start, pos_end)
+            error = None
+            if op == 'MNS':
+                number, error = number.mul(Number(-1))
+            if op == 'NOT':
+                number, error = number.lognot(Number(-1))
+            if error: raise ErrorSignal(error)
+            return number.set_pos(pos_start, pos_end)
+        return run
+
+    def compile_VarAccessNode(self, node):
+        var_name = node.var_name_tok.value
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            value = lookup(context.symbol_table, var_name)
+            if value is None:
+                raise VariableAccessError(pos_start, pos_end, f"'{var_name}' is not defined")
+            if isinstance(value, Struct):
+                return value.copy().set_pos(pos_start, pos_end)
+            if context.display_name.startswith('struct'):
+                return value.set_pos(pos_start, pos_end)
+            return lent(value, context, pos_start, pos_end)
+        return run
+
+    def compile_VarAssignNode(self, node):
+        value_of = self.compiled(node.value_node)
+        assign = self.walker.assign
+        var_name = node.var_name_tok.value
+        keyword = var_name in KWDS + ['T', 'F']
+        plain = node.op_tok.value == '=' and node.statictype == 'default' and not node.const
+
+        def run(context):
+            if keyword:
+                raise BuiltinViolationError(node.pos_start, node.pos_end,
+                                            f'Cannot overwrite keyword {var_name}.')
+            value = kept(value_of(context))
+            if plain and not isinstance(value, Struct):
+                # what assign does to create a variable, or to replace one that is neither
+                # static nor constant and has no triggers, with a value that is not a struct
+                symbol_table = context.symbol_table
+                og_val = lookup(symbol_table, var_name)
+                if og_val is None:
+                    value.static = True if symbol_table.get('static-typing').is_true() else False
+                    symbol_table.symbols[var_name] = value
+                    return value
+                if not og_val.static and not og_val.const and not og_val.triggers:
+                    if 'static-typing' not in symbol_table.symbols:
+                        # fails as assign does in a table that cannot see the setting
+                        symbol_table.get('static-typing').is_true()
+                    value.const = og_val.const
+                    value.triggers = og_val.triggers
+                    symbol_table.symbols[var_name] = value
+                    return value
+            return assign(node, value, context).unwrap()
+        return run
+
+    def compile_IfNode(self, node):
+        cases = [(self.compiled(condition), self.compiled(expr)) for condition, expr, ret in node.cases]
+        else_case = self.compiled(node.else_case[0]) if node.else_case else None
+
+        def run(context):
+            for condition, expr in cases:
+                if condition(context).is_true():
+                    return expr(context)
+            if else_case:
+                return else_case(context)
+            return None
+        return run
+
+    def compile_ForNode(self, node):
+        start_of, end_of = self.compiled(node.start_value_node), self.compiled(node.end_value_node)
+        step_of = self.compiled(node.step_value_node) if node.step_value_node else None
+        body = self.compiled(node.body_node)
+        var_name = node.var_name_tok.value
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            elements = []
+            start_value = start_of(context)
+            end_value = end_of(context)
+            if step_of:
+                step_value = step_of(context)
+            elif start_value.value < end_value.value: step_value = Number(1)
+            else: step_value = Number(-1)
+
+            i = start_value.value
+            forwards = step_value.value >= 0
+            symbols = context.symbol_table
+            while i < end_value.value if forwards else i > end_value.value:
+                symbols.set(var_name, fresh(Number, i, 'INT', None))
+                i += step_value.value
+                try:
+                    result = body(context)
+                except ContinueSignal:
+                    continue
+                except BreakSignal:
+                    break
+                elements.append(result)
+            return fresh_list(elements, context, pos_start, pos_end)
+        return run
+
+    def compile_WhileNode(self, node):
+        condition, body = self.compiled(node.condition_node), self.compiled(node.body_node)
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            elements = []
+            while condition(context).is_true():
+                try:
+                    result = body(context)
+                except ContinueSignal:
+                    continue
+                except BreakSignal:
+                    break
+                elements.append(result)
+            return fresh_list(elements, context, pos_start, pos_end)
+        return run
+
+    def compile_ContinueNode(self, node):
+        def run(context):
+            raise ContinueSignal()
+        return run
+
+    def compile_BreakNode(self, node):
+        def run(context):
+            raise BreakSignal()
+        return run
+
+    # a return whose value is nothing (an if without else) returns nothing, and running goes on
+    def compile_ReturnNode(self, node):
+        if not node.return_node:
+            def run(context):
+                raise ReturnSignal(Number.null)
+            return run
+        value_of = self.compiled(node.return_node)
+
+        def run(context):
+            value = value_of(context)
+            if value is None:
+                return None
+            raise ReturnSignal(value)
+        return run
+
+    def compile_FunctionDefinitionNode(self, node):
+        func_name = node.var_name_tok.value if node.var_name_tok else None
+        body_node = node.body_node
+        arg_names = [a.value for a in node.arg_name_toks]
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            func_val = Function(func_name, body_node, arg_names, node.auto_return) \
+                .set_context(context).set_pos(pos_start, pos_end)
+            if func_name:
+                context.symbol_table.set(func_name, func_val)
+            return func_val
+        return run
+
+    def compile_CallNode(self, node):
+        callee_of = self.compiled(node.node_to_call)
+        callee_name = node.node_to_call.var_name_tok.value if isinstance(node.node_to_call, VarAccessNode) else None
+        args_of = [self.compiled(a) for a in node.arg_nodes]
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            function = None
+            if callee_name is not None and not context.display_name.startswith('struct'):
+                function = lookup(context.symbol_table, callee_name)
+            if type(function) is Function:
+                # one copy in place of the one reading the variable makes and the one made here
+                value_to_call = function.copy().set_context(context).set_pos(pos_start, pos_end)
+            else:
+                value_to_call = callee_of(context).copy().set_pos(pos_start, pos_end)
+            args = [a(context) for a in args_of]
+            if type(value_to_call) is Function:
+                retval = self.call(value_to_call, args)
+            else:
+                retval = value_to_call.execute(args).unwrap()
+            if isinstance(retval, Struct):
+                return retval.copy().set_pos(pos_start, pos_end)
+            return placed(retval, context, pos_start, pos_end)
+        return run
+
+    # Function.execute, with the body run by its closure
+    def call(self, function, args):
+        exec_ctx = Context(function.name, function.context, function.pos_start)
+        exec_ctx.symbol_table = SymbolTable(function.context.symbol_table)
+        if len(args) != len(function.arg_names):
+            function.check_args(function.arg_names, args).unwrap()
+        function.populate_args(function.arg_names, args, exec_ctx)
+        body = function.body_node
+        if isinstance(body, LazyBlockNode):
+            body = function.load_body().unwrap()
+        body = self.compiled(body)
+
+        walker = self.walker
+        invariants, walker.invariants = walker.invariants, {}
+        value = return_value = None
+        try:
+            value = body(exec_ctx)
+        except ReturnSignal as signal:
+            return_value = signal.value
+        finally:
+            walker.invariants = invariants
+        return (value if function.auto_return else None) or return_value or Number.null
+
+    def compile_InlineCallNode(self, node):
+        call = self.compiled(node.call)
+        args_of = [self.compiled(a) for a in node.call.arg_nodes]
+        body = self.compiled(node.body)
+        name, arg_names, body_node = node.name, node.arg_names, node.body
+        pos_start, pos_end = node.pos_start, node.pos_end
+
+        def run(context):
+            function = context.symbol_table.get(name)
+            if type(function) is not Function or function.body_node is not body_node or \
+                    context.display_name.startswith('struct'):
+                return call(context)
+            args = [a(context) for a in args_of]
+            exec_ctx = Context(function.name, context, pos_start)
+            exec_ctx.symbol_table = SymbolTable(context.symbol_table)
+            function.populate_args(arg_names, args, exec_ctx)
+            retval = body(exec_ctx) or Number.null
+            if isinstance(retval, Struct):
+                return retval.copy().set_pos(pos_start, pos_end)
+            return placed(retval, context, pos_start, pos_end)
+        return run
+
+    def compile_InvariantNode(self, node):
+        expr = self.compiled(node.expr)
+        walker, key = self.walker, node.key
+
+        def run(context):
+            stored = walker.invariants.get(key)
+            in_struct = context.display_name.startswith('struct')
+            if stored is None or stored[1] != Interpreter.trigger_epoch or in_struct:
+                value = expr(context)
+                if isinstance(value, (Number, String)) and not in_struct:
+                    walker.invariants[key] = (value.copy(), Interpreter.trigger_epoch)
+                return value
+            value = stored[0].copy()
+            if value.pos_start is not None:
+                value.set_pos(node.anchor.pos_start, node.anchor.pos_end)
+            if not node.shared or not isinstance(value, Number):
+                value.triggers = []
+            return value
+        return run
+
+    def compile_ResetNode(self, node):
+        inner = self.compiled(node.node)
+        walker, keys = self.walker, node.keys
+
+        def run(context):
+            for key in keys:
+                walker.invariants.pop(key, None)
+            return inner(context)
+        return run
@@ -0,0 +1,246 @@
+# The Interpreter with values returned directly.  Each visit_ method of Interpreter makes an
+# RTResult, copies the five fields of each child's RTResult into it with register and tests
+# them with should_return; for a node that only computes a value this wrapping costs more than
+# the value.  A DirectInterpreter's eval_ methods return the value itself, and raise errors,
+# break, continue and return as the signals in interpreter.py, caught by the loop, call or
+# program they stop.  A node that computes a value allocates nothing for its control flow, and
+# the method for a node is found by its class in a dictionary rather than by building its name.
+#
+# The eval_ methods are the visit_ methods without the RTResult: they make, copy and position
+# values the same way, in the same order.  The nodes that are rare or run elsewhere (structs,
+# maps, references, property and container access, use, when) run in the visit_ methods
+# inherited from Interpreter, for which visit wraps a child's eval_ in an RTResult again.
+#
+# usage: DirectInterpreter().run(tree, context) -> RTResult, like Interpreter().visit(tree,
+# context); the shell runs programs this way with engine = 3
+
+from errors import BuiltinViolationError, VariableAccessError
+from interpreter import (BreakSignal, Context, ContinueSignal, ErrorSignal, Function, Interpreter,
+                         ReturnSignal, SymbolTable, settle)
+from lexer import KWDS
+from quicken import apart, lent, placed, read_at
+from typedef import List, Number, String, Struct, kept
+
+class DirectInterpreter(Interpreter):
+    # node class -> the method that evaluates it
+    methods = {}
+
+    def run(self, node, context):
+        return settle(self.evaluate, node, context)
+
+    # the RTResult of node, for the visit_ methods inherited and whoever else visits
+    def visit(self, node, context):
+        return settle(self.evaluate, node, context)
+
+    # the value of node; anything else is raised as a signal
+    def evaluate(self, node, context):
+        method = self.methods.get(type(node))
+        if method is None:
+            method = self.methods[type(node)] = self.method(type(node))
+        return method(self, node, context)
+
+    @staticmethod
+    def method(cls):
+        method = getattr(DirectInterpreter, f'eval_{cls.__name__}', None)
+        if method is not None:
+            return method
+        visit = getattr(Interpreter, f'visit_{cls.__name__}', Interpreter.no_visit_method)
+        return lambda self, node, context: visit(self, node, context).unwrap()
+
+    ###################################
+
+    def eval_NumberNode(self, node, context):
+        return Number(node.tok.value, t=node.tok.type).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_StringNode(self, node, context):
+        return String(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_CapsuleNode(self, node, context):
+        elements = [self.evaluate(el, context) for el in node.elements]
+        if len(elements) == 1:
+            return elements[0].set_context(context).set_pos(node.pos_start, node.pos_end)
+        return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_ListNode(self, node, context):
+        elements = [kept(self.evaluate(el, context)) for el in node.elements]
+        return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_BinOpNode(self, node, context):
+        # the list a nested container access has read already stands in for its node
+        left = node.left_node
+        if not isinstance(left, List):
+            left = self.evaluate(left, context)
+        if isinstance(left, Struct):
+            try: right = self.evaluate(node.right_node, left.context)
+            except VariableAccessError:
+                raise VariableAccessError(node.pos_start, node.pos_end,
+                                          f"Struct has no property '{node.right_node.var_name_tok}'")
+        else:
+            at = read_at(left)
+            right = self.evaluate(node.right_node, context)
+            left = apart(left, at)
+
+        result, error = self.operate(node, left, right)
+        if error: raise ErrorSignal(error)
+        return result
+
+    def eval_UnaryOpNode(self, node, context):
+        number = self.evaluate(node.node, context)
+        error = None
+        if node.op_tok.type == 'MNS':
+            number, error = number.mul(Number(-1))
+        if node.op_tok.type == 'NOT':
+            number, error = number.lognot(Number(-1))
+        if error: raise ErrorSignal(error)
+        return number.set_pos(node.pos_start, node.pos_end)
+
+    def eval_VarAccessNode(self, node, context):
+        var_name = node.var_name_tok.value
+        value = context.symbol_table.get(var_name)
+        if not value:
+            raise VariableAccessError(node.pos_start, node.pos_end,
+                                      f"'{var_name}' is not defined")
+
+        if isinstance(value, Struct):
+            return value.copy().set_pos(node.pos_start, node.pos_end)
+        if context.display_name.startswith('struct'):
+            return value.set_pos(node.pos_start, node.pos_end)
+        return lent(value, context, node.pos_start, node.pos_end)
+
+    def eval_VarAssignNode(self, node, context):
+        var_name = node.var_name_tok.value
+        if var_name in KWDS + ['T', 'F']:
+            raise BuiltinViolationError(node.pos_start, node.pos_end,
+                                        f'Cannot overwrite keyword {var_name}.')
+        value = self.evaluate(node.value_node, context)
+        return self.assign(node, value, context).unwrap()
+
+    def eval_IfNode(self, node, context):
+        for condition, expr, ret in node.cases:
+            if self.evaluate(condition, context).is_true():
+                return self.evaluate(expr, context)
+        if node.else_case:
+            return self.evaluate(node.else_case[0], context)
+        return None
+
+    def eval_ForNode(self, node, context):
+        elements = []
+        start_value = self.evaluate(node.start_value_node, context)
+        end_value = self.evaluate(node.end_value_node, context)
+        if node.step_value_node:
+            step_value = self.evaluate(node.step_value_node, context)
+        elif start_value.value < end_value.value: step_value = Number(1)
+        else: step_value = Number(-1)
+
+        i = start_value.value
+        forwards = step_value.value >= 0
+        while i < end_value.value if forwards else i > end_value.value:
+            context.symbol_table.set(node.var_name_tok.value, Number(i))
+            i += step_value.value
+            try:
+                result = self.evaluate(node.body_node, context)
+            except ContinueSignal:
+                continue
+            except BreakSignal:
+                break
+            elements.append(result)
+
+        return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_WhileNode(self, node, context):
+        elements = []
+        while self.evaluate(node.condition_node, context).is_true():
+            try:
+                result = self.evaluate(node.body_node, context)
+            except ContinueSignal:
+                continue
+            except BreakSignal:
+                break
+            elements.append(result)
+
+        return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+    def eval_InvariantNode(self, node, context):
+        stored = self.invariants.get(node.key)
+        if stored is None or stored[1] != Interpreter.trigger_epoch or context.display_name.startswith('struct'):
+            value = self.evaluate(node.expr, context)
+            # lists may be changed in place, so only numbers and strings are kept
+            if isinstance(value, (Number, String)) and not context.display_name.startswith('struct'):
+                self.invariants[node.key] = (value.copy(), Interpreter.trigger_epoch)
+            return value
+
+        value = stored[0].copy()
+        if value.pos_start is not None:
+            value.set_pos(node.anchor.pos_start, node.anchor.pos_end)
+        if not node.shared or not isinstance(value, Number):
+            value.triggers = []
+        return value
+
+    def eval_ResetNode(self, node, context):
+        for key in node.keys:
+            self.invariants.pop(key, None)
+        return self.evaluate(node.node, context)
+
+    def eval_ContinueNode(self, node, context):
+        raise ContinueSignal()
+
+    def eval_BreakNode(self, node, context):
+        raise BreakSignal()
+
+    # a return whose value is nothing (an if without else) returns nothing, and running goes on
+    def eval_ReturnNode(self, node, context):
+        if not node.return_node:
+            raise ReturnSignal(Number.null)
+        value = self.evaluate(node.return_node, context)
+        if value is None:
+            return None
+        raise ReturnSignal(value)
+
+    def eval_FunctionDefinitionNode(self, node, context):
+        func_name = node.var_name_tok.value if node.var_name_tok else None
+        arg_names = [a.value for a in node.arg_name_toks]
+        func_val = Function(func_name, node.body_node, arg_names, node.auto_return) \
+            .set_context(context).set_pos(node.pos_start, node.pos_end)
+        if node.var_name_tok:
+            context.symbol_table.set(func_name, func_val)
+        return func_val
+
+    def eval_CallNode(self, node, context):
+        value_to_call = self.evaluate(node.node_to_call, context).copy().set_pos(node.pos_start, node.pos_end)
+        args = [self.evaluate(a, context) for a in node.arg_nodes]
+        if type(value_to_call) is Function:
+            retval = self.call(value_to_call, args)
+        else:
+            retval = value_to_call.execute(args).unwrap()
+
+        if isinstance(retval, Struct):
+            return retval.copy().set_pos(node.pos_start, node.pos_end)
+        return placed(retval, context, node.pos_start, node.pos_end)
+
+    # Function.execute, with the body evaluated directly by a DirectInterpreter of its own
+    def call(self, function, args):
+        exec_ctx = function.generate_new_context()
+        function.check_and_populate_args(function.arg_names, args, exec_ctx).unwrap()
+        body_node = function.load_body().unwrap()
+        value = return_value = None
+        try:
+            value = DirectInterpreter().evaluate(body_node, exec_ctx)
+        except ReturnSignal as signal:
+            return_value = signal.value
+        return (value if function.auto_return else None) or return_value or Number.null
+
+    def eval_InlineCallNode(self, node, context):
+        function = context.symbol_table.get(node.name)
+        if type(function) is not Function or function.body_node is not node.body or \
+                context.display_name.startswith('struct'):
+            return self.evaluate(node.call, context)
+
+        args = [self.evaluate(a, context) for a in node.call.arg_nodes]
+        exec_ctx = Context(function.name, context, node.pos_start)
+        exec_ctx.symbol_table = SymbolTable(context.symbol_table)
+        function.populate_args(node.arg_names, args, exec_ctx)
+
+        retval = self.evaluate(node.body, exec_ctx) or Number.null
+        if isinstance(retval, Struct):
+            return retval.copy().set_pos(node.pos_start, node.pos_end)
+        return placed(retval, context, node.pos_start, node.pos_end)
@@ -9,15 +9,17 @@ class SyntaxError(Exception):
         self.details = details
 
     def __repr__(self):
-        mystr = f'{self.error_name}: {self.details}\n'
-        mystr += f'  File {self.pos_start.fn}, line {self.pos_start.ln + 1}, col {self.pos_end.col}'
-        mystr += '\n  ~>   ' + self.pos_start.ftxt
-        mystr += '\n       ' + ' ' * self.pos_start.col
-        mystr += '^' * (self.pos_end.col - self.pos_start.col)
-        return mystr
+        return self.render()
 
     def __str__(self):
+        return self.render()
+
+    # line, column and line text are only looked up here, so tokens can keep bare offsets
+    def render(self):
         mystr = f'{self.error_name}: {self.details}\n'
+        if self.pos_start.ln < 0:
+            # source positions were stripped from the token stream
+            return mystr + '  (no debug info)'
         mystr += f'  File {self.pos_start.fn}, line {self.pos_start.ln + 1}, col {self.pos_end.col}'
         mystr += '\n  ~>   ' + self.pos_start.ftxt
         mystr += '\n       ' + ' ' * self.pos_start.col
@@ -82,12 +84,12 @@ class RuntimeError(SyntaxError):
 
     def __str__(self):
         mystr = self.generate_traceback()
-        mystr += super().__str__()
+        mystr += self.render()
         return mystr
 
     def __repr__(self):
         mystr = self.generate_traceback()
-        mystr += super().__str__()
+        mystr += self.render()
         return mystr
 
     def generate_traceback(self):
@@ -96,7 +98,8 @@ class RuntimeError(SyntaxError):
         ctx = self.context
 
         while ctx:
-            result = f'  File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}\n' + result
+            line = pos.ln + 1 if pos.ln >= 0 else '?'
+            result = f'  File {pos.fn}, line {line}, in {ctx.display_name}\n' + result
             pos = ctx.parent_entry_pos
             ctx = ctx.parent
 
@@ -0,0 +1,224 @@
+# Type feedback kept across runs of a program.  While foo.sfr runs tiered (see tiering.py), its
+# Profile counts the back edges of each loop and the calls of each function body, and records
+# each specialized site: how often it ran specialized, and what was met there (the classes of
+# the operands of arithmetic computed on Python numbers, the functions a direct call found).
+# The profile is written to __sfrcache__/foo.sfp together with the hash of the source and the
+# optimization level, and the next run of the unchanged program starts from it: loops and
+# bodies that were hot in earlier runs are compiled the first time they are met, sites that
+# met more than one kind of value are compiled without speculating, and code that kept
+# deoptimizing stays interpreted.  A stale or unreadable profile is ignored and replaced.
+#
+# Nodes are known by their class and source offsets, so only nodes of the program's own file
+# are profiled, and a program run with debug = 0 keeps no profile.
+#
+# usage: python feedback.py [-n count] file.sfr...  prints the hottest specialized sites
+
+import argparse
+import marshal
+import os
+import sys
+
+from astcache import CACHE_DIR, source_hash
+from interpreter import Function
+from lexer import Source
+
+PROFILE_MAGIC = b'SFRFB'
+# bump whenever what the keys or records hold changes
+PROFILE_VERSION = 1
+
+
+def profile_path(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, CACHE_DIR, os.path.splitext(name)[0] + '.sfp')
+
+
+def header(digest, level):
+    return PROFILE_MAGIC + bytes([PROFILE_VERSION, marshal.version, level]) + digest
+
+
+class Profile:
+    def __init__(self, source, digest, level):
+        # the Source of the program's nodes
+        self.source = source
+        self.digest = digest
+        self.level = level
+        # loop or body key -> back edges or calls counted over all runs
+        self.counts = {}
+        # keys of the loops and bodies that deoptimized too often to be compiled again
+        self.given_up = set()
+        # specialized site key -> [runs specialized, descriptions of what was met there]
+        self.sites = {}
+        # node -> its key, None for nodes from elsewhere
+        self.keys = {}
+
+    def key(self, node):
+        key = self.keys.get(node, 0)
+        if key == 0:
+            start, end = node.pos_start, node.pos_end
+            if start is None or end is None or start.source is not self.source:
+                key = None
+            else:
+                key = (type(node).__name__, start.idx, end.idx)
+            self.keys[node] = key
+        return key
+
+    # one more back edge or call of the loop or body node; the number counted in this run and
+    # the earlier ones
+    def count(self, node):
+        key = self.key(node)
+        if key is None:
+            return 0
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        return count
+
+    def give_up(self, node):
+        key = self.key(node)
+        if key is not None:
+            self.given_up.add(key)
+
+    def gave_up(self, node):
+        return self.key(node) in self.given_up
+
+    # whether the site node met nothing but what description describes in earlier runs
+    def stable(self, node, description):
+        record = self.sites.get(self.key(node))
+        return record is None or record[1] <= {description}
+
+    # the record of the specialized site node, which is counted in its first element
+    def site(self, node, description):
+        key = self.key(node)
+        if key is None:
+            return None
+        record = self.sites.get(key)
+        if record is None:
+            record = self.sites[key] = [0, set()]
+        record[1].add(description)
+        return record
+
+    # what a site met: a function by its name and the offset of its body, anything else by
+    # its class
+    def describe(self, value):
+        if type(value) is Function:
+            start = value.body_node.pos_start
+            if start is not None and start.source is self.source:
+                return f'{value.name}@{start.idx}'
+            return value.name
+        return type(value).__name__
+
+
+# the profile of the .sfr file at path, run as tree at optimization level, as earlier runs left
+# it; None when tree has no positions to know its nodes by
+def load_profile(path, tree, level):
+    start = tree.pos_start
+    if start is None or start.source is None or not os.path.exists(path):
+        return None
+    profile = Profile(start.source, source_hash(path), level)
+    try:
+        with open(profile_path(path), 'rb') as f:
+            data = f.read()
+        head = header(profile.digest, level)
+        if data.startswith(head):
+            stored = marshal.loads(data[len(head):])
+            if well_formed(stored):
+                profile.counts, given_up, profile.sites = stored
+                profile.given_up = set(given_up)
+    except (OSError, EOFError, ValueError, TypeError):
+        # missing, stale, truncated or otherwise corrupt: start a new profile
+        pass
+    return profile
+
+
+# whether stored, as read back from a profile file, is what save_profile writes: the counts
+# of loops and bodies, the keys given up on, and the records of the sites by key
+def well_formed(stored):
+    if not isinstance(stored, tuple) or len(stored) != 3:
+        return False
+    counts, given_up, sites = stored
+    return isinstance(counts, dict) and isinstance(given_up, list) and isinstance(sites, dict) and \
+        all(isinstance(count, int) for count in counts.values()) and \
+        all(isinstance(key, tuple) and len(key) == 3 and isinstance(record, list) and len(record) == 2 and
+            isinstance(record[0], int) and isinstance(record[1], set) for key, record in sites.items())
+
+
+# store a profile, as write_cache in astcache.py stores a tree
+def save_profile(path, profile):
+    target = profile_path(path)
+    temp = f'{target}.{os.getpid()}.tmp'
+    try:
+        data = header(profile.digest, profile.level) + \
+            marshal.dumps((profile.counts, list(profile.given_up), profile.sites))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, target)
+    except (OSError, ValueError):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# the stored sites of the .sfr file at path, hottest first, as (runs, key, descriptions), and
+# whether the profile is of the source as it is; None without a profile
+def hottest_sites(path):
+    try:
+        with open(profile_path(path), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    head = PROFILE_MAGIC + bytes([PROFILE_VERSION, marshal.version])
+    if not data.startswith(head):
+        return None
+    digest = data[len(head) + 1:len(head) + 33]
+    try:
+        stored = marshal.loads(data[len(head) + 33:])
+    except (EOFError, ValueError, TypeError):
+        # truncated or otherwise corrupt
+        return None
+    if not well_formed(stored):
+        return None
+    counts, given_up, sites = stored
+    current = os.path.exists(path) and source_hash(path) == digest
+    return sorted(((runs, key, seen) for key, (runs, seen) in sites.items()), reverse=True), current
+
+
+def main(argv):
+    args = argparse.ArgumentParser(description='Print the hottest specialized sites recorded for '
+                                               'each .sfr file.')
+    args.add_argument('files', nargs='+')
+    args.add_argument('-n', dest='count', type=int, default=20,
+                      help='sites to print per file (default %(default)s)')
+    args = args.parse_args(argv)
+
+    for path in args.files:
+        found = hottest_sites(path)
+        if found is None:
+            print(f'{path}: no profile')
+            continue
+        sites, current = found
+        if not current:
+            print(f'{path}: profile of an earlier version of the source, offsets shown')
+        source = None
+        if current:
+            with open(path) as f:
+                source = Source(f.read())
+        print(f'{path}: {len(sites)} specialized sites')
+        for runs, (kind, start, end), seen in sites[:args.count]:
+            if source:
+                place = f'{source.line_of(start) + 1}:{source.column_of(start) + 1}'
+                text = ' '.join(source.text[start:end].split())
+            else:
+                place, text = f'@{start}', ''
+            if len(text) > 40:
+                text = text[:37] + '...'
+            met = []
+            for description in sorted(seen):
+                name, _, offset = description.partition('@')
+                if offset and source:
+                    name += f' (line {source.line_of(int(offset)) + 1})'
+                met.append(name)
+            state = 'specialized' if len(seen) == 1 else 'generic'
+            print(f'{runs:>12}  {place:<8} {kind:<12} {text:<40}  {state}: {", ".join(met)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
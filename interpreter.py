@@ -1,11 +1,20 @@
 from lexer import KWDS, Lexer
 from parser import (Parser, VarAssignNode, ContainerAccessNode,
                     PropertyAccessNode, ListNode, StringNode,
-                    VarAccessNode, NumberNode, BinOpNode, Token)
+                    VarAccessNode, NumberNode, BinOpNode, LazyBlockNode, Token)
 from typedef import *
+from astcache import parse_file
+from optimizer import optimize
+from quicken import GENERIC, apart, lent, placed, quicken, read_at
+from sfc import load_sfc
 from errors import *
 
+import itertools
 import os
+import weakref
+
+# the operator of the BinOpNodes made to index a value on each container access
+AT = Token('AT', '@')
 
 
 # wrapper class to pass meta information between AST nodes
@@ -61,6 +70,55 @@ class RTResult:
                 self.loop_should_break
         )
 
+    # the value, for an engine that passes values on directly: anything else the result
+    # carries is raised as the matching signal
+    def unwrap(self):
+        if self.error: raise ErrorSignal(self.error)
+        if self.func_return_value: raise ReturnSignal(self.func_return_value)
+        if self.loop_should_continue: raise ContinueSignal()
+        if self.loop_should_break: raise BreakSignal()
+        return self.value
+
+
+# Signals raised instead of returning an RTResult that stops what encloses it.  An engine that
+# returns values directly raises them where the node causing them runs, and loops, calls and
+# the top of the program catch them.
+class ControlSignal(Exception):
+    pass
+
+
+class BreakSignal(ControlSignal):
+    pass
+
+
+class ContinueSignal(ControlSignal):
+    pass
+
+
+class ReturnSignal(ControlSignal):
+    def __init__(self, value):
+        self.value = value
+
+
+class ErrorSignal(ControlSignal):
+    def __init__(self, error):
+        self.error = error
+
+
+# the RTResult of func(*args), a function that returns a value or raises a signal
+def settle(func, *args):
+    res = RTResult()
+    try:
+        return res.success(func(*args))
+    except ErrorSignal as signal:
+        return res.failure(signal.error)
+    except ReturnSignal as signal:
+        return res.success_return(signal.value)
+    except ContinueSignal:
+        return res.success_continue()
+    except BreakSignal:
+        return res.success_break()
+
 # base class for all functions
 # handles function name, generating new execution context for tracebacks,
 # verifying arguments
@@ -97,7 +155,7 @@ class BaseFunction(Value):
     def populate_args(self, arg_names, args, exec_ctx):
         for i in range(len(args)):
             arg_name = arg_names[i]
-            arg_value = args[i]
+            arg_value = kept(args[i])
             if not isinstance(arg_value, Struct):
                 arg_value.set_context(exec_ctx)
                 exec_ctx.symbol_table.set(arg_name, arg_value)
@@ -111,6 +169,15 @@ class BaseFunction(Value):
         self.populate_args(arg_names, args, exec_ctx)
         return res.success(None)
 
+    # the body to run; one a lazy parse skipped over is parsed here, on the first call
+    def load_body(self):
+        res = RTResult()
+        if isinstance(self.body_node, LazyBlockNode):
+            body = self.body_node.parse()
+            if body.error: return res.failure(body.error)
+            self.body_node = body.node
+        return res.success(self.body_node)
+
 
 class Function(BaseFunction):
     def __init__(self, name, body_node, arg_names, auto_return):
@@ -127,7 +194,14 @@ class Function(BaseFunction):
         res.register(self.check_and_populate_args(self.arg_names, args, exec_ctx))
         if res.should_return(): return res
 
-        value = res.register(interpreter.visit(self.body_node, exec_ctx))
+        body_node = res.register(self.load_body())
+        if res.should_return(): return res
+
+        tiers = Interpreter.tiering
+        if tiers:
+            value = res.register(tiers.run_body(interpreter, body_node, exec_ctx))
+        else:
+            value = res.register(interpreter.visit(body_node, exec_ctx))
         if res.should_return() and res.func_return_value is None: return res
 
         retval = (value if self.auto_return else None) or res.func_return_value or Number.null
@@ -164,8 +238,11 @@ class StructGenerator(BaseFunction):
         res.register(self.check_and_populate_args(self.arg_names, args, exec_ctx))
         if res.should_return(): return res
 
-        names = [el.var_name_tok.value for el in self.body_node.elements if isinstance(el, VarAssignNode)]
-        value = res.register(interpreter.visit(self.body_node, exec_ctx))
+        body_node = res.register(self.load_body())
+        if res.should_return(): return res
+
+        names = [el.var_name_tok.value for el in body_node.elements if isinstance(el, VarAssignNode)]
+        value = res.register(interpreter.visit(body_node, exec_ctx))
         properties = {name: exec_ctx.symbol_table.get(name) for name in names}
 
         if res.should_return() and res.func_return_value is None: return res
@@ -214,6 +291,14 @@ class BuiltInFunction(BaseFunction):
     def no_visit_method(self, node, context):
         raise Exception(f'No execute_{self.name} method defined')
 
+    # built-in functions are given the values themselves, as APPEND and the like change the
+    # list passed to them
+    def populate_args(self, arg_names, args, exec_ctx):
+        for arg_name, arg_value in zip(arg_names, args):
+            if not isinstance(arg_value, Struct):
+                arg_value.set_context(exec_ctx)
+            exec_ctx.symbol_table.set(arg_name, arg_value)
+
     def copy(self):
         copy = BuiltInFunction(self.name)
         copy.set_context(self.context)
@@ -295,7 +380,8 @@ class BuiltInFunction(BaseFunction):
                 exec_ctx
             ))
 
-        list_.elements.append(value)
+        list_.unshare()
+        list_.elements.append(kept(value))
         return RTResult().success(Number(0))
 
     execute_append.arg_names = ["list", "value"]
@@ -318,6 +404,7 @@ class BuiltInFunction(BaseFunction):
                 exec_ctx
             ))
 
+        list_.unshare()
         try:
             element = list_.elements.pop(index.value)
         except:
@@ -326,6 +413,9 @@ class BuiltInFunction(BaseFunction):
                 'Element at this index could not be removed from list because index is out of bounds',
                 exec_ctx
             ))
+        # held by the lists list_ was copied from too, if it shared its elements with them
+        if element is not None:
+            element.shared = True
         return RTResult().success(element)
 
     execute_pop.arg_names = ["list", "index"]
@@ -348,7 +438,10 @@ class BuiltInFunction(BaseFunction):
                 exec_ctx
             ))
 
+        listA.unshare()
         listA.elements.extend(listB.elements)
+        # the elements of listB are listA's too now
+        listB.mark = None
         return RTResult().success(Number(0))
 
     execute_extend.arg_names = ["listA", "listB"]
@@ -369,22 +462,44 @@ BuiltInFunction.extend = BuiltInFunction("extend")
 
 
 class SymbolTable:
+    # globals as a set, and its version: each assignment of globals takes a new one, so a cache
+    # of which names a table shows the tables below it holds for as long as its version does
+    # (see vm.py).  Tables without globals share the first.
+    global_names = frozenset()
+    version = 0
+    versions = itertools.count(1)
+
     def __init__(self, parent=None):
         self.symbols = {}
         self.parent = parent
-        self.globals = []
+        self._globals = []
+
+    # the names of this table the tables below it see; assigned, never changed in place
+    @property
+    def globals(self):
+        return self._globals
+
+    @globals.setter
+    def globals(self, names):
+        self._globals = names
+        self.global_names = frozenset(names)
+        self.version = next(SymbolTable.versions)
 
     def get(self, name):
         value = self.symbols.get(name, None)
         if value == None and self.parent:
             # return self.parent.get(name)
-            if name in self.parent.globals:
+            if name in self.parent.global_names:
                 return self.parent.get(name)
         return value
 
     def set(self, name, value):
         self.symbols[name] = value
 
+    # whether name is a variable of this table, rather than a global of one above it
+    def holds(self, name):
+        return name in self.symbols
+
     def remove(self, name):
         del self.symbols[name]
 
@@ -397,6 +512,19 @@ class Context:
         self.symbol_table = None
 
 class Interpreter:
+    # bumped whenever a when body runs; a when body may assign any variable, so values stored
+    # for InvariantNodes before are not reused
+    trigger_epoch = 0
+    # the Tiers that compiles hot loops and function bodies (see tiering.py), or None
+    tiering = None
+    # BinOpNode -> the handler it was quickened to (see quicken.py); keyed weakly, so that a
+    # tree run and dropped (a shell run, a module used) takes its handlers with it
+    quickened = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        # InvariantNode key -> (value, trigger_epoch when it was computed)
+        self.invariants = {}
+
     def visit(self, node, context):
         method_name = f'visit_{type(node).__name__}'
         method = getattr(self, method_name, self.no_visit_method)
@@ -434,7 +562,7 @@ class Interpreter:
         elements = []
         for el in node.elements:
             ret = res.register(self.visit(el, context))
-            elements.append(ret)
+            elements.append(kept(ret))
             if res.should_return(): return res
         return RTResult().success(
             List(elements).set_context(context).set_pos(node.pos_start, node.pos_end))
@@ -442,9 +570,9 @@ class Interpreter:
     def visit_MapNode(self, node, context):
         res = RTResult()
         elements = {}
-        for key, val in node.elements.items():
-            mykey = res.register(self.visit(key, context))
-            myval = res.register(self.visit(val, context))
+        for key, val in node.elements:
+            mykey = kept(res.register(self.visit(key, context)))
+            myval = kept(res.register(self.visit(val, context)))
             elements[mykey] = myval
 
             if res.should_return(): return res
@@ -465,39 +593,38 @@ class Interpreter:
                 raise VariableAccessError(node.pos_start, node.pos_end,
                                           f"Struct has no property '{node.right_node.var_name_tok}'")
         else:
+            # a read in the right operand may move a left one lent out by the same variable
+            at = read_at(left)
             right = res.register(self.visit(node.right_node, context))
+            left = apart(left, at)
         if res.should_return(): return res
 
-        if node.op_tok.type == 'PLS': result, error = left.add(right)
-        elif node.op_tok.type == 'MNS': result, error = left.sub(right)
-        elif node.op_tok.type == 'MUL': result, error = left.mul(right)
-        elif node.op_tok.type == 'DIV': result, error = left.div(right)
-        elif node.op_tok.type == 'MOD': result, error = left.mod(right)
-        elif node.op_tok.type == 'POW': result, error = left.pow(right)
-        elif node.op_tok.type == 'EQ': result, error = left.eq(right)
-        elif node.op_tok.type == 'NE': result, error = left.ne(right)
-        elif node.op_tok.type == 'LT': result, error = left.lt(right)
-        elif node.op_tok.type == 'GT': result, error = left.gt(right)
-        elif node.op_tok.type == 'LE': result, error = left.le(right)
-        elif node.op_tok.type == 'GE': result, error = left.ge(right)
-        elif node.op_tok.type == 'AND': result, error = left.logand(right)
-        elif node.op_tok.type == 'OR': result, error = left.logor(right)
-        elif node.op_tok.type == 'NAND': result, error = left.lognand(right)
-        elif node.op_tok.type == 'NOR': result, error = left.lognor(right)
-        elif node.op_tok.type == 'XOR': result, error = left.logxor(right)
-        elif node.op_tok.type == 'AT': result, error = left.at(right)
-        elif node.op_tok.type == 'LSLC': result, error = left.sliceleft(right)
-        elif node.op_tok.type == 'RSLC': result, error = left.sliceright(right)
-        elif node.op_tok.type == 'DOT':
-            result, error = right, None
-            pass
-
+        result, error = self.operate(node, left, right)
         if error:
             return res.failure(error)
         else:
             # return res.success(result.set_pos(node.pos_start, node.pos_end))
             return res.success(result)
 
+    # the operation of node on its operands, by the handler it was quickened to; the BinOpNodes
+    # made anew on each container access are quickened each time, for which one lookup is all
+    # quicken does
+    def operate(self, node, left, right):
+        if node.op_tok is AT:
+            outcome = quicken('AT', left, right)(left, right)
+            if outcome is None:
+                outcome = GENERIC['AT'](left, right)
+            return outcome
+        handler = Interpreter.quickened.get(node)
+        if handler is None:
+            handler = Interpreter.quickened[node] = quicken(node.op_tok.type, left, right)
+        outcome = handler(left, right)
+        if outcome is None:
+            # operands of other classes than it was quickened for: generic from now on
+            handler = Interpreter.quickened[node] = GENERIC[node.op_tok.type]
+            outcome = handler(left, right)
+        return outcome
+
     def visit_UnaryOpNode(self, node, context):
         res = RTResult()
         number = res.register(self.visit(node.node, context))
@@ -525,12 +652,13 @@ class Interpreter:
             raise VariableAccessError(node.pos_start, node.pos_end,
                                       f"'{var_name}' is not defined")
 
+        # the value itself is lent out, moved to where it is read; what keeps it copies it
         if isinstance(value, Struct):
             value = value.copy().set_pos(node.pos_start, node.pos_end)
         elif context.display_name.startswith('struct'):
             value = value.set_pos(node.pos_start, node.pos_end)
         else:
-            value = value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+            value = lent(value, context, node.pos_start, node.pos_end)
         return res.success(value)
 
     def visit_ContainerAccessNode(self, node, context):
@@ -542,7 +670,7 @@ class Interpreter:
         if isinstance(curr_node.root_var, ContainerAccessNode):
             result = res.register(self.visit(curr_node.root_var, context))
             if res.error: return res
-            val = BinOpNode(result, Token('AT', '@'), curr_node.specifier)
+            val = BinOpNode(result, AT, curr_node.specifier)
             result = res.register(self.visit(val, context))
             if res.error: return res
             return res.success(result)
@@ -550,14 +678,13 @@ class Interpreter:
         elif isinstance(curr_node.root_var, PropertyAccessNode):
             result = res.register(self.visit(curr_node.root_var, context))
             if res.error: return res
-            val = BinOpNode(result, Token('AT', '@'), curr_node.specifier)
+            val = BinOpNode(result, AT, curr_node.specifier)
             result = res.register(self.visit(val, context))
             if res.error: return res
             return res.success(result)
 
         elif isinstance(curr_node.root_var, VarAccessNode) or isinstance(curr_node.root_var, StringNode):
-            binopnode = BinOpNode(curr_node.root_var, Token('AT', '@'),
-                                  curr_node.specifier)
+            binopnode = BinOpNode(curr_node.root_var, AT, curr_node.specifier)
             result = res.register(self.visit(binopnode, context))
             if res.error: return res
             return res.success(result)
@@ -598,8 +725,6 @@ class Interpreter:
         value = res.register(self.visit(node.value_node, context))
         if res.error: return res
 
-        node.target_node.value = value
-
         # Okay.  Not gonna lie.  This is the kludgey-est thing in this language, but I think
         # it'll work.
 
@@ -638,7 +763,8 @@ class Interpreter:
                 # var = res.register(self.visit(curr_node, context))
                 specifier = self.visit(curr_node.specifier, context)
                 if accesstype == 'elem':
-                    childstring += f'[{specifier.value}]'
+                    # the element, copied where lists share it, so the change is this list's alone
+                    childstring = f'.owned({specifier.value})'
                 curr_node = curr_node.root_var
 
             children = childstring + children
@@ -665,7 +791,7 @@ class Interpreter:
             return res.success(source)
 
         if isinstance(curr_node.root_var, VarAccessNode):
-            val = res.register(self.visit(BinOpNode(curr_node.root_var, Token('AT', '@'), curr_node.specifier),
+            val = res.register(self.visit(BinOpNode(curr_node.root_var, AT, curr_node.specifier),
                                           context))
             if res.error: return res
             return res.success(val)
@@ -674,7 +800,7 @@ class Interpreter:
             source = res.register(self.visit(curr_node.root_var, context))
             if res.error: return res
 
-            val = res.register(self.visit(BinOpNode(source, Token('AT', '@'), curr_node.specifier),
+            val = res.register(self.visit(BinOpNode(source, AT, curr_node.specifier),
                                           context))
             if res.error: return res
             return res.success(val)
@@ -683,12 +809,20 @@ class Interpreter:
     def visit_VarAssignNode(self, node, context):
         res = RTResult()
         var_name = node.var_name_tok.value
-        op_tok = node.op_tok.value
         if var_name in KWDS + ['T', 'F']:
             raise BuiltinViolationError(node.pos_start, node.pos_end,
                                         f'Cannot overwrite keyword {var_name}.')
         value = res.register(self.visit(node.value_node, context))
         if res.should_return(): return res
+        return self.assign(node, value, context)
+
+    # store value, computed from node's value expression, in the variable node assigns: checks
+    # static types and constants and runs the variable's when triggers
+    def assign(self, node, value, context):
+        res = RTResult()
+        value = kept(value)
+        var_name = node.var_name_tok.value
+        op_tok = node.op_tok.value
 
         og_val = context.symbol_table.get(var_name)
         static_mode = context.symbol_table.get('static-typing').is_true()
@@ -772,6 +906,7 @@ class Interpreter:
                         for t in value.triggers:
                             condition = res.register(self.visit(node.condition_node, context))
                             if condition.is_true():
+                                Interpreter.trigger_epoch += 1
                                 result = res.register(self.visit(node.body_node, context))
 
                             if res.should_return(): return res
@@ -801,8 +936,14 @@ class Interpreter:
                 if res.should_return(): return res
 
                 if condition.is_true():
+                    Interpreter.trigger_epoch += 1
                     result = res.register(self.visit(t.body_node, context))
 
+        elif op_tok == '+=' and isinstance(og_val, List) and context.symbol_table.holds(var_name):
+            # appended in place, unless the elements are shared
+            og_val.unshare()
+            og_val.elements.append(value)
+            value = og_val
         elif op_tok == '+=': value = og_val.add(value)[0]
         elif op_tok == '-=': value = og_val.sub(value)[0]
         elif op_tok == '*=': value = og_val.mul(value)[0]
@@ -818,6 +959,7 @@ class Interpreter:
             if res.should_return(): return res
 
             if condition.is_true():
+                Interpreter.trigger_epoch += 1
                 result = res.register(self.visit(t.body_node, context))
 
         return res.success(value)
@@ -864,7 +1006,15 @@ class Interpreter:
         if step_value.value >= 0: condition = lambda: i < end_value.value
         else: condition = lambda: i > end_value.value
 
+        tiers = Interpreter.tiering
         while condition():
+            unit = tiers and tiers.loop(node, context)
+            if unit:
+                # the rest of the loop runs compiled, unless its unit is dropped on the way
+                i, done = unit.resume(self, context, elements, i, end_value.value, step_value.value)
+                if done: return done
+                continue
+
             context.symbol_table.set(node.var_name_tok.value, Number(i))
             i += step_value.value
 
@@ -881,7 +1031,13 @@ class Interpreter:
         res = RTResult()
         elements = []
 
+        tiers = Interpreter.tiering
         while True:
+            unit = tiers and tiers.loop(node, context)
+            if unit:
+                done = unit.resume(self, context, elements)[1]
+                if done: return done
+
             condition = res.register(self.visit(node.condition_node, context))
             if res.should_return(): return res
 
@@ -909,6 +1065,29 @@ class Interpreter:
 
         return res.success(List(elements).set_context(context).set_pos(node.pos_start, node.pos_end))
 
+    def visit_InvariantNode(self, node, context):
+        stored = self.invariants.get(node.key)
+        if stored is None or stored[1] != Interpreter.trigger_epoch or context.display_name.startswith('struct'):
+            res = RTResult()
+            value = res.register(self.visit(node.expr, context))
+            if res.should_return(): return res
+            # lists may be changed in place, so only numbers and strings are kept
+            if isinstance(value, (Number, String)) and not context.display_name.startswith('struct'):
+                self.invariants[node.key] = (value.copy(), Interpreter.trigger_epoch)
+            return res.success(value)
+
+        value = stored[0].copy()
+        if value.pos_start is not None:
+            value.set_pos(node.anchor.pos_start, node.anchor.pos_end)
+        if not node.shared or not isinstance(value, Number):
+            value.triggers = []
+        return RTResult().success(value)
+
+    def visit_ResetNode(self, node, context):
+        for key in node.keys:
+            self.invariants.pop(key, None)
+        return self.visit(node.node, context)
+
     def visit_ContinueNode(self, node, context):
         return RTResult().success_continue()
 
@@ -932,16 +1111,24 @@ class Interpreter:
             context.symbol_table.set('static-typing', Number(1))
             return res.success(None)
 
-        f = open(f'C:\\Users\\pvshe\\PycharmProjects\\safyr\\{name}.sfr', 'r')
-        code = f.read()
-        f.close()
+        path = f'C:\\Users\\pvshe\\PycharmProjects\\safyr\\{name}.sfr'
+        level = context.symbol_table.get('opt-level')
+        level = level.value if level else 0
 
-        ast = Parser(Lexer().tokenize(code)).parse()
+        # a fresh .sfc holds the module's tree already optimized (see sfc.py)
+        compiled = load_sfc(path, Lexer(), 0, level)
+        if compiled is not None:
+            return res.success(self.visit(compiled[0], context).value)
+
+        # modules are parsed lazily: only the functions a program calls get their bodies parsed;
+        # their trees are cached only when the program's are (see cache in shell.py)
+        cache = context.symbol_table.get('ast-cache')
+        ast = parse_file(path, use_cache=bool(cache and cache.is_true()), lazy=True)
         if ast.error:
             raise SyntaxError(node.fname.pos_start, node.fname.pos_end,
                               f'Error parsing file {name}')
 
-        result = self.visit(ast.node, context)
+        result = self.visit(optimize(ast.node, level), context)
         return res.success(result.value)
 
 
@@ -974,7 +1161,33 @@ class Interpreter:
 
         if isinstance(retval, Struct):
             return res.success(retval.copy().set_pos(node.pos_start, node.pos_end))
-        return res.success(retval.copy().set_pos(node.pos_start, node.pos_end).set_context(context))
+        return res.success(placed(retval, context, node.pos_start, node.pos_end))
+
+    # a call to a one-line function, run in place while the variable still holds it: the same
+    # context, argument values and result as visit_CallNode and Function.execute would give
+    def visit_InlineCallNode(self, node, context):
+        function = context.symbol_table.get(node.name)
+        if type(function) is not Function or function.body_node is not node.body or \
+                context.display_name.startswith('struct'):
+            return self.visit(node.call, context)
+
+        res = RTResult()
+        args = []
+        for a in node.call.arg_nodes:
+            args.append(res.register(self.visit(a, context)))
+            if res.should_return(): return res
+
+        exec_ctx = Context(function.name, context, node.pos_start)
+        exec_ctx.symbol_table = SymbolTable(context.symbol_table)
+        function.populate_args(node.arg_names, args, exec_ctx)
+
+        retval = res.register(self.visit(node.body, exec_ctx))
+        if res.should_return(): return res
+        retval = retval or Number.null
+
+        if isinstance(retval, Struct):
+            return res.success(retval.copy().set_pos(node.pos_start, node.pos_end))
+        return res.success(placed(retval, context, node.pos_start, node.pos_end))
 
     def visit_StructDefinitionNode(self, node, context):
         res = RTResult()
@@ -1,5 +1,14 @@
 from errors import *
 
+import hashlib
+import marshal
+import multiprocessing
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+
 
 DGT = '1234567890'
 LWR = 'abcdefghijklmnopqrstuvwxyz'
@@ -61,6 +70,28 @@ OPNAMES = {'+': 'PLS',
            '/>': 'RSLC'
            }
 
+BIGRAPH_SET = frozenset(BIGRAPHS)
+KWD_SET = frozenset(KWDS)
+
+# lexer states, see build_rules
+STATES = ['new', 'int', 'flt', 'con', 'ops', 'dec',
+          'st1', 'st2', 'sym', 'fin', 'xxx', 'cmt']
+
+# file `python lexer.py` exports the transition table to, for tools that want it without
+# importing the lexer.  The lexer itself never reads or writes it: building the table takes
+# less time than reading the file back.  Its header records a hash of this file, where
+# build_rules is, so read_rules turns down a table exported by another lexer.py.  Bump
+# RULES_VERSION when the file format changes.
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexer.rules')
+RULES_VERSION = 1
+RULES_HEADER = b'SFRRULES' + bytes([RULES_VERSION, marshal.version])
+
+# number of characters read at a time by Lexer.iter_tokens
+CHUNK_SIZE = 1 << 16
+
+# inputs shorter than this (in characters per worker) are not worth a process pool
+PARALLEL_MIN_PIECE = 1 << 18
+
 
 class Position:
     def __init__(self, idx, ln, col, fn, ftxt):
@@ -83,6 +114,8 @@ class Position:
 
 
 class Token:
+    __slots__ = ('type', 'value', 'pos_start', 'pos_end')
+
     def __init__(self, type_, value=None, pos_start=None, pos_end=None):
         self.type = type_
         self.value = value
@@ -105,16 +138,461 @@ class Token:
     def __eq__(self, other):
         return self.value == other.value and self.type == other.type
 
+    # tokens never change once lexed, so copies of the values and trees holding them share them
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# source text shared by every token lexed from it; the index of line starts is only built
+# the first time a line or column number is needed
+class Source:
+    __slots__ = ('text', 'name', '_line_starts')
+
+    def __init__(self, text, name=''):
+        self.text = text
+        self.name = name
+        self._line_starts = None
+
+    # append more text; returns the text held and the offset of its first character
+    def feed(self, chunk):
+        self.text += chunk
+        self._line_starts = None
+        return self.text, 0
+
+    def line_starts(self):
+        if self._line_starts is None:
+            starts = [0]
+            i = self.text.find('\n')
+            while i >= 0:
+                starts.append(i + 1)
+                i = self.text.find('\n', i + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    # zero-based line number containing the offset idx
+    def line_of(self, idx):
+        return bisect_right(self.line_starts(), idx) - 1
+
+    def column_of(self, idx):
+        return idx - self.line_starts()[self.line_of(idx)]
+
+    # text of line ln, without its newline
+    def line_text(self, ln):
+        start = self.line_starts()[ln]
+        end = self.text.find('\n', start)
+        return self.text[start:] if end < 0 else self.text[start:end]
+
+
+# Source for text that is read in chunks: line starts are indexed as each chunk arrives, but
+# only the text from the start of the current line onwards is kept.  Older lines are read back
+# from the file (when its path is known) if an error needs to show them.
+class StreamSource(Source):
+    __slots__ = ('base', 'path')
+
+    def __init__(self, name='', path=None):
+        super().__init__('', name)
+        self._line_starts = [0]
+        self.base = 0
+        self.path = path
+
+    def feed(self, chunk):
+        starts = self._line_starts
+        offset = self.base + len(self.text)
+        keep = starts[-1] - self.base
+        self.text = self.text[keep:] + chunk
+        self.base += keep
+
+        i = chunk.find('\n')
+        while i >= 0:
+            starts.append(offset + i + 1)
+            i = chunk.find('\n', i + 1)
+        return self.text, self.base
+
+    # read the rest of the current line from chunks, keeping the text already held, so that an
+    # error found on a line that runs past the last chunk fed shows the whole line
+    def finish_line(self, chunks):
+        for chunk in chunks:
+            self.text += chunk
+            if '\n' in chunk:
+                break
+
+    def line_text(self, ln):
+        start = self._line_starts[ln]
+        if start >= self.base:
+            text = self.text
+            start -= self.base
+        elif self.path:
+            with open(self.path, 'r') as f:
+                text = f.read()
+        else:
+            return ''
+        end = text.find('\n', start)
+        return text[start:] if end < 0 else text[start:end]
+
+
+# Source for tokens that were not lexed in this run (e.g. loaded from the AST cache): the file's
+# text is only read if a line or column is actually needed
+class FileSource(Source):
+    __slots__ = ('path',)
+
+    def __init__(self, path, name=''):
+        super().__init__(None, name)
+        self.path = path
+
+    def line_starts(self):
+        if self.text is None:
+            with open(self.path, 'r') as f:
+                self.text = f.read()
+        return super().line_starts()
+
+    def line_text(self, ln):
+        self.line_starts()
+        return super().line_text(ln)
+
+
+# drop-in replacement for Position that only stores an offset into a Source; line, column and
+# line text are resolved on access, which normally only happens when an error is rendered.
+# A Location without a source stands for a position stripped from the token stream.
+class Location:
+    __slots__ = ('source', 'idx')
+
+    def __init__(self, source, idx):
+        self.source = source
+        self.idx = idx
+
+    @property
+    def ln(self):
+        return self.source.line_of(self.idx) if self.source else -1
+
+    @property
+    def col(self):
+        return self.source.column_of(self.idx) if self.source else 0
+
+    @property
+    def fn(self):
+        return self.source.name if self.source else ''
+
+    @property
+    def ftxt(self):
+        return self.source.line_text(self.ln) if self.source else ''
+
+    def advance(self):
+        self.idx += 1
+        return self
+
+    def __repr__(self):
+        return f'idx: {self.idx} line: {self.ln} col: {self.col} name: {self.fn}'
+
+    def copy(self):
+        return Location(self.source, self.idx)
+
+
+# token produced by the scanner: carries only its start and end offsets and the shared Source,
+# and hands out Locations for pos_start and pos_end on demand
+class SourceToken(Token):
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, type_, value, source, start, end):
+        self.type = type_
+        self.value = value
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def pos_start(self):
+        return Location(self.source, self.start)
+
+    @property
+    def pos_end(self):
+        return Location(self.source, self.end)
+
+
+# token produced with debug info stripped: no offsets at all, positions are unknown
+class StrippedToken(Token):
+    __slots__ = ()
+
+    def __init__(self, type_, value=None):
+        self.type = type_
+        self.value = value
+
+    @property
+    def pos_start(self):
+        return Location(None, -1)
+
+    @property
+    def pos_end(self):
+        return Location(None, -1)
+
+
+# classify a finished raw token string, returning its (type, value), or None if it is an
+# unsupported two-character operator; shared by both scanning engines
+def token_kind(s):
+    c = s[0]
+    # numerical token
+    if c in DGT or c == '.':
+        if '.' in s:
+            if s == '.':
+                return 'DOT', s
+            if s == '..':
+                return 'OPS', s
+            return 'FLT', float(s)
+        return 'INT', int(s)
+
+    # symbol token
+    if c in UPR or c in LWR:
+        return ('KWD' if s in KWD_SET else 'SYM'), s
+
+    # string token
+    if c in '\'"':
+        return 'STR', s[1:-1]
+
+    # operator or container token
+    if c in OPS or c in CON:
+        if len(s) == 2 and s not in BIGRAPH_SET:
+            return None
+        if s in KWD_SET:
+            return 'KWD', s
+        return OPNAMES.get(s, 'OPS'), s
+
+
+# build a Token with full Positions from a finished raw token string (legacy engine)
+def make_token(s, pos_start, pos_end):
+    kind = token_kind(s)
+    if kind is None:
+        raise IllegalTokenFormatError(pos_start, pos_end, f'Token [{s}] not supported.')
+    return Token(kind[0], kind[1], pos_start=pos_start, pos_end=pos_end)
+
+
+# build the lexer's state transition table: t[state][char] = (next state, steps to advance)
+def build_rules():
+    # state notes
+    # new: ready to start a new token or skip whitespace
+    # int: currently building integer token
+    # flt: currently building float token
+    # con: container token; ends after a single character
+    # ops: operator token; can end after one or two characters
+    # st1: currently building single-quoted string
+    # st2: currently building double-quoted string
+    # sym: currently building symbol (var name or keyword)
+    # fin: done building current token
+    # xxx: fail
+    t = {}
+    for s in STATES:
+        t[s] = {}
+    # initialize transitions for each state on seeing a digit
+    for c in DGT:
+        for s_ in ['new', 'int']:
+            t[s_][c] = ('int', 1)
+        for s_ in ['con', 'ops']:
+            t[s_][c] = ('fin', 0)
+        for s_ in ['flt', 'st1', 'st2', 'sym']:
+            t[s_][c] = (s_, 1)
+        t['dec'][c] = ('flt', 1)
+
+    # initialize transitions for each state on seeing a letter
+    for c in UPR + LWR:
+        for s_ in ['con', 'ops', 'dec']:
+            t[s_][c] = ('fin', 0)
+        for s_ in ['int', 'flt']:
+            t[s_][c] = ('xxx', 0)
+        for s_ in ['new', 'sym']:
+            t[s_][c] = ('sym', 1)
+        for s_ in ['st1', 'st2']:
+            t[s_][c] = (s_, 1)
+
+    # initialize transitions for each state on seeing a punctuation mark
+    for c in PNC:
+        for s_ in ['new', 'int', 'flt', 'ops', 'sym']:
+            t[s_][c] = ('xxx', 0)
+        for s_ in ['st1', 'st2']:
+            t[s_][c] = (s_, 1)
+        t['con'][c] = ('fin', 0)
+        t['dec'][c] = ('fin', 0)
+        t['flt'][c] = ('fin', 0)
+
+    # initialize transitions for each state on seeing an operator (overrides transitions from PNC)
+    for c in OPS:
+        for s_ in ['con', 'int', 'flt', 'sym']:
+            t[s_][c] = ('fin', 0)
+        for s_ in ['st1', 'st2']:
+            t[s_][c] = (s_, 1)
+        t['new'][c] = ('ops', 1)
+        t['ops'][c] = ('fin', 1)
+        t['dec']['.'] = ('fin', 1)
+        t['flt']['.'] = ('fin', 0)
+
+    # initialize transitions for each state on seeing a container symbol (overrides transitions from PNC)
+    for c in CON:
+        for s_ in ['con', 'int', 'flt', 'ops', 'sym']:
+            t[s_][c] = ('fin', 0)
+        for s_ in ['st1', 'st2']:
+            t[s_][c] = (s_, 1)
+        t['new'][c] = ('con', 1)
+
+    # initialize transitions for each state on seeing whitespace
+    for c in WHT:
+        for s_ in ['new', 'st1', 'st2']:
+            t[s_][c] = (s_, 1)
+        for s_ in ['int', 'flt', 'ops', 'sym']:
+            t[s_][c] = ('fin', 1)
+        t['con'][c] = ('fin', 0)
+        t['dec'][c] = ('fin', 1)
+
+    # special transitions, e.g. closing off a string when the appropriate quote is encountered
+    t['new']['.'] = ('dec', 1)
+    t['int']['.'] = ('flt', 1)
+    t['new']["'"] = ('st1', 1)
+    t['new']['"'] = ('st2', 1)
+    t['st1']["'"] = ('fin', 1)
+    t['st2']['"'] = ('fin', 1)
+    t['ops']['~'] = ('fin', 1)
+    t['ops']['.'] = ('fin', 1)
+
+    for s in ['int', 'flt', 'con', 'ops', 'dec', 'sym', 'fin', 'xxx', 'cmt']:
+        t[s][';'] = ('fin', 0)
+    for s in ['st1', 'st2']:
+        t[s][';'] = (s, 1)
+    t['new'][';'] = ('cmt', 1)
+    for c in UPR + LWR + DGT + PNC + ' \t':
+        t['cmt'][c] = ('cmt', 1)
+    t['cmt']['\n'] = ('new', 1)
+    return t
+
+
+# the header of a rules file for build_rules as it is: format tag, RULES_VERSION, the marshal
+# format version, and a hash of the text of lexer.py
+def rules_header():
+    with open(__file__, 'rb') as f:
+        return RULES_HEADER + hashlib.blake2b(f.read(), digest_size=16).digest()
+
+
+# write a transition table to a lexer.rules file: the header followed by a marshal image of
+# the table.  The file is replaced whole, so a process reading it never sees half of it.
+def write_rules(t, path=RULES_FILE):
+    temp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp, 'wb') as f:
+            f.write(rules_header())
+            f.write(marshal.dumps({s: dict(row) for s, row in t.items()}))
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# read a table written by write_rules; raises ValueError for files written by another
+# version of the rules, of lexer.py or of Python's marshal format
+def read_rules(path=RULES_FILE):
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = rules_header()
+    if not data.startswith(header):
+        raise ValueError(f'Outdated rules file {path}')
+    try:
+        t = marshal.loads(data[len(header):])
+    except (EOFError, TypeError) as e:
+        raise ValueError(f'Malformed rules file {path}') from e
+    if not isinstance(t, dict) or set(t) != set(STATES):
+        raise ValueError(f'Malformed rules file {path}')
+    return t
+
+
+# for each state, precompile a pattern matching the longest run of characters that keep the
+# lexer in that state, so the scanner can consume identifiers, numbers, strings, comments and
+# whitespace in one step instead of one transition per character
+def compile_runs(t):
+    runs = {}
+    for s, row in t.items():
+        chars = [c for c, (s_, delta) in row.items() if s_ == s and delta == 1 and c != '\n']
+        if chars:
+            runs[s] = re.compile('[' + ''.join(re.escape(c) for c in sorted(chars)) + ']+')
+    return runs
+
+
+_RULES = None
+_RUNS = None
+
+
+# transition table and run patterns shared (read-only) by every Lexer in the process, built
+# by the first Lexer
+def shared_rules():
+    global _RULES, _RUNS
+    if _RULES is None:
+        t = build_rules()
+        _RULES = MappingProxyType({s: MappingProxyType(row) for s, row in t.items()})
+        _RUNS = MappingProxyType(compile_runs(t))
+    return _RULES, _RUNS
+
+
+# offsets at which text can be cut into about n pieces that tokenize independently.  Strings
+# cannot span lines and comments end at a newline, so after any newline the scanner is back in
+# state 'new' with no partial token; a piece may therefore start right after any newline.
+def split_points(text, n):
+    cuts = [0]
+    size = len(text) // n
+    for k in range(1, n):
+        i = text.find('\n', max(cuts[-1], k * size))
+        if i < 0:
+            break
+        if i + 1 < len(text):
+            cuts.append(i + 1)
+    cuts.append(len(text))
+    return cuts
+
+
+# process pool worker: tokenize one piece of a larger text.  Returns the tokens as columns (types,
+# values and, unless debug info is stripped, offsets relative to the piece), which cross the
+# process boundary far more cheaply than Token objects, or None if the piece does not tokenize.
+def scan_piece(args):
+    piece, strip = args
+    types, values, starts, ends = [], [], array('q'), array('q')
+
+    def sink(type_, value, start, end):
+        types.append(type_)
+        values.append(value)
+        if not strip:
+            starts.append(start)
+            ends.append(end)
+
+    try:
+        for _ in Lexer(strip_debug=strip).scan_chunks([piece], Source('', ''), sink):
+            pass
+    except SyntaxError:
+        return None
+    return types, values, starts, ends
+
+
+# build tokens from the columns returned by scan_piece for a piece starting at offset base of
+# source (StrippedTokens if source is None); the piece's EOF token is left out unless eof is set
+def piece_tokens(columns, source, base, eof):
+    types, values, starts, ends = columns
+    count = len(types) - (not eof)
+    if source is None:
+        return [StrippedToken(types[i], values[i]) for i in range(count)]
+    return [SourceToken(types[i], values[i], source, starts[i] + base, ends[i] + base)
+            for i in range(count)]
+
 
 class Lexer:
-    def __init__(self):
+    # legacy=True selects the original character-at-a-time engine (transition), which is
+    # kept around so its output can be diffed against the table-driven scanner (scan).
+    # strip_debug=True makes the scanner emit tokens without any source offsets, for runs
+    # that will never print an error location.
+    def __init__(self, legacy=False, strip_debug=False):
+
+        self.legacy = legacy
+        self.strip_debug = strip_debug
+        self.source = None
 
         self.state = 'new'
         self.pos = 0
         self.token = ''
         self.tokens = []
         self.input = ''
-        self.t = {}
         self.name = ''
 
         self.linenum = 0
@@ -126,116 +604,9 @@ class Lexer:
 
         self.load_rules()
 
+    # attach the process-wide transition table; nothing is rebuilt per instance
     def load_rules(self):
-        # state notes
-        # new: ready to start a new token or skip whitespace
-        # int: currently building integer token
-        # flt: currently building float token
-        # con: container token; ends after a single character
-        # ops: operator token; can end after one or two characters
-        # st1: currently building single-quoted string
-        # st2: currently building double-quoted string
-        # sym: currently building symbol (var name or keyword)
-        # fin: done building current token
-        # xxx: fail
-        states = ['new', 'int', 'flt', 'con', 'ops', 'dec',
-                  'st1', 'st2', 'sym', 'fin', 'xxx', 'cmt']
-
-        # with open('lexer.rules', 'r') as f:
-        #     data = f.read()
-        #     i = 0
-        #     while True:
-        #         d = data[i:i+12]
-        #         if not d:
-        #             break
-        #         line = data[i:i+11]
-        #         i += 12
-        #         line = line.split('~')
-        #         s, c, s_, d = line[0], line[1], line[2], int(line[3])
-        #         if s not in self.t:
-        #             self.t[s] = {}
-        #         if c not in self.t[s]:
-        #             self.t[s][c] = [s_, d]
-
-        for s in states:
-            self.t[s] = {}
-        # initialize transitions for each state on seeing a digit
-        for c in DGT:
-            for s_ in ['new', 'int']:
-                self.t[s_][c] = ['int', 1]
-            for s_ in ['con', 'ops']:
-                self.t[s_][c] = ['fin', 0]
-            for s_ in ['flt', 'st1', 'st2', 'sym']:
-                self.t[s_][c] = [s_, 1]
-            self.t['dec'][c] = ['flt', 1]
-
-        # initialize transitions for each state on seeing a letter
-        for c in UPR + LWR:
-            for s_ in ['con', 'ops', 'dec']:
-                self.t[s_][c] = ['fin', 0]
-            for s_ in ['int', 'flt']:
-                self.t[s_][c] = ['xxx', 0]
-            for s_ in ['new', 'sym']:
-                self.t[s_][c] = ['sym', 1]
-            for s_ in ['st1', 'st2']:
-                self.t[s_][c] = [s_, 1]
-
-        # initialize transitions for each state on seeing a punctuation mark
-        for c in PNC:
-            for s_ in ['new', 'int', 'flt', 'ops', 'sym']:
-                self.t[s_][c] = ['xxx', 0]
-            for s_ in ['st1', 'st2']:
-                self.t[s_][c] = [s_, 1]
-            self.t['con'][c] = ['fin', 0]
-            self.t['dec'][c] = ['fin', 0]
-            self.t['flt'][c] = ['fin', 0]
-
-        # initialize transitions for each state on seeing an operator (overrides transitions from PNC)
-        for c in OPS:
-            for s_ in ['con', 'int', 'flt', 'sym']:
-                self.t[s_][c] = ['fin', 0]
-            for s_ in ['st1', 'st2']:
-                self.t[s_][c] = [s_, 1]
-            self.t['new'][c] = ['ops', 1]
-            self.t['ops'][c] = ['fin', 1]
-            self.t['dec']['.'] = ['fin', 1]
-            self.t['flt']['.'] = ['fin', 0]
-
-        # initialize transitions for each state on seeing a container symbol (overrides transitions from PNC)
-        for c in CON:
-            for s_ in ['con', 'int', 'flt', 'ops', 'sym']:
-                self.t[s_][c] = ['fin', 0]
-            for s_ in ['st1', 'st2']:
-                self.t[s_][c] = [s_, 1]
-            self.t['new'][c] = ['con', 1]
-
-        # initialize transitions for each state on seeing whitespace
-        for c in WHT:
-            for s_ in ['new', 'st1', 'st2']:
-                self.t[s_][c] = [s_, 1]
-            for s_ in ['int', 'flt', 'ops', 'sym']:
-                self.t[s_][c] = ['fin', 1]
-            self.t['con'][c] = ['fin', 0]
-            self.t['dec'][c] = ['fin', 1]
-
-        # special transitions, e.g. closing off a string when the appropriate quote is encountered
-        self.t['new']['.'] = ['dec', 1]
-        self.t['int']['.'] = ['flt', 1]
-        self.t['new']["'"] = ['st1', 1]
-        self.t['new']['"'] = ['st2', 1]
-        self.t['st1']["'"] = ['fin', 1]
-        self.t['st2']['"'] = ['fin', 1]
-        self.t['ops']['~'] = ['fin', 1]
-        self.t['ops']['.'] = ['fin', 1]
-
-        for s in ['int', 'flt', 'con', 'ops', 'dec', 'sym', 'fin', 'xxx', 'cmt']:
-            self.t[s][';'] = ['fin', 0]
-        for s in ['st1', 'st2']:
-            self.t[s][';'] = [s, 1]
-        self.t['new'][';'] = ['cmt', 1]
-        for c in UPR + LWR + DGT + PNC + ' \t':
-            self.t['cmt'][c] = ['cmt', 1]
-        self.t['cmt']['\n'] = ['new', 1]
+        self.t, self.runs = shared_rules()
 
     # load new text and reset variables for new input
     def load(self, text, name=''):
@@ -274,7 +645,7 @@ class Lexer:
 
         # unhandled character
         if c not in self.t[self.state]:
-            self.end_pos = Position(self.pos, self.linenum, self.colnum+1, self.name, self.currline)
+            self.end_pos = Position(self.pos + 1, self.linenum, self.colnum + 1, self.name, self.currline)
             raise IllegalInputCharacterError(self.start_pos, self.end_pos, f'Character [{c}] not supported.')
 
         # get new state and number of steps to move
@@ -288,7 +659,7 @@ class Lexer:
 
         # fail state
         if s_ == 'xxx':
-            self.end_pos = Position(self.pos, self.linenum, self.colnum+1, self.name, self.currline)
+            self.end_pos = Position(self.pos + 1, self.linenum, self.colnum + 1, self.name, self.currline)
             raise IllegalTokenFormatError(self.start_pos, self.end_pos,
                                           f'Encountered character [{c}] in state [{self.state}]')
 
@@ -324,9 +695,9 @@ class Lexer:
 
         # track line and column numbers for error reporting
         if c == '\n':
+            self.end_pos = Position(self.pos, self.linenum, self.colnum, self.name, self.currline)
             if self.state[:2] == 'st':
                 raise UnmatchedQuoteError(self.start_pos, self.end_pos, 'Unmatched quotation mark')
-            self.end_pos = Position(self.pos, self.linenum, self.colnum, self.name, self.currline)
             self.linenum += 1
             self.colnum = 0
             self.currline = ''
@@ -341,43 +712,220 @@ class Lexer:
 
     # take a raw text token and convert it to a Token object with the appropriate values
     def get_token(self):
-        s = self.token
         self.end_pos = Position(self.pos, self.linenum, self.colnum, self.name, self.currline)
-        # numerical token
-        if s[0] in DGT + '.':
-            if '.' in s:
-                if s == '.':
-                    return Token('DOT', s, pos_start=self.start_pos, pos_end=self.end_pos)
-                if s == '..':
-                    return Token('OPS', s, pos_start=self.start_pos, pos_end=self.end_pos)
-                return Token('FLT', float(s), pos_start=self.start_pos, pos_end=self.end_pos)
+        return make_token(self.token, self.start_pos, self.end_pos)
+
+    # table-driven scanner; walks the same state table as transition, but tokens only record
+    # offsets into a shared Source, so no line or column bookkeeping is done while scanning
+    def scan(self):
+        source = self.source = Source('', self.name)
+        for batch in self.scan_chunks([self.input], source):
+            self.tokens.extend(batch)
+        return self.tokens
+
+    # tokenize with a pool of worker processes: the text is cut at newlines into one piece per
+    # process, the pieces are scanned separately and their tokens stitched back together with
+    # offsets shifted to the whole text, which gives exactly the tokens tokenize would.  Small
+    # inputs are scanned serially, and so is the whole text if any piece fails, so that the
+    # error raised is the one serial tokenization reports.
+    def tokenize_parallel(self, text=None, processes=None):
+        if text:
+            self.input = text
+        text = self.input
+        processes = processes or os.cpu_count() or 1
+        processes = min(processes, len(text) // PARALLEL_MIN_PIECE)
+        cuts = split_points(text, processes) if processes > 1 else []
+        if len(cuts) < 3:
+            return self.scan()
+
+        with multiprocessing.Pool(len(cuts) - 1) as pool:
+            results = pool.map(scan_piece, [(text[a:b], self.strip_debug) for a, b in zip(cuts, cuts[1:])])
+        if None in results:
+            return self.scan()
+
+        source = self.source = Source(text, self.name)
+        tokens = self.tokens
+        last = len(results) - 1
+        for k, columns in enumerate(results):
+            # every piece but the last ends in its own EOF token, which is dropped
+            tokens.extend(piece_tokens(columns, None if self.strip_debug else source, cuts[k], k == last))
+        self.pos = len(text)
+        return tokens
+
+    # update the tokens of a text after its characters start:end were replaced by text, without
+    # rescanning all of it.  Scanning restarts at the beginning of the line holding start (after a
+    # newline the scanner is always in state 'new') and stops at the first line break after the
+    # replaced text, where the new scan has reconverged with the old one; old tokens past that
+    # point are kept with their offsets shifted.  tokens must come from the table scanner with
+    # offsets (not stripped); the list, its tokens and their Source are updated in place and
+    # the list is returned.
+    def retokenize(self, tokens, start, end, text):
+        if not tokens or not isinstance(tokens[-1], SourceToken):
+            raise ValueError('retokenize needs tokens with source offsets')
+        source = self.source = tokens[-1].source
+        old = source.text
+        new = old[:start] + text + old[end:]
+        delta = len(new) - len(old)
+
+        restart = old.rfind('\n', 0, start) + 1
+        stop = new.find('\n', start + len(text)) + 1 or len(new)
+        first = bisect_left(tokens, restart, key=lambda t: t.end)
+        if stop < len(new):
+            last = bisect_left(tokens, stop - delta, key=lambda t: t.end)
+        else:
+            last = len(tokens)
+
+        # scan the changed lines against a Source holding the text before them, so that offsets
+        # (and the location of any error) are those of the whole new text
+        self.state, self.token, self.pos = 'new', '', restart
+        scanned = Source(new[:restart], source.name)
+        piece = [tok for batch in self.scan_chunks([new[restart:stop]], scanned) for tok in batch]
+        if stop < len(new):
+            piece.pop()
+        for tok in piece:
+            tok.source = source
+
+        source.text = new
+        source._line_starts = None
+        if delta:
+            for tok in tokens[last:]:
+                tok.start += delta
+                tok.end += delta
+        tokens[first:last] = piece
+        self.input = new
+        self.tokens = tokens
+        self.pos = len(new)
+        return tokens
+
+    # read fileobj in chunks and yield its tokens lazily, ending with EOF; the text is never
+    # held in memory as a whole
+    def iter_tokens(self, fileobj, chunk_size=CHUNK_SIZE):
+        path = getattr(fileobj, 'name', None)
+        source = self.source = StreamSource(self.name, path if isinstance(path, str) else None)
+        chunks = iter(lambda: fileobj.read(chunk_size), '')
+        try:
+            for batch in self.scan_chunks(chunks, source):
+                yield from batch
+        except SyntaxError:
+            source.finish_line(chunks)
+            raise
+
+    # scanner core: feeds each chunk to source and yields the list of tokens it completed.  The
+    # state and the partial token are carried from one chunk to the next, so tokens and strings
+    # may straddle chunk boundaries; offsets are absolute positions in the whole input.
+    # If sink is given, it is called as sink(type, value, start, end) for each token instead of
+    # building Token objects, and the yielded lists stay empty.
+    def scan_chunks(self, chunks, source, sink=None):
+        table = self.t
+        runs = self.runs
+        strip = self.strip_debug
+        batch = []
+
+        def emit(type_, value, start, end):
+            if sink:
+                sink(type_, value, start, end)
+            elif strip:
+                batch.append(StrippedToken(type_, value))
             else:
-                return Token('INT', int(s), pos_start=self.start_pos, pos_end=self.end_pos)
-
-        # symbol token
-        if s[0] in UPR + LWR:
-            if s in KWDS:
-                return Token('KWD', s, pos_start=self.start_pos, pos_end=self.end_pos)
-            return Token('SYM', s, pos_start=self.start_pos, pos_end=self.end_pos)
-
-        # string token
-        if s[0] in '\'"':
-            return Token('STR', s[1:-1], pos_start=self.start_pos, pos_end=self.end_pos)
-
-        # operator or container token
-        if s[0] in OPS + CON:
-            if len(s) == 2 and s not in BIGRAPHS:
-                raise IllegalTokenFormatError(self.start_pos, self.end_pos, f'Token [{s}] not supported.')
-            if s in KWDS:
-                if s in KWDS:
-                    return Token('KWD', s, pos_start=self.start_pos, pos_end=self.end_pos)
-            if s in OPNAMES:
-                return Token(OPNAMES[s], s, pos_start=self.start_pos, pos_end=self.end_pos)
-            return Token('OPS', s, pos_start=self.start_pos, pos_end=self.end_pos)
+                batch.append(SourceToken(type_, value, source, start, end))
+
+        def finish(s, start, end):
+            kind = token_kind(s)
+            if kind is None:
+                raise IllegalTokenFormatError(Location(source, start), Location(source, end),
+                                              f'Token [{s}] not supported.')
+            emit(kind[0], kind[1], start, end)
+
+        state = self.state
+        token = self.token
+        at = start = self.pos
+
+        for chunk in chunks:
+            text, base = source.feed(chunk)
+            n = len(text)
+            pos = at - base
+
+            while pos < n:
+                c = text[pos]
+
+                if state == 'new':
+                    start = base + pos
+
+                row = table[state]
+                if c not in row:
+                    raise IllegalInputCharacterError(Location(source, start), Location(source, base + pos + 1),
+                                                     f'Character [{c}] not supported.')
+                s_, delta = row[c]
+
+                if token == '=' and (c == "'" or c == '"'):
+                    s_, delta = 'fin', 0
+
+                if s_ == 'xxx':
+                    raise IllegalTokenFormatError(Location(source, start), Location(source, base + pos + 1),
+                                                  f'Encountered character [{c}] in state [{state}]')
+
+                elif s_ == 'new' and state == 'new':
+                    pass
+
+                elif s_ == 'cmt':
+                    state = s_
+
+                elif s_ == 'fin':
+                    if token == c == '~':
+                        delta = 0
+                    if state == 'ops' and (token + c not in BIGRAPH_SET):
+                        delta = 0
+                    if delta and c not in WHT:
+                        token += c
+                    finish(token, start, base + pos)
+                    token = ''
+                    state = 'new'
+
+                else:
+                    token += c
+                    state = s_
+
+                if c == '\n':
+                    if state[:2] == 'st':
+                        raise UnmatchedQuoteError(Location(source, start), Location(source, base + pos),
+                                                  'Unmatched quotation mark')
+                    token = ''
+                    emit('BREAK', None, start, base + pos)
+
+                pos += delta
+
+                # consume the rest of a run of characters that cannot change the state
+                if delta and state in runs:
+                    m = runs[state].match(text, pos)
+                    if m:
+                        stop = m.end()
+                        if state != 'new' and state != 'cmt':
+                            token += text[pos:stop]
+                        pos = stop
+
+            at = base + pos
+            if batch:
+                yield batch
+                batch = []
+
+        # if there is an active token when the end of the input is reached, store it
+        if token:
+            if state in ['st1', 'st2']:
+                raise UnmatchedQuoteError(Location(source, start), Location(source, at + 1),
+                                          'Unmatched quotation mark')
+            finish(token, start, at)
+        emit('EOF', None, at, at + 1)
+
+        self.state = 'new'
+        self.token = ''
+        self.pos = at
+        yield batch
 
     def tokenize(self, text=None):
         if text:
             self.input = text
+        if not self.legacy:
+            return self.scan()
         # if self.input[-1] != '\n':
         #     self.input += '\n'
         # process entire input string
@@ -387,7 +935,7 @@ class Lexer:
         if self.token:
             # handle unclosed quote in input
             if self.state in ['st1', 'st2']:
-                self.end_pos = Position(self.pos, self.linenum, self.colnum+1, self.name, self.currline)
+                self.end_pos = Position(self.pos + 1, self.linenum, self.colnum + 1, self.name, self.currline)
                 raise UnmatchedQuoteError(self.start_pos, self.end_pos, 'Unmatched quotation mark')
 
             # add token to list
@@ -397,3 +945,8 @@ class Lexer:
                                           self.currline))
                            )
         return self.tokens
+
+
+if __name__ == '__main__':
+    write_rules(build_rules())
+    print(f'Wrote {RULES_FILE}')
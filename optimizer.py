@@ -0,0 +1,576 @@
+# Optimization passes over parsed trees, run between Parser.parse and Interpreter.visit.  Trees
+# are immutable, so a pass returns a new tree that shares every subtree it left unchanged.
+#
+# Optimization levels:
+#   0  run the tree as parsed
+#   1  fold constant expressions: arithmetic, comparisons and logical operators on number
+#      literals, string concatenation, and unary operators on number literals
+#   2  also compute loop-invariant expressions once per loop run and repeated subexpressions
+#      once per statement (see Hoister)
+#   3  also evaluate calls to one-line functions in place, without a call (see Inliner)
+
+import itertools
+
+from lexer import Token
+from parser import (BinOpNode, CallNode, CapsuleNode, ContainerAccessNode, ForNode,
+                    FunctionDefinitionNode, IfNode, LazyBlockNode, ListNode, MapNode, Node,
+                    NumberNode, PropertyAccessNode, PropertyAssignNode, ReferenceAccessNode,
+                    ReferenceAssignNode, ReturnNode, StringNode, StructDefinitionNode, UnaryOpNode,
+                    UseNode, VarAccessNode, VarAssignNode, WhenNode, WhileNode, setfield)
+from typedef import Number, String
+
+OPT_NONE, OPT_FOLD, OPT_HOIST, OPT_INLINE = 0, 1, 2, 3
+
+# the Value method the interpreter calls for each foldable binary operator
+FOLD_METHODS = {'PLS': 'add', 'MNS': 'sub', 'MUL': 'mul', 'DIV': 'div', 'MOD': 'mod', 'POW': 'pow',
+                'EQ': 'eq', 'NE': 'ne', 'LT': 'lt', 'GT': 'gt', 'LE': 'le', 'GE': 'ge',
+                'AND': 'logand', 'OR': 'logor', 'NAND': 'lognand', 'NOR': 'lognor',
+                'XOR': 'logxor'}
+
+# the only operator folded on strings; the others are rarely written on two literals
+STRING_FOLDS = frozenset(('PLS',))
+
+# folded constants larger than this many bits or characters are left to be computed at runtime,
+# so that something like 9 ^ 9 ^ 9 does not bloat the tree
+MAX_FOLDED_SIZE = 1 << 12
+
+
+# the optimized version of tree at the given level
+def optimize(tree, level=OPT_FOLD):
+    if not level or tree is None:
+        return tree
+    tree = transform(tree, level)
+    if level >= OPT_HOIST:
+        tree = Hoister().visit(tree)
+    if level >= OPT_INLINE:
+        tree = Inliner().visit(tree)
+    return tree
+
+
+# rebuild node with its children transformed, bottom-up, then simplify the node itself
+def transform(node, level):
+    if isinstance(node, tuple):
+        items = tuple(transform(v, level) for v in node)
+        return node if all(a is b for a, b in zip(items, node)) else items
+    if not isinstance(node, Node):
+        return node
+    if isinstance(node, LazyBlockNode):
+        # the body is optimized once it has been parsed
+        return LazyBlockNode(node.tokens, node.static, level)
+    if isinstance(node, ReferenceAccessNode):
+        # the interpreter turns reference targets into symbol table paths by their shape
+        return node
+
+    changes = {}
+    for name in type(node).__slots__:
+        if hasattr(node, name):
+            value = getattr(node, name)
+            new = transform(value, level)
+            if new is not value:
+                changes[name] = new
+    if changes:
+        node = rebuilt(node, changes)
+
+    if isinstance(node, BinOpNode):
+        return fold_binary(node)
+    if isinstance(node, UnaryOpNode):
+        return fold_unary(node)
+    return node
+
+
+# a copy of node with some fields replaced
+def rebuilt(node, changes):
+    cls = type(node)
+    new = cls.__new__(cls)
+    for name in cls.__slots__:
+        if name in changes:
+            setfield(new, name, changes[name])
+        elif hasattr(node, name):
+            setfield(new, name, getattr(node, name))
+    return new
+
+
+# the value the interpreter would create for a literal node, or a parenthesized one, or None
+# for any other node; positions included, as errors report them
+def literal_value(node):
+    if isinstance(node, CapsuleNode) and len(node.elements) == 1:
+        value = literal_value(node.elements[0])
+        return value and value.set_pos(node.pos_start, node.pos_end)
+    if isinstance(node, NumberNode):
+        return Number(node.tok.value, t=node.tok.type).set_pos(node.pos_start, node.pos_end)
+    if isinstance(node, StringNode):
+        return String(node.tok.value).set_pos(node.pos_start, node.pos_end)
+    return None
+
+
+# a literal node standing for value in place of node.  Its token carries the positions the
+# interpreter would have given the computed value, which are not always node's own (the
+# result of 1 + 2 is placed at the 1, that of 1 < 2 nowhere), so that an error involving the
+# value later reads exactly the same.
+def literal_node(value, node):
+    if isinstance(value, Number):
+        if isinstance(value.value, int) and value.value.bit_length() > MAX_FOLDED_SIZE:
+            return node
+        cls = NumberNode
+    elif isinstance(value, String):
+        if len(value.value) > MAX_FOLDED_SIZE:
+            return node
+        cls = StringNode
+    else:
+        return node
+    tok = Token(value.type, value.value)
+    tok.pos_start, tok.pos_end = value.pos_start, value.pos_end
+    return cls(tok)
+
+
+# evaluate an operator on two literals exactly as the interpreter does; operations that fail,
+# such as division by zero or 0 ^ -1, are left in place to fail the same way at runtime
+def fold_binary(node):
+    method = FOLD_METHODS.get(node.op_tok.type)
+    left = literal_value(node.left_node)
+    right = literal_value(node.right_node)
+    if method is None or left is None or right is None:
+        return node
+    if isinstance(left, String) and (node.op_tok.type not in STRING_FOLDS or not isinstance(right, String)):
+        return node
+    if isinstance(left, Number) and not isinstance(right, Number):
+        return node
+    try:
+        result, error = getattr(left, method)(right)
+    except Exception:
+        return node
+    if error or result is None:
+        return node
+    return literal_node(result, node)
+
+
+def fold_unary(node):
+    number = literal_value(node.node)
+    if not isinstance(number, Number):
+        return node
+    error = None
+    try:
+        if node.op_tok.type == 'MNS':
+            number, error = number.mul(Number(-1))
+        if node.op_tok.type == 'NOT':
+            number, error = number.lognot(Number(-1))
+    except Exception:
+        return node
+    if error:
+        return node
+    return literal_node(number.set_pos(node.pos_start, node.pos_end), node)
+
+
+# An expression whose value is reused.  The first evaluation after key was reset stores the
+# value under key and later ones return a copy of it.  Nodes for the same repeated
+# subexpression share a key.  A copy gets what a fresh evaluation of expr would give the value
+# and the stored one may not have: the position of anchor, the node the result of the arithmetic
+# takes it from, and, unless shared is set, a triggers list of its own instead of the one the
+# value shares with a variable.
+class InvariantNode(Node):
+    __slots__ = ('expr', 'key', 'anchor', 'shared', 'pos_start', 'pos_end')
+
+    def __init__(self, expr, key):
+        setfield(self, 'expr', expr)
+        setfield(self, 'key', key)
+        anchor, shared = origin(expr)
+        setfield(self, 'anchor', anchor)
+        setfield(self, 'shared', shared)
+        setfield(self, 'pos_start', expr.pos_start)
+        setfield(self, 'pos_end', expr.pos_end)
+
+    def __repr__(self):
+        return f'<{self.key}: {self.expr}>'
+
+
+# Runs node after forgetting the values stored under keys: a loop, whose invariants are
+# computed afresh each time it starts, or an expression, whose repeated subexpressions are
+# computed afresh each time it is evaluated.
+class ResetNode(Node):
+    __slots__ = ('node', 'keys', 'pos_start', 'pos_end')
+
+    def __init__(self, node, keys):
+        setfield(self, 'node', node)
+        setfield(self, 'keys', tuple(keys))
+        setfield(self, 'pos_start', node.pos_start)
+        setfield(self, 'pos_end', node.pos_end)
+
+    def __repr__(self):
+        return f'{self.node}'
+
+
+# keys are never reused, so trees optimized separately (modules, lazily parsed bodies) can run
+# in the same interpreter
+invariant_keys = itertools.count()
+
+# the operators whose Number result is a copy of the left operand
+ARITHMETIC = frozenset(('PLS', 'MNS', 'MUL', 'DIV', 'MOD', 'POW'))
+
+# the unary operators whose result is a new value; unary plus hands back its operand itself,
+# which may be a float where a copy would be an int
+STORED_UNARY = frozenset(('MNS', 'NOT'))
+
+# the fields of each node evaluated in the node's own context; the right of '.' is evaluated
+# in a struct's, and property and container access are left alone altogether
+EVALUATED_FIELDS = {UnaryOpNode: ('node',), CapsuleNode: ('elements',), ListNode: ('elements',),
+                    MapNode: ('elements',), CallNode: ('node_to_call', 'arg_nodes'),
+                    VarAssignNode: ('value_node',), ReturnNode: ('return_node',),
+                    IfNode: ('cases', 'else_case'),
+                    ForNode: ('start_value_node', 'end_value_node', 'step_value_node', 'body_node'),
+                    WhileNode: ('condition_node', 'body_node'), ResetNode: ('node',)}
+
+# the fields holding a whole expression, whose repeated subexpressions are shared
+EXPRESSION_FIELDS = {VarAssignNode: ('value_node',), ReturnNode: ('return_node',),
+                     WhileNode: ('condition_node',),
+                     ForNode: ('start_value_node', 'end_value_node', 'step_value_node'),
+                     CapsuleNode: ('elements',)}
+
+# nodes that run statements or assign; in an expression without them, every occurrence of a
+# subexpression has the same value
+STATEMENT_NODES = (VarAssignNode, ReferenceAssignNode, PropertyAssignNode, IfNode, ForNode,
+                   WhileNode, WhenNode, FunctionDefinitionNode, StructDefinitionNode, UseNode,
+                   LazyBlockNode)
+
+
+def evaluated_fields(node):
+    if isinstance(node, BinOpNode):
+        return ('left_node',) if node.op_tok.type == 'DOT' else ('left_node', 'right_node')
+    return EVALUATED_FIELDS.get(type(node), ())
+
+
+# the key of an operator expression over literals and variables whose value is worth storing,
+# equal for two expressions exactly when they compute the same value; None for any other node
+def stored_key(node):
+    if isinstance(node, BinOpNode) and node.op_tok.type in FOLD_METHODS or \
+            isinstance(node, UnaryOpNode) and node.op_tok.type in STORED_UNARY:
+        return pure_key(node)
+    return None
+
+
+def pure_key(node):
+    if isinstance(node, VarAccessNode):
+        return ('var', node.var_name_tok.value)
+    if isinstance(node, (NumberNode, StringNode)):
+        # folded literals can have no position, which is then also their value's
+        value = node.tok.value
+        return ('lit', node.tok.type, type(value).__name__, value, node.pos_start is None)
+    if isinstance(node, InvariantNode):
+        return pure_key(node.expr)
+    if isinstance(node, CapsuleNode) and len(node.elements) == 1:
+        inner = pure_key(node.elements[0])
+        return inner and ('()', inner)
+    if isinstance(node, UnaryOpNode) and node.op_tok.type in STORED_UNARY:
+        inner = pure_key(node.node)
+        return inner and (node.op_tok.type, inner)
+    if isinstance(node, BinOpNode) and node.op_tok.type in FOLD_METHODS:
+        left = pure_key(node.left_node)
+        right = left and pure_key(node.right_node)
+        return right and (node.op_tok.type, left, right)
+    return None
+
+
+# the names an expression accepted by pure_key reads
+def read_names(node, names):
+    if isinstance(node, VarAccessNode):
+        names.add(node.var_name_tok.value)
+    elif isinstance(node, InvariantNode):
+        read_names(node.expr, names)
+    elif isinstance(node, CapsuleNode):
+        read_names(node.elements[0], names)
+    elif isinstance(node, UnaryOpNode):
+        read_names(node.node, names)
+    elif isinstance(node, BinOpNode):
+        read_names(node.left_node, names)
+        read_names(node.right_node, names)
+    return names
+
+
+# where the Number an expression evaluates to gets its position and triggers list: the node
+# whose position it has, or None if it has none, and whether its triggers list is a variable's.
+# Arithmetic copies its left operand; comparisons, logical operators and literals make new
+# numbers; parentheses and unary operators place their value at themselves.  (Strings are
+# always new.)
+def origin(node):
+    while isinstance(node, BinOpNode) and node.op_tok.type in ARITHMETIC:
+        node = node.left_node
+    if isinstance(node, BinOpNode):
+        return None, False
+    if isinstance(node, InvariantNode):
+        return node.anchor, node.shared
+    if isinstance(node, CapsuleNode):
+        return node, origin(node.elements[0])[1]
+    if isinstance(node, UnaryOpNode):
+        return node, node.op_tok.type == 'MNS' and origin(node.node)[1]
+    return node, isinstance(node, VarAccessNode)
+
+
+# add the names node may assign while it runs to names; returns False if that cannot be known.
+# Function and struct bodies are not entered: they run in a symbol table of their own, so a
+# call never assigns the caller's variables.  Neither are the bodies of when, which may run
+# after any assignment at all; the interpreter discards stored values whenever one has run.
+def assigned_names(node, names):
+    if isinstance(node, tuple):
+        return all(assigned_names(v, names) for v in node)
+    if not isinstance(node, Node):
+        return True
+    if isinstance(node, (FunctionDefinitionNode, StructDefinitionNode)):
+        if node.var_name_tok:
+            names.add(node.var_name_tok.value)
+        return True
+    if isinstance(node, (WhenNode, LazyBlockNode, InvariantNode)):
+        return True
+    if isinstance(node, UseNode):
+        # a module runs in the current context
+        return node.fname.value == 'static'
+    if isinstance(node, PropertyAssignNode):
+        return False
+    if isinstance(node, (VarAssignNode, ForNode)):
+        names.add(node.var_name_tok.value)
+    if isinstance(node, ReferenceAssignNode):
+        # the value changed in place is inside the variable the target starts at
+        root = node.target_node.head
+        while isinstance(root, (PropertyAccessNode, ContainerAccessNode)):
+            root = root.root_var
+        if not isinstance(root, VarAccessNode):
+            return False
+        names.add(root.var_name_tok.value)
+    return all(assigned_names(getattr(node, name), names)
+               for name in type(node).__slots__ if hasattr(node, name))
+
+
+def contains(node, classes):
+    if isinstance(node, tuple):
+        return any(contains(v, classes) for v in node)
+    if not isinstance(node, Node):
+        return False
+    return isinstance(node, classes) or any(contains(getattr(node, name), classes)
+                                            for name in type(node).__slots__ if hasattr(node, name))
+
+
+# count the operator expressions in node, by stored_key, down to the first one on each path
+def count_keys(node, counts):
+    if isinstance(node, tuple):
+        for v in node:
+            count_keys(v, counts)
+        return
+    key = stored_key(node)
+    if key is not None:
+        counts[key] = counts.get(key, 0) + 1
+    for name in evaluated_fields(node):
+        count_keys(getattr(node, name), counts)
+
+
+# node with each outermost operator expression whose key satisfies wanted replaced by an
+# InvariantNode; shared maps keys to the InvariantNode keys given out, which are added to keys
+def replace_keys(node, wanted, shared, keys):
+    if isinstance(node, tuple):
+        items = tuple(replace_keys(v, wanted, shared, keys) for v in node)
+        return node if all(a is b for a, b in zip(items, node)) else items
+    key = stored_key(node)
+    if key is not None and wanted(node, key):
+        if key not in shared:
+            shared[key] = next(invariant_keys)
+            keys.append(shared[key])
+        return InvariantNode(node, shared[key])
+    changes = {}
+    for name in evaluated_fields(node):
+        value = getattr(node, name)
+        new = replace_keys(value, wanted, shared, keys)
+        if new is not value:
+            changes[name] = new
+    return rebuilt(node, changes) if changes else node
+
+
+# Loop-invariant code motion and common subexpression elimination.
+#
+# In a loop, an operator expression over literals and variables the loop never assigns is
+# invariant: it becomes an InvariantNode and the loop is wrapped in a ResetNode, so that it is
+# computed once per run of the loop.  In an expression, an operator expression that occurs more
+# than once is computed once per evaluation.  Either way the value is computed where the
+# expression stands, the first time it is reached, so code that is never reached or fails
+# earlier behaves as before.
+#
+# What keeps this exact:
+#   - assigned_names finds every variable a loop may assign, and so every one it may change
+#   - calls cannot assign the caller's variables, and when bodies are checked for at runtime
+#   - the interpreter only stores numbers and strings, which nothing changes in place, and
+#     nothing in struct contexts, where reading a variable moves the value itself
+#   - when conditions, reference targets and anything evaluated in another context are left
+#     alone; function bodies are optimized on their own, as they run apart from the loop
+class Hoister:
+    def visit(self, node):
+        if isinstance(node, tuple):
+            items = tuple(self.visit(v) for v in node)
+            return node if all(a is b for a, b in zip(items, node)) else items
+        if not isinstance(node, Node) or isinstance(node, (LazyBlockNode, WhenNode, ReferenceAccessNode,
+                                                           StructDefinitionNode, InvariantNode)):
+            # lazy bodies are optimized once parsed, like any other tree
+            return node
+
+        keys = []
+        if isinstance(node, (ForNode, WhileNode)):
+            node = self.hoist_loop(node, keys)
+
+        roots = EXPRESSION_FIELDS.get(type(node), ())
+        changes = {}
+        for name in type(node).__slots__:
+            if hasattr(node, name):
+                value = getattr(node, name)
+                new = self.visit(value)
+                if name in roots:
+                    new = self.share_all(new)
+                if new is not value:
+                    changes[name] = new
+        if isinstance(node, IfNode):
+            cases = changes.get('cases', node.cases)
+            new = tuple((self.share(c), e, r) for c, e, r in cases)
+            if any(a[0] is not b[0] for a, b in zip(new, cases)):
+                changes['cases'] = new
+        if changes:
+            node = rebuilt(node, changes)
+        return ResetNode(node, keys) if keys else node
+
+    # the loop with its invariant expressions replaced, their keys added to keys
+    def hoist_loop(self, node, keys):
+        fields = ('body_node',) if isinstance(node, ForNode) else ('condition_node', 'body_node')
+        assigned = set()
+        if isinstance(node, ForNode):
+            assigned.add(node.var_name_tok.value)
+        if not all(assigned_names(getattr(node, name), assigned) for name in fields):
+            return node
+
+        def invariant(expr, key):
+            return not read_names(expr, set()) & assigned
+
+        changes = {}
+        for name in fields:
+            value = getattr(node, name)
+            new = replace_keys(value, invariant, {}, keys)
+            if new is not value:
+                changes[name] = new
+        return rebuilt(node, changes) if changes else node
+
+    def share_all(self, value):
+        if isinstance(value, tuple):
+            items = tuple(self.share(v) for v in value)
+            return value if all(a is b for a, b in zip(items, value)) else items
+        return self.share(value)
+
+    # expr with its repeated operator expressions computed once per evaluation
+    def share(self, expr):
+        if not isinstance(expr, Node) or contains(expr, STATEMENT_NODES):
+            return expr
+        counts = {}
+        count_keys(expr, counts)
+        if all(n == 1 for n in counts.values()):
+            return expr
+        keys = []
+        expr = replace_keys(expr, lambda e, key: counts[key] > 1, {}, keys)
+        return ResetNode(expr, keys)
+
+
+# A call to a one-line function that runs its body in place.  name is the variable called and
+# body the body of the definition the call was found to refer to; the interpreter only runs it
+# while name still holds a function made from that definition, and otherwise runs call.
+class InlineCallNode(Node):
+    __slots__ = ('call', 'name', 'body', 'arg_names', 'pos_start', 'pos_end')
+
+    def __init__(self, call, definition):
+        setfield(self, 'call', call)
+        setfield(self, 'name', definition.var_name_tok.value)
+        setfield(self, 'body', definition.body_node)
+        setfield(self, 'arg_names', tuple(a.value for a in definition.arg_name_toks))
+        setfield(self, 'pos_start', call.pos_start)
+        setfield(self, 'pos_end', call.pos_end)
+
+    def __repr__(self):
+        return f'{self.call}'
+
+
+# the nodes a function body may be made of to be inlined: expressions that compute from
+# variables and literals, and so cannot call anything, the function itself included, assign,
+# or break out of the body
+INLINED_NODES = (NumberNode, StringNode, VarAccessNode, BinOpNode, UnaryOpNode, CapsuleNode,
+                 ListNode, InvariantNode, ResetNode)
+
+
+def inlinable(node):
+    if isinstance(node, tuple):
+        return all(inlinable(v) for v in node)
+    if not isinstance(node, Node):
+        return True
+    if not isinstance(node, INLINED_NODES) or isinstance(node, BinOpNode) and node.op_tok.type == 'DOT':
+        return False
+    return all(inlinable(getattr(node, name)) for name in type(node).__slots__ if hasattr(node, name))
+
+
+# add a (name, node) pair to found for each statement in a scope that binds a name: definitions,
+# assignments and loop variables.  Function and struct bodies are scopes of their own.
+def bindings(node, found):
+    if isinstance(node, tuple):
+        for v in node:
+            bindings(v, found)
+        return
+    if not isinstance(node, Node) or isinstance(node, (LazyBlockNode, ReferenceAccessNode)):
+        return
+    if isinstance(node, (FunctionDefinitionNode, StructDefinitionNode)):
+        if node.var_name_tok:
+            found.append((node.var_name_tok.value, node))
+        return
+    if isinstance(node, (VarAssignNode, ForNode)):
+        found.append((node.var_name_tok.value, node))
+    for name in type(node).__slots__:
+        if hasattr(node, name):
+            bindings(getattr(node, name), found)
+
+
+# Inlining of one-line functions.
+#
+# A function defined as .f [x y] <~ expr, whose body inlinable accepts, is stable in a scope
+# when that definition is the only statement of the scope that binds f.  A call f(a b) in the
+# scope with as many arguments as f has parameters becomes an InlineCallNode: the interpreter
+# evaluates the arguments and the body itself, in the context the call would have made, and
+# skips copying the function, a new interpreter and checking the arguments.
+#
+# The binding is only known not to change in the scope; a module run by use or a when body
+# declared elsewhere may still assign f, and a call may run before the definition.  The
+# interpreter guards each inlined call on the function it finds under f, and makes a real call
+# for any other value.  Struct bodies are left alone, as calls in a struct's context see
+# variables as they are rather than copies of them.
+class Inliner:
+    def visit(self, node):
+        found = []
+        bindings(node, found)
+        counts = {}
+        for name, _ in found:
+            counts[name] = counts.get(name, 0) + 1
+        self.stable = {name: d for name, d in found
+                       if counts[name] == 1 and isinstance(d, FunctionDefinitionNode) and d.auto_return
+                       and not isinstance(d.body_node, LazyBlockNode) and inlinable(d.body_node)}
+        return self.rewrite(node)
+
+    def rewrite(self, node):
+        if isinstance(node, tuple):
+            items = tuple(self.rewrite(v) for v in node)
+            return node if all(a is b for a, b in zip(items, node)) else items
+        if not isinstance(node, Node) or isinstance(node, (LazyBlockNode, ReferenceAccessNode,
+                                                           StructDefinitionNode, InvariantNode)):
+            return node
+        if isinstance(node, FunctionDefinitionNode):
+            body = Inliner().visit(node.body_node)
+            return node if body is node.body_node else rebuilt(node, {'body_node': body})
+
+        changes = {}
+        for name in type(node).__slots__:
+            if hasattr(node, name):
+                value = getattr(node, name)
+                new = self.rewrite(value)
+                if new is not value:
+                    changes[name] = new
+        if changes:
+            node = rebuilt(node, changes)
+        if isinstance(node, CallNode) and isinstance(node.node_to_call, VarAccessNode):
+            definition = self.stable.get(node.node_to_call.var_name_tok.value)
+            if definition and len(definition.arg_name_toks) == len(node.arg_nodes):
+                return InlineCallNode(node, definition)
+        return node
@@ -1,24 +1,70 @@
 from errors import *
-from lexer import Token
+from lexer import Token, OPNAMES
 
 
-class NumberNode:
-    def __init__(self, tok):
-        self.tok = tok
 
-        self.pos_start = self.tok.pos_start
-        self.pos_end = self.tok.pos_end
+# Base of the tree nodes.  Nodes keep their fields in __slots__ and their children in tuples,
+# and a tree never changes once it is built: fields are written only by __init__, through
+# setfield, and assigning to one later raises.  This keeps the tree small and lets caches and
+# later passes share subtrees freely.  The single-token leaves, by far the most common nodes,
+# are built without their positions (see LeafNode).
+class Node:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} nodes are immutable')
+
+    # copying a value that holds a tree, such as a struct's functions, shares the tree
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+setfield = object.__setattr__
+
+
+# Base of the nodes that something keeps by weak reference while they run (see
+# Interpreter.quickened), so that it goes with the tree.  The slot is declared here rather than
+# with the fields, which are a node class's own __slots__.
+class WeakNode(Node):
+    __slots__ = ('__weakref__',)
+
+
+# Base of the single-token leaves.  A leaf takes its positions from its token the first time
+# they are asked for and keeps them from then on, so a tree that never runs resolves none, and
+# one that runs reads them as directly as any other node's.  The slots are declared here rather
+# than with the fields, which are a node class's own __slots__, so passes over the fields leave
+# them to be taken from the token again.
+class LeafNode(Node):
+    __slots__ = ('pos_start', 'pos_end')
+    # the field holding the token
+    token_field = 'tok'
+
+    def __getattr__(self, name):
+        if name == 'pos_start' or name == 'pos_end':
+            location = getattr(getattr(self, self.token_field), name)
+            setfield(self, name, location)
+            return location
+        raise AttributeError(name)
+
+
+class NumberNode(LeafNode):
+    __slots__ = ('tok',)
+
+    def __init__(self, tok):
+        setfield(self, 'tok', tok)
 
     def __repr__(self):
         return f'{self.tok}'
 
 
-class StringNode:
-    def __init__(self, tok):
-        self.tok = tok
+class StringNode(LeafNode):
+    __slots__ = ('tok',)
 
-        self.pos_start = self.tok.pos_start
-        self.pos_end = self.tok.pos_end
+    def __init__(self, tok):
+        setfield(self, 'tok', tok)
 
     def __repr__(self):
         return f'"{self.tok}"'
@@ -27,274 +73,398 @@ class StringNode:
         return f'"{self.tok}"'
 
 
-class CapsuleNode:
+class CapsuleNode(Node):
+    __slots__ = ('elements', 'pos_start', 'pos_end')
+
     def __init__(self, element_nodes, pos_start, pos_end):
-        self.elements = element_nodes
+        setfield(self, 'elements', tuple(element_nodes))
+
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
 
-        self.pos_start = pos_start
-        self.pos_end = pos_end
 
+class ListNode(Node):
+    __slots__ = ('elements', 'pos_start', 'pos_end')
 
-class ListNode:
     def __init__(self, element_nodes, pos_start, pos_end):
-        self.elements = element_nodes
+        setfield(self, 'elements', tuple(element_nodes))
+
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
 
-        self.pos_start = pos_start
-        self.pos_end = pos_end
 
+# elements is a tuple of (key node, value node) pairs in source order
+class MapNode(Node):
+    __slots__ = ('elements', 'pos_start', 'pos_end')
 
-class MapNode:
     def __init__(self, elements, pos_start, pos_end):
-        self.elements = elements
+        setfield(self, 'elements', tuple(elements.items()))
 
-        self.pos_start = pos_start
-        self.pos_end = pos_end
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
 
 
-class UseNode:
+class UseNode(Node):
+    __slots__ = ('fname', 'pos_start', 'pos_end')
+
     def __init__(self, fname):
-        self.fname = fname
+        setfield(self, 'fname', fname)
 
-        self.pos_start = self.fname.pos_start
-        self.pos_end = self.fname.pos_end
+        setfield(self, 'pos_start', fname.pos_start)
+        setfield(self, 'pos_end', fname.pos_end)
 
     def __repr__(self):
         return f'<{self.fname}>'
 
 
-class VarAccessNode:
-    def __init__(self, var_name_tok):
-        self.var_name_tok = var_name_tok
+class VarAccessNode(LeafNode):
+    __slots__ = ('var_name_tok',)
+    token_field = 'var_name_tok'
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.var_name_tok.pos_end
+    def __init__(self, var_name_tok):
+        setfield(self, 'var_name_tok', var_name_tok)
 
     def __repr__(self):
         return f'{self.var_name_tok}'
 
 
-class ReferenceAccessNode:
+class ReferenceAccessNode(Node):
+    __slots__ = ('head', 'pos_start', 'pos_end')
+
     def __init__(self, head):
-        self.head = head
+        setfield(self, 'head', head)
 
-        self.pos_start = self.head.specifier.pos_start
-        self.pos_end = self.head.specifier.pos_end
+        setfield(self, 'pos_start', head.specifier.pos_start)
+        setfield(self, 'pos_end', head.specifier.pos_end)
 
     def __repr__(self):
         return f'{self.head}'
 
-class PropertyAccessNode:
+class PropertyAccessNode(Node):
+    __slots__ = ('root_var', 'specifier', 'pos_start', 'pos_end')
+
     def __init__(self, root_var_tok, specifier):
-        self.root_var = root_var_tok
-        self.specifier = specifier
+        setfield(self, 'root_var', root_var_tok)
+        setfield(self, 'specifier', specifier)
 
-        self.pos_start = self.root_var.pos_start
-        self.pos_end = self.root_var.pos_end
+        setfield(self, 'pos_start', root_var_tok.pos_start)
+        setfield(self, 'pos_end', root_var_tok.pos_end)
 
     def __repr__(self):
         return f'{self.root_var} ~> {self.specifier}'
 
 
-class PropertyProbeNode:
+class PropertyProbeNode(Node):
+    __slots__ = ('root_var', 'child_var', 'value', 'pos_start', 'pos_end')
+
     def __init__(self, node, value):
-        self.root_var = node.root_var
-        self.child_var = node.child_var
-        self.value = value
+        setfield(self, 'root_var', node.root_var)
+        setfield(self, 'child_var', node.child_var)
+        setfield(self, 'value', value)
 
-        self.pos_start = self.root_var.pos_start
-        self.pos_end = self.root_var.pos_end
+        setfield(self, 'pos_start', node.root_var.pos_start)
+        setfield(self, 'pos_end', node.root_var.pos_end)
 
     def __repr__(self):
         return f'{self.root_var} ~> {self.child_var}'
 
 
-class PropertyAssignNode:
+class PropertyAssignNode(Node):
+    __slots__ = ('propaccess_node', 'value')
+
     def __init__(self, propaccess_node):
-        self.propaccess_node = propaccess_node
-        self.value = None
+        setfield(self, 'propaccess_node', propaccess_node)
+        setfield(self, 'value', None)
 
     def __repr__(self):
         return f'{self.root_var} ~> {self.child_var}'
 
 
-class ContainerAccessNode:
+class ContainerAccessNode(Node):
+    __slots__ = ('root_var', 'specifier', 'pos_start', 'pos_end')
+
     def __init__(self, root_var_tok, specifier_tok):
-        self.root_var = root_var_tok
-        self.specifier = specifier_tok
+        setfield(self, 'root_var', root_var_tok)
+        setfield(self, 'specifier', specifier_tok)
 
-        self.pos_start = self.root_var.pos_start
-        self.pos_end = self.root_var.pos_end
+        setfield(self, 'pos_start', root_var_tok.pos_start)
+        setfield(self, 'pos_end', root_var_tok.pos_end)
 
     def __repr__(self):
         return f'{self.root_var} ~> {self.specifier}'
 
 
-class ReferenceAssignNode:
+class ReferenceAssignNode(Node):
+    __slots__ = ('target_node', 'value_node')
+
     def __init__(self, target_node, value_node):
-        self.target_node = target_node
-        self.value_node = value_node
+        setfield(self, 'target_node', target_node)
+        setfield(self, 'value_node', value_node)
 
         # self.pos_start = self.target_node.pos_start
         # self.pos_end = self.target_node.pos_end
 
 
-class VarAssignNode:
+class VarAssignNode(Node):
+    __slots__ = ('var_name_tok', 'op_tok', 'value_node', 'const', 'statictype', 'pos_start', 'pos_end')
+
     def __init__(self, var_name_tok, op_tok, value_node,
                  const=False, statictype=None):
-        self.var_name_tok = var_name_tok
-        self.op_tok = op_tok
-        self.value_node = value_node
-        self.const = const
-        self.statictype = statictype
+        setfield(self, 'var_name_tok', var_name_tok)
+        setfield(self, 'op_tok', op_tok)
+        setfield(self, 'value_node', value_node)
+        setfield(self, 'const', const)
+        setfield(self, 'statictype', statictype)
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.value_node.pos_end
+        setfield(self, 'pos_start', var_name_tok.pos_start)
+        setfield(self, 'pos_end', value_node.pos_end)
 
     def __repr__(self):
         return f'({self.var_name_tok} {self.op_tok} {self.value_node})'
 
 
-class BinOpNode:
+class BinOpNode(WeakNode):
+    __slots__ = ('left_node', 'op_tok', 'right_node', 'pos_start', 'pos_end')
+
     def __init__(self, left_node, op_tok, right_node):
-        self.left_node = left_node
-        self.op_tok = op_tok
-        self.right_node = right_node
+        setfield(self, 'left_node', left_node)
+        setfield(self, 'op_tok', op_tok)
+        setfield(self, 'right_node', right_node)
 
-        self.pos_start = self.left_node.pos_start
-        self.pos_end = self.right_node.pos_end
+        setfield(self, 'pos_start', left_node.pos_start)
+        setfield(self, 'pos_end', right_node.pos_end)
 
     def __repr__(self):
         return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
 
-class UnaryOpNode:
+class UnaryOpNode(Node):
+    __slots__ = ('op_tok', 'node', 'pos_start', 'pos_end')
+
     def __init__(self, op_tok, node):
-        self.op_tok = op_tok
-        self.node = node
+        setfield(self, 'op_tok', op_tok)
+        setfield(self, 'node', node)
 
-        self.pos_start = self.op_tok.pos_start
-        self.pos_end = node.pos_end
+        setfield(self, 'pos_start', op_tok.pos_start)
+        setfield(self, 'pos_end', node.pos_end)
 
     def __repr__(self):
         return f'({self.op_tok}, {self.node})'
 
 
-class IfNode:
+# cases is a tuple of (condition, body, is block) triples; else_case a (body, is block) pair
+class IfNode(Node):
+    __slots__ = ('cases', 'else_case', 'pos_start', 'pos_end')
+
     def __init__(self, cases, else_case):
-        self.cases = cases
-        self.else_case = else_case
+        cases = tuple(map(tuple, cases))
+        else_case = else_case and tuple(else_case)
+        setfield(self, 'cases', cases)
+        setfield(self, 'else_case', else_case)
+
+        setfield(self, 'pos_start', cases[0][0].pos_start)
+        setfield(self, 'pos_end', (else_case or cases[len(cases) - 1])[0].pos_end)
 
-        self.pos_start = self.cases[0][0].pos_start
-        self.pos_end = (self.else_case or self.cases[len(self.cases) - 1])[0].pos_end
 
+class ForNode(Node):
+    __slots__ = ('var_name_tok', 'start_value_node', 'end_value_node', 'step_value_node', 'body_node',
+                 'should_return_null', 'pos_start', 'pos_end')
 
-class ForNode:
     def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null):
-        self.var_name_tok = var_name_tok
-        self.start_value_node = start_value_node
-        self.end_value_node = end_value_node
-        self.step_value_node = step_value_node
-        self.body_node = body_node
-        self.should_return_null = should_return_null
+        setfield(self, 'var_name_tok', var_name_tok)
+        setfield(self, 'start_value_node', start_value_node)
+        setfield(self, 'end_value_node', end_value_node)
+        setfield(self, 'step_value_node', step_value_node)
+        setfield(self, 'body_node', body_node)
+        setfield(self, 'should_return_null', should_return_null)
+
+        setfield(self, 'pos_start', var_name_tok.pos_start)
+        setfield(self, 'pos_end', body_node.pos_end)
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.body_node.pos_end
 
+class WhileNode(Node):
+    __slots__ = ('condition_node', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
 
-class WhileNode:
     def __init__(self, condition_node, body_node, should_return_null):
-        self.condition_node = condition_node
-        self.body_node = body_node
-        self.should_return_null = should_return_null
+        setfield(self, 'condition_node', condition_node)
+        setfield(self, 'body_node', body_node)
+        setfield(self, 'should_return_null', should_return_null)
 
-        self.pos_start = self.condition_node.pos_start
-        self.pos_end = self.body_node.pos_end
+        setfield(self, 'pos_start', condition_node.pos_start)
+        setfield(self, 'pos_end', body_node.pos_end)
 
 
-class WhenNode:
+class WhenNode(Node):
+    __slots__ = ('condition_node', 'target', 'body_node', 'should_return_null', 'pos_start', 'pos_end')
+
     def __init__(self, condition_node, body_node, should_return_null):
-        self.condition_node = condition_node
-        self.target = condition_node.left_node.var_name_tok.value
+        setfield(self, 'condition_node', condition_node)
+        setfield(self, 'target', condition_node.left_node.var_name_tok.value)
+
+        setfield(self, 'body_node', body_node)
+        setfield(self, 'should_return_null', should_return_null)
 
-        self.body_node = body_node
-        self.should_return_null = should_return_null
+        setfield(self, 'pos_start', condition_node.pos_start)
+        setfield(self, 'pos_end', body_node.pos_end)
 
-        self.pos_start = self.condition_node.pos_start
-        self.pos_end = self.body_node.pos_end
 
+class ContinueNode(Node):
+    __slots__ = ('pos_start', 'pos_end')
 
-class ContinueNode:
     def __init__(self, pos_start, pos_end):
-        self.pos_start = pos_start
-        self.pos_end = pos_end
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
+
 
+class BreakNode(Node):
+    __slots__ = ('pos_start', 'pos_end')
 
-class BreakNode:
     def __init__(self, pos_start, pos_end):
-        self.pos_start = pos_start
-        self.pos_end = pos_end
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
 
 
-class ReturnNode:
+class ReturnNode(Node):
+    __slots__ = ('return_node', 'pos_start', 'pos_end')
+
     def __init__(self, return_node, pos_start, pos_end):
-        self.return_node = return_node
-        self.pos_start = pos_start
-        self.pos_end = pos_end
+        setfield(self, 'return_node', return_node)
+        setfield(self, 'pos_start', pos_start)
+        setfield(self, 'pos_end', pos_end)
+
 
+class FunctionDefinitionNode(Node):
+    __slots__ = ('var_name_tok', 'arg_name_toks', 'body_node', 'auto_return', 'pos_start', 'pos_end')
 
-class FunctionDefinitionNode:
     def __init__(self, var_name_tok, arg_name_toks, body_node, auto_return):
-        self.var_name_tok = var_name_tok
-        self.arg_name_toks = arg_name_toks
-        self.body_node = body_node
-        self.auto_return = auto_return
-
-        if self.var_name_tok:
-            self.pos_start = self.var_name_tok.pos_start
-        elif len(self.arg_name_toks) > 0:
-            self.pos_start = self.arg_name_toks[0].pos_start
+        setfield(self, 'var_name_tok', var_name_tok)
+        setfield(self, 'arg_name_toks', tuple(arg_name_toks))
+        setfield(self, 'body_node', body_node)
+        setfield(self, 'auto_return', auto_return)
+
+        if var_name_tok:
+            setfield(self, 'pos_start', var_name_tok.pos_start)
+        elif len(arg_name_toks) > 0:
+            setfield(self, 'pos_start', arg_name_toks[0].pos_start)
         else:
-            self.pos_start = self.body_node.pos_start
+            setfield(self, 'pos_start', body_node.pos_start)
+
+        setfield(self, 'pos_end', body_node.pos_end)
 
-        self.pos_end = self.body_node.pos_end
 
+class CallNode(Node):
+    __slots__ = ('node_to_call', 'arg_nodes', 'pos_start', 'pos_end')
 
-class CallNode:
     def __init__(self, node_to_call, arg_nodes):
-        self.node_to_call = node_to_call
-        self.arg_nodes = arg_nodes
+        setfield(self, 'node_to_call', node_to_call)
+        setfield(self, 'arg_nodes', tuple(arg_nodes))
 
-        self.pos_start = self.node_to_call.pos_start
+        setfield(self, 'pos_start', node_to_call.pos_start)
 
-        if len(self.arg_nodes) > 0:
-            self.pos_end = self.arg_nodes[len(self.arg_nodes) - 1].pos_end
+        if len(arg_nodes) > 0:
+            setfield(self, 'pos_end', arg_nodes[len(arg_nodes) - 1].pos_end)
         else:
-            self.pos_end = self.node_to_call.pos_end
+            setfield(self, 'pos_end', node_to_call.pos_end)
 
 
-class StructDefinitionNode:
+class StructDefinitionNode(Node):
+    __slots__ = ('var_name_tok', 'arg_name_toks', 'body_node', 'auto_return', 'pos_start', 'pos_end')
+
     def __init__(self, var_name_tok, arg_name_toks, body_node, auto_return):
-        self.var_name_tok = var_name_tok
-        self.arg_name_toks = arg_name_toks
-        self.body_node = body_node
-        self.auto_return = auto_return
-
-        if self.var_name_tok:
-            self.pos_start = self.var_name_tok.pos_start
-        elif len(self.arg_name_toks) > 0:
-            self.pos_start = self.arg_name_toks[0].pos_start
+        setfield(self, 'var_name_tok', var_name_tok)
+        setfield(self, 'arg_name_toks', tuple(arg_name_toks))
+        setfield(self, 'body_node', body_node)
+        setfield(self, 'auto_return', auto_return)
+
+        if var_name_tok:
+            setfield(self, 'pos_start', var_name_tok.pos_start)
+        elif len(arg_name_toks) > 0:
+            setfield(self, 'pos_start', arg_name_toks[0].pos_start)
         else:
-            self.pos_start = self.body_node.pos_start
+            setfield(self, 'pos_start', body_node.pos_start)
+
+        setfield(self, 'pos_end', body_node.pos_end)
+
+
+# stand-in for the body of a function or struct in lazy mode: the parser stepped over it,
+# keeping its tokens up to and including the closing 'end' or '}', and parses them only when
+# the body is first needed.  The outcome is kept in result, the one field written after
+# __init__.  A tree optimized at opt_level has its lazy bodies optimized the same way when
+# they are parsed.
+class LazyBlockNode(Node):
+    __slots__ = ('tokens', 'static', 'opt_level', 'result', 'pos_start', 'pos_end')
+
+    def __init__(self, tokens, static, opt_level=0):
+        setfield(self, 'tokens', tuple(tokens))
+        setfield(self, 'static', static)
+        setfield(self, 'opt_level', opt_level)
+        setfield(self, 'result', None)
+
+        setfield(self, 'pos_start', tokens[0].pos_start)
+        setfield(self, 'pos_end', tokens[-1].pos_end)
+
+    # the ParseResult for the body's statements, parsed on the first call.  Errors the parser
+    # raises rather than returns come back in the result too, as the error of that call.  The
+    # tokens are given an EOF after the closer, so the parser can look past it as it does in
+    # the whole file.
+    def parse(self):
+        if self.result is None:
+            closer = self.tokens[-1]
+            parser = Parser(list(self.tokens) + [Token('EOF', None, closer.pos_end, closer.pos_end)])
+            parser.static = self.static
+            try:
+                res = parser.statements()
+            except SyntaxError as error:
+                setfield(self, 'result', ParseResult().failure(error))
+                return self.result
+            if not res.error and parser.current_tok is not closer:
+                res.failure(InvalidSyntaxError(
+                    parser.current_tok.pos_start, parser.current_tok.pos_end,
+                    f"Expected '{closer.value}'"
+                ))
+            if not res.error and self.opt_level:
+                from optimizer import optimize
+                res.node = optimize(res.node, self.opt_level)
+            setfield(self, 'result', res)
+        return self.result
+
+    def __repr__(self):
+        return f'<lazy block of {len(self.tokens)} tokens>'
+
+# binding powers for the Pratt loop in Parser.binary_expr, for every operator type the lexer
+# produces: logical < comparison < additive < multiplicative, all left-associative.  Operators
+# with power 0 are not infix operators and end an expression; POWER_OPS are right-associative
+# and bind tighter than all of these, and are handled in Parser.factor.
+LOGICAL_BP, COMPARE_BP, ARITH_BP, TERM_BP = 1, 2, 3, 4
+BINDING_POWER = dict.fromkeys(OPNAMES.values(), 0)
+BINDING_POWER.update(dict.fromkeys(('AND', 'OR', 'NAND', 'NOR', 'XOR'), LOGICAL_BP))
+BINDING_POWER.update(dict.fromkeys(('EQ', 'NE', 'LT', 'GT', 'LE', 'GE'), COMPARE_BP))
+BINDING_POWER.update(dict.fromkeys(('PLS', 'MNS'), ARITH_BP))
+BINDING_POWER.update(dict.fromkeys(('MUL', 'DIV', 'MOD'), TERM_BP))
+POWER_OPS = frozenset(('POW', 'LSLC', 'RSLC'))
+CALL_OR_POWER = POWER_OPS | {'LPR'}
+
+# atoms made of a single token
+LEAF_NODES = {'INT': NumberNode, 'FLT': NumberNode, 'STR': StringNode, 'SYM': VarAccessNode}
+
+# values naming a static type in a declaration
+TYPE_NAMES = frozenset(('int', 'flt', 'str', 'lst', 'map'))
+
+# tokens that close a block of statements; they can never start a statement
+BLOCK_END = frozenset((('KWD', 'end'), ('KWD', '!?'), ('KWD', '!'), ('RCR', '}')))
+
+# tokens that open a block closed by 'end' when a line break follows them
+BLOCK_OPENERS = frozenset((('OPS', ':'), ('INJ', '<~'), ('KWD', '!')))
 
-        self.pos_end = self.body_node.pos_end
 
 class ParseResult:
+    __slots__ = ('error', 'node', 'last_registered_advance_count', 'advance_count')
+
     def __init__(self):
         self.error = None
         self.node = None
         self.last_registered_advance_count = 0
         self.advance_count = 0
-        self.to_reverse_count = 0
 
     def register_advancement(self):
         self.last_registered_advance_count = 1
@@ -306,13 +476,6 @@ class ParseResult:
         if res.error: self.error = res.error
         return res.node
 
-    def try_register(self, res):
-        if res.error:
-            self.to_reverse_count = res.advance_count
-            # self.error = res.error
-            return None
-        return self.register(res)
-
     def success(self, node):
         self.node = node
         return self
@@ -323,20 +486,94 @@ class ParseResult:
         return self
 
 
+# token source for the parser: either a complete list of tokens or a lazy stream of them, e.g.
+# from Lexer.iter_tokens.  For streams only the tokens since the last commit point are kept, and
+# the tokens at the marks below it, which are all the parser can still back up to.
+class TokenStream:
+    def __init__(self, tokens):
+        self.buffer = tokens if isinstance(tokens, list) else []
+        self.source = None if isinstance(tokens, list) else iter(tokens)
+        # a list is the caller's and is left whole
+        self.owned = self.source is not None
+        self.offset = 0
+        self.marks = []
+        self.pinned = {}
+
+    # token at absolute index i, or None past the end of the stream
+    def get(self, i):
+        j = i - self.offset
+        if j < 0:
+            if i < 0:
+                return None
+            if i in self.pinned:
+                return self.pinned[i]
+            raise IndexError(f'Cannot back up to token {i}; stream was committed at token {self.offset}')
+        while j >= len(self.buffer) and self.source:
+            tok = next(self.source, None)
+            if tok is None:
+                self.source = None
+            else:
+                self.buffer.append(tok)
+        return self.buffer[j] if j < len(self.buffer) else None
+
+    # the parser may back up to token i until the matching release.  Having backed up, it only
+    # looks at that token before failing or finishing the block, so a mark keeps just its token
+    def mark(self, i):
+        self.marks.append(i)
+
+    def release(self):
+        i = self.marks.pop()
+        if i not in self.marks:
+            self.pinned.pop(i, None)
+
+    # the parser will not back up before token i again, except to a mark; release everything
+    # else before it
+    def commit(self, i):
+        drop = i - self.offset
+        if self.owned and drop > 0:
+            for m in self.marks:
+                if self.offset <= m < i:
+                    self.pinned[m] = self.buffer[m - self.offset]
+            del self.buffer[:drop]
+            self.offset = i
+
+
 class Parser:
-    def __init__(self, tokens, symbol_table=None):
+    # With lazy set, the bodies of multi-line functions and structs are not parsed but stepped
+    # over and left as LazyBlockNodes.
+    def __init__(self, tokens, symbol_table=None, lazy=False):
         self.warnings = []
-        self.tokens = tokens
+        self.lazy = lazy
+        self.tokens = TokenStream(tokens)
+        # the stream's buffer, which it only ever changes in place
+        self.buffer = self.tokens.buffer
         self.symbol_table = symbol_table
         self.static = False
         if symbol_table:
             if self.symbol_table.get('static-typing').is_true():
                 self.static = True
+        self.keyword_statements = {'use': self.use_statement,
+                                   'return': self.return_statement,
+                                   'continue': self.continue_statement,
+                                   'break': self.break_statement}
+        self.compound_rules = {('KWD', '?'): self.if_expr,
+                               ('KWD', 'if'): self.if_expr,
+                               ('KWD', 'for'): self.for_expr,
+                               ('KWD', 'while'): self.while_expr,
+                               ('KWD', 'when'): self.when_expr,
+                               ('DOT', '.'): self.func_def,
+                               ('OPS', ':'): self.struct_def}
         self.tok_idx = -1
         self.advance()
 
+    # runs once per token, so the buffered case reads the list here instead of calling through
+    # update_current_tok and TokenStream.get
     def advance(self):
-        self.tok_idx += 1
+        self.tok_idx = i = self.tok_idx + 1
+        j = i - self.tokens.offset
+        if 0 <= j < len(self.buffer):
+            self.current_tok = tok = self.buffer[j]
+            return tok
         self.update_current_tok()
         return self.current_tok
 
@@ -346,19 +583,31 @@ class Parser:
         return self.current_tok
 
     def update_current_tok(self):
-        if 0 <= self.tok_idx < len(self.tokens):
-            self.current_tok = self.tokens[self.tok_idx]
+        # read straight from the buffer when the token is already there
+        j = self.tok_idx - self.tokens.offset
+        if 0 <= j < len(self.tokens.buffer):
+            self.current_tok = self.tokens.buffer[j]
+            return
+        tok = self.tokens.get(self.tok_idx)
+        if tok is not None:
+            self.current_tok = tok
 
     def peek(self):
-        if self.tok_idx < len(self.tokens) - 1:
-            return self.tokens[self.tok_idx + 1]
+        j = self.tok_idx + 1 - self.tokens.offset
+        if 0 <= j < len(self.buffer):
+            return self.buffer[j]
+        return self.tokens.get(self.tok_idx + 1)
+
+    # whether the current token has the given type and value
+    def current_is(self, type_, value):
+        tok = self.current_tok
+        return tok.type == type_ and tok.value == value
 
     def parse(self):
-        res = self.statements()
-        if res.error:
-            return res
-        return res
+        return self.statements()
 
+    # the parser only backs up to the start of a statement that failed, so the token stream is
+    # committed before each statement and the start marked while it is parsed
     def statements(self):
         res = ParseResult()
         statements = []
@@ -387,13 +636,22 @@ class Parser:
             if self.current_tok.type == 'EOF':
                 more_statements = False
 
-            if not more_statements: break
-            statement = res.try_register(self.statement())
-            if not statement:
-                self.reverse(res.to_reverse_count)
+            tok = self.current_tok
+            if (tok.type, tok.value) in BLOCK_END:
                 more_statements = False
-                continue
-            statements.append(statement)
+
+            if not more_statements: break
+            self.tokens.commit(self.tok_idx)
+            # a line that does not parse as a statement ends the block; its tokens are left for
+            # whatever encloses it
+            self.tokens.mark(self.tok_idx)
+            attempt = self.statement()
+            if attempt.error:
+                self.reverse(attempt.advance_count)
+                self.tokens.release()
+                break
+            self.tokens.release()
+            statements.append(res.register(attempt))
 
         return res.success(CapsuleNode(
             statements,
@@ -401,59 +659,79 @@ class Parser:
             self.current_tok.pos_end.copy()
         ))
 
+    # statements starting with one of the keywords in keyword_statements are dispatched on that
+    # token; anything else is an expression
     def statement(self):
-        res = ParseResult()
-        pos_start = self.current_tok.pos_start.copy()
-
-        if self.current_tok.matches(Token('KWD', 'use')):
-            res.register_advancement()
-            self.advance()
+        tok = self.current_tok
+        if tok.type == 'KWD' and tok.value in self.keyword_statements:
+            return self.keyword_statements[tok.value]()
 
-            if self.current_tok.type == 'SYM':
-                fname = self.current_tok
-                res.register_advancement()
-                self.advance()
-            else:
-                raise InvalidSyntaxError(pos_start, self.current_tok.pos_end,
-                                         f'Expected file identifier')
+        res = ParseResult()
+        expr = res.register(self.expr())
+        if res.error:
+            return res.failure(InvalidSyntaxError(self.current_tok.pos_start,
+                                                  self.current_tok.pos_end,
+                                                  'Expected expression.'))
 
-            if self.current_tok.matches(Token('BREAK', None)):
-                res.register_advancement()
-                self.advance()
-            elif self.current_tok.matches(Token('EOF', None)):
-                pass
-            else:
-                raise InvalidSyntaxError(pos_start, self.current_tok.pos_end,
-                                         f'Expected newline')
+        return res.success(expr)
 
-            return res.success(UseNode(fname))
+    def use_statement(self):
+        res = ParseResult()
+        pos_start = self.current_tok.pos_start.copy()
+        res.register_advancement()
+        self.advance()
 
-        if self.current_tok.matches(Token('KWD', 'return')):
+        if self.current_tok.type == 'SYM':
+            fname = self.current_tok
             res.register_advancement()
             self.advance()
-            expr = res.try_register(self.expr())
-            if not expr:
-                self.reverse(res.to_reverse_count)
-            return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
+        else:
+            raise InvalidSyntaxError(pos_start, self.current_tok.pos_end,
+                                     f'Expected file identifier')
 
-        if self.current_tok.matches(Token('KWD', 'continue')):
+        if self.current_tok.type == 'BREAK':
             res.register_advancement()
             self.advance()
-            return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+        elif self.current_tok.type == 'EOF':
+            pass
+        else:
+            raise InvalidSyntaxError(pos_start, self.current_tok.pos_end,
+                                     f'Expected newline')
 
-        if self.current_tok.matches(Token('KWD', 'break')):
-            res.register_advancement()
-            self.advance()
-            return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+        return res.success(UseNode(fname))
 
+    def return_statement(self):
+        res = ParseResult()
+        pos_start = self.current_tok.pos_start.copy()
+        res.register_advancement()
+        self.advance()
 
-        expr = res.register(self.expr())
-        if res.error:
-            return res.failure(InvalidSyntaxError(self.current_tok.pos_start,
-                                                  self.current_tok.pos_end,
-                                                  'Expected expression.'))
+        # a bare return is followed by a newline or the end of its block
+        tok = self.current_tok
+        expr = None
+        if tok.type != 'BREAK' and (tok.type, tok.value) not in BLOCK_END:
+            self.tokens.mark(self.tok_idx)
+            attempt = self.expr()
+            if attempt.error:
+                self.reverse(attempt.advance_count)
+            else:
+                expr = res.register(attempt)
+            self.tokens.release()
+        return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
 
-        return res.success(expr)
+    def continue_statement(self):
+        res = ParseResult()
+        pos_start = self.current_tok.pos_start.copy()
+        res.register_advancement()
+        self.advance()
+        return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+
+    def break_statement(self):
+        res = ParseResult()
+        pos_start = self.current_tok.pos_start.copy()
+        res.register_advancement()
+        self.advance()
+        return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
 
     def expr(self):
         res = ParseResult()
@@ -463,13 +741,13 @@ class Parser:
         constvar = False
 
         # check for constant declaration
-        if self.current_tok.matches(Token('KWD', 'const')):
+        if self.current_tok.type == 'KWD' and self.current_tok.value == 'const':
             constvar = True
             res.register_advancement()
             self.advance()
 
         # warning about unnecessary var keyword
-        if self.current_tok.matches(Token('KWD', 'var')):
+        if self.current_tok.type == 'KWD' and self.current_tok.value == 'var':
             if not self.static:
                 warn_msg = f'kwd <var> has no effect'
             statictype = 'var'
@@ -477,13 +755,15 @@ class Parser:
             self.advance()
 
         # check for explicit type definition
-        if self.current_tok.value in ['int', 'flt', 'str', 'lst', 'map']:
+        if self.current_tok.value in TYPE_NAMES:
             statictype = self.current_tok.value
             res.register_advancement()
             self.advance()
 
+        next_type = self.peek().type
+
         # regular variable assignment
-        if self.current_tok.type == 'SYM' and self.peek().type in ('ASG',):
+        if self.current_tok.type == 'SYM' and next_type == 'ASG':
 
             var_name = self.current_tok
             res.register_advancement()
@@ -503,7 +783,7 @@ class Parser:
 
         # assign a value to a property or container element
 
-        if self.peek().type in ('DOT', 'AT'):
+        if next_type == 'DOT' or next_type == 'AT':
 
             origin = res.register(self.atom())
             done = False
@@ -546,9 +826,7 @@ class Parser:
         #     elem = self.list_expr()
         #     pass
 
-        node = res.register(self.bin_op(self.comp_expr, (('AND', '&'), ('OR', '|'),
-                                                         ('NAND', '~&'), ('NOR', '~|'),
-                                                         ('XOR', '><'))))
+        node = res.register(self.binary_expr())
 
         if res.error:
             return res.failure(InvalidSyntaxError(
@@ -561,40 +839,52 @@ class Parser:
 
         return res.success(node)
 
-    def comp_expr(self):
+    def arith_expr(self):
+        return self.binary_expr(ARITH_BP)
+
+    # Pratt loop over the infix operators in BINDING_POWER: reads an operand, then folds in every
+    # operator that binds at least as tightly as min_bp, parsing its right operand one level
+    # tighter so that chains associate to the left.  '~' applies to a whole comparison, so it is
+    # only accepted where a comparison can start (min_bp <= COMPARE_BP); failing on the first
+    # token there reports the same error the old comp_expr level did.
+    def binary_expr(self, min_bp=LOGICAL_BP):
         res = ParseResult()
+        tok = self.current_tok
 
-        if self.current_tok.matches(Token('NOT', '~')):
-            op_tok = self.current_tok
+        if min_bp <= COMPARE_BP and tok.type == 'NOT':
             res.register_advancement()
             self.advance()
-
-            node = res.register(self.comp_expr())
+            node = res.register(self.binary_expr(COMPARE_BP))
             if res.error: return res
-            return res.success(UnaryOpNode(op_tok, node))
-
-        # elif self.current_tok.matches(Token('AT', '@')):
-        #     node = res.register(self.bin_op(self.term, ('AT',), func_b=self.expr()))
-        #     if res.error: return res
-        #     return res.success(node)
-
-        # node = res.register(self.bin_op(self.arith_expr, ('EQ', 'NE', 'LT', 'GT', 'LE', 'GE')))
-        node = res.register(self.bin_op(self.arith_expr, ('EQ', 'NE', 'LT', 'GT', 'LE', 'GE')))
-
-        if res.error:
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected int, float, identifier, '+', '-', '(', '[', 'IF', 'FOR', 'WHILE', 'FUN' or 'NOT'"
-            ))
-
-        return res.success(node)
+            left = UnaryOpNode(tok, node)
+        elif tok.type in LEAF_NODES and self.peek().type not in CALL_OR_POWER:
+            # a lone literal or name: skip the factor and call levels entirely
+            res.register_advancement()
+            self.advance()
+            left = LEAF_NODES[tok.type](tok)
+        else:
+            left = res.register(self.factor())
+            if res.error:
+                if min_bp <= COMPARE_BP:
+                    return res.failure(InvalidSyntaxError(
+                        self.current_tok.pos_start, self.current_tok.pos_end,
+                        "Expected int, float, identifier, '+', '-', '(', '[', 'IF', 'FOR', 'WHILE', 'FUN' or 'NOT'"
+                    ))
+                return res
 
-    def arith_expr(self):
-        return self.bin_op(self.term, ('PLS', 'MNS'))
+        bp = BINDING_POWER.get(self.current_tok.type, 0)
+        while bp >= min_bp:
+            op_tok = self.current_tok
+            res.register_advancement()
+            self.advance()
+            right = res.register(self.binary_expr(bp + 1))
+            if res.error: return res
+            left = BinOpNode(left, op_tok, right)
+            bp = BINDING_POWER.get(self.current_tok.type, 0)
 
-    def term(self):
-        return self.bin_op(self.factor, ('MUL', 'DIV', 'MOD'))
+        return res.success(left)
 
+    # unary plus and minus, then a call followed by right-associative power and slice operators
     def factor(self):
         res = ParseResult()
         tok = self.current_tok
@@ -606,15 +896,32 @@ class Parser:
             if res.error: return res
             return res.success(UnaryOpNode(tok, factor))
 
-        return self.power()
+        left = res.register(self.call())
+        if res.error: return res
 
-    def power(self):
-        return self.bin_op(self.call, ('POW', 'LSLC', 'RSLC'), self.factor)
+        while self.current_tok.type in POWER_OPS:
+            op_tok = self.current_tok
+            res.register_advancement()
+            self.advance()
+            right = res.register(self.factor())
+            if res.error: return res
+            left = BinOpNode(left, op_tok, right)
+
+        return res.success(left)
 
     def call(self):
         res = ParseResult()
-        atom = res.register(self.atom())
-        if res.error: return res
+        tok = self.current_tok
+
+        # literals and names are by far the most common atoms; build them here directly
+        node_class = LEAF_NODES.get(tok.type)
+        if node_class:
+            res.register_advancement()
+            self.advance()
+            atom = node_class(tok)
+        else:
+            atom = res.register(self.atom())
+            if res.error: return res
 
         if self.current_tok.type == 'LPR':
             res.register_advancement()
@@ -692,35 +999,12 @@ class Parser:
             if res.error: return res
             return res.success(list_expr)
 
-        elif tok.matches(Token('KWD', '?')) or tok.matches(Token('KWD', 'if')):
-            if_expr = res.register(self.if_expr())
-            if res.error: return res
-            return res.success(if_expr)
-
-        elif tok.matches(Token('KWD', 'for')):
-            for_expr = res.register(self.for_expr())
-            if res.error: return res
-            return res.success(for_expr)
-
-        elif tok.matches(Token('KWD', 'while')):
-            while_expr = res.register(self.while_expr())
-            if res.error: return res
-            return res.success(while_expr)
-
-        elif tok.matches(Token('KWD', 'when')):
-            when_expr = res.register(self.when_expr())
+        # control flow and definitions, dispatched on their first token
+        rule = self.compound_rules.get((tok.type, tok.value))
+        if rule:
+            node = res.register(rule())
             if res.error: return res
-            return res.success(when_expr)
-
-        elif tok.matches(Token('DOT', '.')):
-            func_def = res.register(self.func_def())
-            if res.error: return res
-            return res.success(func_def)
-
-        elif tok.matches(Token('OPS', ':')):
-            struct_def = res.register(self.struct_def())
-            if res.error: return res
-            return res.success(struct_def)
+            return res.success(node)
 
         return res.failure(InvalidSyntaxError(
             tok.pos_start, tok.pos_end,
@@ -753,7 +1037,7 @@ class Parser:
                         "Expected '}', 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
                     ))
 
-                if not self.current_tok.matches(Token('OPS', ':')):
+                if not self.current_is('OPS', ':'):
                     return res.failure(InvalidSyntaxError(
                         self.current_tok.pos_start, self.current_tok.pos_end,
                         f"Expected ':'"
@@ -767,7 +1051,7 @@ class Parser:
 
                 elements[key] = value
 
-                while self.current_tok.matches(Token('BREAK', None)):
+                while self.current_tok.type == 'BREAK':
                     res.register_advancement()
                     self.advance()
 
@@ -841,7 +1125,7 @@ class Parser:
         res = ParseResult()
         else_case = None
 
-        if self.current_tok.matches(Token('KWD', '!')):
+        if self.current_is('KWD', '!'):
             res.register_advancement()
             self.advance()
 
@@ -853,7 +1137,7 @@ class Parser:
                 if res.error: return res
                 else_case = (statements, True)
 
-                if self.current_tok.matches(Token('KWD', 'end')):
+                if self.current_is('KWD', 'end'):
                     res.register_advancement()
                     self.advance()
                 else:
@@ -875,7 +1159,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-        if self.current_tok.matches(Token('KWD', '!?')):
+        if self.current_is('KWD', '!?'):
             all_cases = res.register(self.if_expr_b())
             if res.error: return res
             cases, else_case = all_cases
@@ -890,7 +1174,7 @@ class Parser:
         cases = []
         else_case = None
 
-        if not self.current_tok.matches(Token('KWD', case_keyword)):
+        if not self.current_is('KWD', case_keyword):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected '{case_keyword}'"
@@ -902,7 +1186,7 @@ class Parser:
         condition = res.register(self.expr())
         if res.error: return res
 
-        if not self.current_tok.matches(Token('OPS', ':')):
+        if not self.current_is('OPS', ':'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected ':'"
@@ -919,7 +1203,7 @@ class Parser:
             if res.error: return res
             cases.append((condition, statements, True))
 
-            if self.current_tok.matches(Token('KWD', 'end')):
+            if self.current_is('KWD', 'end'):
                 res.register_advancement()
                 self.advance()
                 all_cases = res.register(self.if_expr_b_or_c())
@@ -945,7 +1229,7 @@ class Parser:
     def for_expr(self):
         res = ParseResult()
 
-        if not self.current_tok.matches(Token('KWD', 'for')):
+        if not self.current_is('KWD', 'for'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected 'FOR'"
@@ -976,7 +1260,7 @@ class Parser:
         start_value = res.register(self.expr())
         if res.error: return res
 
-        if not self.current_tok.matches(Token('OPS', '..')):
+        if not self.current_is('OPS', '..'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected '..'"
@@ -988,7 +1272,7 @@ class Parser:
         end_value = res.register(self.expr())
         if res.error: return res
 
-        if self.current_tok.matches(Token('OPS', '..')):
+        if self.current_is('OPS', '..'):
             res.register_advancement()
             self.advance()
 
@@ -997,7 +1281,7 @@ class Parser:
         else:
             step_value = None
 
-        if not self.current_tok.matches(Token('OPS', ':')):
+        if not self.current_is('OPS', ':'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected ':'"
@@ -1013,7 +1297,7 @@ class Parser:
             body = res.register(self.statements())
             if res.error: return res
 
-            if not self.current_tok.matches(Token('KWD', 'end')):
+            if not self.current_is('KWD', 'end'):
                 return res.failure(InvalidSyntaxError(
                     self.current_tok.pos_start, self.current_tok.pos_end,
                     f"Expected 'end'"
@@ -1032,7 +1316,7 @@ class Parser:
     def while_expr(self):
         res = ParseResult()
 
-        if not self.current_tok.matches(Token('KWD', 'while')):
+        if not self.current_is('KWD', 'while'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected 'while'"
@@ -1044,7 +1328,7 @@ class Parser:
         condition = res.register(self.expr())
         if res.error: return res
 
-        if not self.current_tok.matches(Token('OPS', ':')):
+        if not self.current_is('OPS', ':'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected ':'"
@@ -1060,7 +1344,7 @@ class Parser:
             body = res.register(self.statements())
             if res.error: return res
 
-            if not self.current_tok.matches(Token('KWD', 'end')):
+            if not self.current_is('KWD', 'end'):
                 return res.failure(InvalidSyntaxError(
                     self.current_tok.pos_start, self.current_tok.pos_end,
                     f"Expected 'end'"
@@ -1079,7 +1363,7 @@ class Parser:
     def when_expr(self):
         res = ParseResult()
 
-        if not self.current_tok.matches(Token('KWD', 'when')):
+        if not self.current_is('KWD', 'when'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected 'when'"
@@ -1091,7 +1375,7 @@ class Parser:
         condition = res.register(self.expr())
         if res.error: return res
 
-        if not self.current_tok.matches(Token('OPS', ':')):
+        if not self.current_is('OPS', ':'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected ':'"
@@ -1107,7 +1391,7 @@ class Parser:
             body = res.register(self.statements())
             if res.error: return res
 
-            if not self.current_tok.matches(Token('KWD', 'end')):
+            if not self.current_is('KWD', 'end'):
                 return res.failure(InvalidSyntaxError(
                     self.current_tok.pos_start, self.current_tok.pos_end,
                     f"Expected 'end'"
@@ -1123,10 +1407,45 @@ class Parser:
 
         return res.success(WhenNode(condition, body, False))
 
+    # lazy mode: step over a block body up to its closing 'end' or '}', matching nested blocks
+    # by their openers but parsing nothing, and stop on the closer.  The result holds a
+    # LazyBlockNode, or None with the position unchanged if the block is never closed, in which
+    # case the caller parses the body normally to report the error.
+    def skip_block(self, closer):
+        res = ParseResult()
+        tokens = []
+        depth = 0
+        prev = None
+        tok = self.current_tok
+        while tok.type != 'EOF':
+            if closer == 'end':
+                if tok.type == 'BREAK' and prev is not None and (prev.type, prev.value) in BLOCK_OPENERS:
+                    depth += 1
+                elif tok.type == 'KWD' and tok.value == 'end':
+                    if depth == 0:
+                        break
+                    depth -= 1
+            elif tok.type == 'LCR':
+                depth += 1
+            elif tok.type == 'RCR':
+                if depth == 0:
+                    break
+                depth -= 1
+            tokens.append(tok)
+            prev = tok
+            res.register_advancement()
+            tok = self.advance()
+        else:
+            self.reverse(res.advance_count)
+            return ParseResult().success(None)
+
+        tokens.append(tok)
+        return res.success(LazyBlockNode(tokens, self.static))
+
     def func_def(self):
         res = ParseResult()
 
-        if not self.current_tok.matches(Token('DOT', '.')):
+        if not self.current_is('DOT', '.'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected '.'"
@@ -1189,11 +1508,13 @@ class Parser:
                 res.register_advancement()
                 self.advance()
 
-                body = res.register(self.statements())
-                if res.error: return res
+                body = res.register(self.skip_block('end')) if self.lazy else None
+                if body is None:
+                    body = res.register(self.statements())
+                    if res.error: return res
 
                 # function definition must end with if
-                if not self.current_tok.matches(Token('KWD', 'end')):
+                if not self.current_is('KWD', 'end'):
                     return res.failure(InvalidSyntaxError(
                         self.current_tok.pos_start, self.current_tok.pos_end,
                         f"Expected 'end'"
@@ -1211,7 +1532,7 @@ class Parser:
                     False))
 
             # one-line functions auto-return, so ignore the return keyword if it was included
-            if self.current_tok.matches(Token('KWD', 'return')):
+            if self.current_is('KWD', 'return'):
                 res.register_advancement()
                 self.advance()
 
@@ -1234,7 +1555,7 @@ class Parser:
     def struct_def(self):
         res = ParseResult()
 
-        if not self.current_tok.matches(Token('OPS', ':')):
+        if not self.current_is('OPS', ':'):
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
                 f"Expected ':'"
@@ -1297,8 +1618,10 @@ class Parser:
                 res.register_advancement()
                 self.advance()
 
-                body = res.register(self.statements())
-                if res.error: return res
+                body = res.register(self.skip_block('}')) if self.lazy else None
+                if body is None:
+                    body = res.register(self.statements())
+                    if res.error: return res
 
                 # function definition must end with if
                 if not self.current_tok.type == 'RCR':
@@ -1323,23 +1646,3 @@ class Parser:
             self.current_tok.pos_start, self.current_tok.pos_end,
             f"Expected NEWLINE"
         ))
-
-    ###################################
-
-    def bin_op(self, func_a, ops, func_b=None):
-        if func_b == None:
-            func_b = func_a
-
-        res = ParseResult()
-        left = res.register(func_a())
-        if res.error: return res
-
-        while self.current_tok.type in ops or (self.current_tok.type, self.current_tok.value) in ops:
-            op_tok = self.current_tok
-            res.register_advancement()
-            self.advance()
-            right = res.register(func_b())
-            if res.error: return res
-            left = BinOpNode(left, op_tok, right)
-
-        return res.success(left)
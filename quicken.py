@@ -0,0 +1,219 @@
+# Quickened binary operations.  A BinOpNode is quickened the first time the Interpreter runs
+# it: the handler for its operator and the classes of the operands it met is found here once,
+# and kept for the node in Interpreter.quickened, so that later runs neither compare the
+# operator with each name in turn nor look the Value method up.  The handlers for numbers,
+# strings and lists computed in Python (INT + INT, STR + STR, LST @ INT and the like) build
+# their result directly, with the attributes the Value method would give it, instead of
+# copying the left operand and overwriting its value.
+#
+# A handler returns (result, error) as the Value methods do, or None when its operands are not
+# of the classes it was made for, or would make the Value method fail; the node is then run
+# by the generic handler for its operator, which calls the Value method, from then on.
+#
+# The values are built by the constructors below, which the closure engine, the VM and tiered
+# code build theirs with too.
+#
+# usage: quicken(op, left, right) -> handler; handler(left, right) -> (result, error) or None
+
+import operator
+
+from typedef import List, Map, Number, String
+
+# the Value method behind each binary operator
+OPERATOR_METHODS = {'PLS': 'add', 'MNS': 'sub', 'MUL': 'mul', 'DIV': 'div', 'MOD': 'mod',
+                    'POW': 'pow', 'EQ': 'eq', 'NE': 'ne', 'LT': 'lt', 'GT': 'gt', 'LE': 'le',
+                    'GE': 'ge', 'AND': 'logand', 'OR': 'logor', 'NAND': 'lognand',
+                    'NOR': 'lognor', 'XOR': 'logxor', 'AT': 'at', 'LSLC': 'sliceleft',
+                    'RSLC': 'sliceright'}
+
+# the operators on two Numbers: those whose result is a copy of the left operand, those that
+# also fail on a zero right operand, and those whose result is a new 0 or 1
+ARITHMETIC_OPS = {'PLS': operator.add, 'MNS': operator.sub, 'MUL': operator.mul, 'POW': operator.pow}
+DIVISION_OPS = {'DIV': operator.truediv, 'MOD': operator.mod}
+TEST_OPS = {'EQ': operator.eq, 'NE': operator.ne, 'LT': operator.lt, 'GT': operator.gt,
+            'LE': operator.le, 'GE': operator.ge,
+            'AND': lambda a, b: a and b, 'OR': lambda a, b: a or b,
+            'NAND': lambda a, b: not (a and b), 'NOR': lambda a, b: not (a or b),
+            'XOR': lambda a, b: (a and not b) or (not a and b)}
+
+make = object.__new__
+
+# the type a copy of each class has: Number.copy makes an INT of any Number
+COPY_TYPES = {Number: 'INT', String: 'STR', List: 'LST', Map: 'MAP'}
+
+
+# Values built with the attributes their constructors and copy() give them, set all at once.
+# Nearly every operation makes one, and Value.__init__ with its set_pos and set_context calls
+# costs more than the operation.
+
+# a new Number or String
+def fresh(cls, value, t, context, pos_start=None, pos_end=None, static=False, const=False, triggers=None):
+    made = make(cls)
+    made.__dict__ = {'pos_start': pos_start, 'pos_end': pos_end, 'context': context, 'value': value,
+                     'type': t, 'static': static, 'const': const,
+                     'triggers': [] if triggers is None else triggers}
+    return made
+
+
+# List(elements).set_context(context).set_pos(pos_start, pos_end)
+def fresh_list(elements, context, pos_start, pos_end):
+    made = make(List)
+    made.__dict__ = {'pos_start': pos_start, 'pos_end': pos_end, 'context': context, 'value': None,
+                     'type': 'LST', 'static': False, 'const': False, 'triggers': [],
+                     'elements': elements}
+    return made
+
+
+# the result of arithmetic on the Number left: a copy of it holding result
+def derived(left, result):
+    made = make(Number)
+    made.__dict__ = {'pos_start': left.pos_start, 'pos_end': left.pos_end, 'context': left.context,
+                     'value': result, 'type': 'INT', 'static': left.static, 'const': left.const,
+                     'triggers': left.triggers}
+    return made
+
+
+# value.copy().set_pos(pos_start, pos_end).set_context(context) for a Number, String, List or
+# Map, holding the same value or elements: a read of a variable whose value another read has
+# moved since (see apart)
+def copied(value, context, pos_start, pos_end):
+    cls = type(value)
+    made = make(cls)
+    if cls is List or cls is Map:
+        made.__dict__ = {'pos_start': pos_start, 'pos_end': pos_end, 'context': context, 'value': None,
+                         'type': COPY_TYPES[cls], 'static': value.static, 'const': value.const,
+                         'triggers': value.triggers, 'elements': value.elements,
+                         'shares_elements': True}
+        value.shares_elements = True
+        value.mark = None
+    else:
+        made.__dict__ = {'pos_start': pos_start, 'pos_end': pos_end, 'context': context,
+                         'value': value.value, 'type': COPY_TYPES[cls], 'static': value.static,
+                         'const': value.const, 'triggers': value.triggers}
+    return made
+
+
+# the value of a variable read outside a struct, for a value that is not a struct: the value
+# itself, lent out and moved to where it is read (see Interpreter.visit_VarAccessNode)
+def lent(value, context, pos_start, pos_end):
+    value.pos_start = pos_start
+    value.pos_end = pos_end
+    value.context = context
+    value.shared = True
+    return value
+
+
+# value.set_pos(pos_start, pos_end).set_context(context), as a call gives back a value that is
+# not a struct
+def placed(value, context, pos_start, pos_end):
+    value.pos_start = pos_start
+    value.pos_end = pos_end
+    value.context = context
+    return value
+
+
+# A read lends out the value the variable holds, so a second read of the variable moves the
+# value the first one gave while it is still in use.  A binary operation notes where its left
+# operand was read before running its right one, and puts a copy back there if a read moved it.
+
+# where value was read, if it is lent out and may be moved: its position and context
+def read_at(value):
+    if value.shared:
+        return value.pos_start, value.pos_end, value.context
+    return None
+
+
+# value, or a copy of it back where it was read at, if a later read moved it
+def apart(value, at):
+    if at is None:
+        return value
+    pos_start, pos_end, context = at
+    if value.pos_start is pos_start and value.pos_end is pos_end and value.context is context:
+        return value
+    if type(value) in COPY_TYPES:
+        return copied(value, context, pos_start, pos_end)
+    return value.copy().set_pos(pos_start, pos_end).set_context(context)
+
+
+# the handler calling the Value method of op, for operands of any class
+def generic(op):
+    if op == 'DOT':
+        return lambda left, right: (right, None)
+    name = OPERATOR_METHODS[op]
+    return lambda left, right: getattr(left, name)(right)
+
+
+GENERIC = {op: generic(op) for op in list(OPERATOR_METHODS) + ['DOT']}
+
+
+# NUM op NUM for an arithmetic operator: a copy of left holding the result, as Number.copy makes
+# it (whose type is always INT)
+def arithmetic(compute):
+    def handler(left, right):
+        if type(left) is not Number or type(right) is not Number:
+            return None
+        return derived(left, compute(left.value, right.value)), None
+    return handler
+
+
+# NUM / NUM and NUM % NUM, left to Number.div and Number.mod to fail on a zero right operand
+def division(compute):
+    def handler(left, right):
+        if type(left) is not Number or type(right) is not Number or right.value == 0:
+            return None
+        return derived(left, compute(left.value, right.value)), None
+    return handler
+
+
+# NUM op NUM for a comparison or logical operator: a new Number 0 or 1
+def test(compute):
+    def handler(left, right):
+        if type(left) is not Number or type(right) is not Number:
+            return None
+        return fresh(Number, int(compute(left.value, right.value)), 'INT', left.context), None
+    return handler
+
+
+# STR + STR
+def concatenate(left, right):
+    if type(left) is not String or type(right) is not String:
+        return None
+    return fresh(String, left.value + right.value, 'STR', left.context), None
+
+
+# LST @ INT: the element, lent out as List.at gives it; an index past the end fails there
+def element(left, right):
+    if type(left) is not List or type(right) is not Number or right.type != 'INT':
+        return None
+    index = right.value
+    if type(index) is not int or index >= len(left.elements):
+        return None
+    return left.element(index), None
+
+
+# STR @ INT: a new string of the one character
+def character(left, right):
+    if type(left) is not String or type(right) is not Number or right.type != 'INT':
+        return None
+    text = left.value
+    index = right.value
+    if type(index) is not int or index >= len(text):
+        return None
+    return fresh(String, text[index], 'STR', None), None
+
+
+# (op, class of the left operand, class of the right operand) -> its handler
+SPECIALIZED = {('PLS', String, String): concatenate,
+               ('AT', List, Number): element,
+               ('AT', String, Number): character}
+for op, compute in ARITHMETIC_OPS.items():
+    SPECIALIZED[op, Number, Number] = arithmetic(compute)
+for op, compute in DIVISION_OPS.items():
+    SPECIALIZED[op, Number, Number] = division(compute)
+for op, compute in TEST_OPS.items():
+    SPECIALIZED[op, Number, Number] = test(compute)
+
+
+# the handler for a node with operator op first run on left and right
+def quicken(op, left, right):
+    return SPECIALIZED.get((op, type(left), type(right))) or GENERIC[op]
@@ -0,0 +1,61 @@
+# Static name resolution for the bytecode compiler.  Each parameter of a function and each
+# variable its body binds gets a fixed slot, so a call keeps them in a list (see SlotTable in
+# vm.py) and the VM reads and writes them by index rather than through a dict.
+#
+# Slots only change where a variable is kept, not what a name means: a SlotTable still finds a
+# slotted variable by name for the Interpreter and anything else that goes through get and set,
+# and names without a slot, bound in ways no pass can see (a module run by use, a when body
+# declared elsewhere), stay in its dict.  Only the targets of when and of reference assignments,
+# which the Interpreter reaches in the dict directly, are kept out of the slots.
+#
+# Only the VM uses slots.  Function.execute, and with it the Interpreter, the closure engine,
+# the DirectInterpreter and tiered code, still gives each call a SymbolTable: those write some
+# variables into its dict directly, and by name a SlotTable finds a variable no faster than a
+# dict does.  Nor are slots faster in the VM: bench.py slots measures slot frames within noise
+# of dict frames.
+#
+# usage: resolve(body, arg_names) -> the variable names, in slot order
+
+from optimizer import InlineCallNode
+from parser import (ContainerAccessNode, ForNode, FunctionDefinitionNode, LazyBlockNode, Node,
+                    PropertyAccessNode, ReferenceAssignNode, StructDefinitionNode, VarAccessNode,
+                    VarAssignNode, WhenNode)
+
+
+def resolve(body, arg_names):
+    names, unslotted = {}, set()
+    for name in arg_names:
+        names.setdefault(name)
+    bound_names(body, names, unslotted)
+    return [name for name in names if name not in unslotted]
+
+
+# add the names node binds to names, in the order met, and the names that must stay in the
+# dict to unslotted.  Function and struct bodies are scopes of their own, and so is the body an
+# inlined call runs, in a frame of its own.
+def bound_names(node, names, unslotted):
+    if isinstance(node, (tuple, list)):
+        for v in node:
+            bound_names(v, names, unslotted)
+        return
+    if not isinstance(node, Node) or isinstance(node, LazyBlockNode):
+        return
+    if isinstance(node, (FunctionDefinitionNode, StructDefinitionNode)):
+        if node.var_name_tok:
+            names.setdefault(node.var_name_tok.value)
+        return
+    if isinstance(node, InlineCallNode):
+        return bound_names(node.call, names, unslotted)
+    if isinstance(node, (VarAssignNode, ForNode)):
+        names.setdefault(node.var_name_tok.value)
+    elif isinstance(node, WhenNode):
+        unslotted.add(node.target)
+    elif isinstance(node, ReferenceAssignNode):
+        root = node.target_node.head
+        while isinstance(root, (PropertyAccessNode, ContainerAccessNode)):
+            root = root.root_var
+        if isinstance(root, VarAccessNode):
+            unslotted.add(root.var_name_tok.value)
+    for name in type(node).__slots__:
+        if hasattr(node, name):
+            bound_names(getattr(node, name), names, unslotted)
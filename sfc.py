@@ -0,0 +1,336 @@
+# Compiled Safyr files.  foo.sfc, next to foo.sfr, holds the program compiled to bytecode (see
+# bytecode.py) together with the optimized tree it was compiled from, so that run and use skip
+# the lexer, parser, optimizer and compiler.  A .sfc is fresh while the hash of its source, the
+# optimization level, static mode and debug setting it records match the ones in use; a .sfc
+# whose .sfr is gone is run as it is, like a .pyc shipped without its source.  Stale, foreign
+# or damaged files are ignored.
+#
+# Layout, all offsets from the start of the file:
+#   header    SFC_MAGIC, format version, marshal version, flags (bit 0 debug stripped, bit 1
+#             static, bit 2 little-endian code), optimization level, SHA-256 of the source,
+#             CRC-32 of the rest of the file, and the offset and length of each section below
+#   consts    marshal: the constant pool of each code object
+#   names     marshal: the names table of each code object
+#   code      the instructions of all code objects, one native int32 array
+#   tree      marshal: the optimized tree, nodes numbered in the order they are first met
+#   objects   marshal: per code object its name, where its code is, its node numbers, the
+#             code objects of its function bodies and its slotted variables
+#
+# The file is mapped with mmap and the code section is used where it lies, so processes running
+# the same compiled scripts share those pages.
+#
+# usage: python sfc.py [-O level] [--strip] [--static] directory...  compiles every .sfr below
+
+import argparse
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+import optimizer
+import parser
+from astcache import parse_file, source_hash
+from bytecode import CodeObject, Compiler
+from errors import SyntaxError
+from lexer import FileSource, Lexer, Location, Position, SourceToken, StrippedToken, Token
+from parser import setfield
+
+SFC_MAGIC = b'SFRBC'
+# bump whenever the instruction set, the node classes or the layout change
+SFC_VERSION = 4
+SECTIONS = ('consts', 'names', 'code', 'tree', 'objects')
+HEADER = struct.Struct(f'<{len(SFC_MAGIC)}s4B32sI{2 * len(SECTIONS)}I')
+
+# tags of the encoded tree, as in astcache, with back references for nodes met before, the
+# tokens of folded constants, which take their positions from the expression they replace
+# and may have none, and numbers, which only tokens hold there
+NODE, REF, TOKEN, STRIPPED, FOLDED, TUPLE, DICT, NUMBER = range(8)
+
+
+def sfc_path(path):
+    return os.path.splitext(path)[0] + '.sfc'
+
+
+def flags(stripped, static):
+    return int(stripped) | int(static) << 1 | (sys.byteorder == 'little') << 2
+
+
+# The optimized tree is not a tree: an inlined call and the function it inlines share the
+# body, and a hoisted expression knows the node it stands for.  Each node is numbered when
+# it is first met and stored once; later meetings store its number, so identities survive.
+def encode_tree(root):
+    numbers = {}
+
+    def encode(value):
+        if value is None or isinstance(value, (bool, str)):
+            return value
+        if isinstance(value, (int, float)):
+            return (NUMBER, value)
+        if isinstance(value, list):
+            return [encode(v) for v in value]
+        if isinstance(value, tuple):
+            return (TUPLE,) + tuple(encode(v) for v in value)
+        if isinstance(value, dict):
+            return (DICT, [encode(k) for k in value], [encode(v) for v in value.values()])
+        if isinstance(value, StrippedToken):
+            return (STRIPPED, value.type, value.value)
+        if isinstance(value, SourceToken):
+            return (TOKEN, value.type, value.value, value.start, value.end)
+        if isinstance(value, Token):
+            return (FOLDED, value.type, value.value, encode(getattr(value, 'pos_start', None)),
+                    encode(getattr(value, 'pos_end', None)))
+        if isinstance(value, (Location, Position)):
+            return value.idx
+        if id(value) in numbers:
+            return (REF, numbers[id(value)])
+        node_class(type(value).__name__)
+        numbers[id(value)] = len(numbers)
+        fields = [NODE, type(value).__name__]
+        for name in type(value).__slots__:
+            if hasattr(value, name):
+                fields += [name, encode(getattr(value, name))]
+        return tuple(fields)
+
+    return encode(root), numbers
+
+
+# the tree encode_tree stored, and its nodes by number.  Hoisted expressions get new keys, as
+# keys must not repeat among the trees one process runs.
+def decode_tree(value, source):
+    nodes, classes, keys = [], {}, {}
+
+    def key(old):
+        new = keys.get(old)
+        if new is None:
+            new = keys[old] = next(optimizer.invariant_keys)
+        return new
+
+    def build(value):
+        kind = type(value)
+        if kind is list:
+            return [build(v) for v in value]
+        if kind is int:
+            return Location(source if value >= 0 else None, value)
+        if kind is not tuple:
+            return value
+        tag = value[0]
+        if tag == NODE:
+            cls = classes.get(value[1])
+            if cls is None:
+                cls = classes[value[1]] = node_class(value[1])
+            node = cls.__new__(cls)
+            nodes.append(node)
+            for i in range(2, len(value), 2):
+                setfield(node, value[i], build(value[i + 1]))
+            if cls is optimizer.InvariantNode:
+                setfield(node, 'key', key(node.key))
+            elif cls is optimizer.ResetNode:
+                setfield(node, 'keys', tuple(key(k) for k in node.keys))
+            return node
+        if tag == REF:
+            return nodes[value[1]]
+        if tag == NUMBER:
+            return value[1]
+        if tag == TOKEN:
+            return SourceToken(value[1], value[2], source, value[3], value[4])
+        if tag == STRIPPED:
+            return StrippedToken(value[1], value[2])
+        if tag == FOLDED:
+            tok = Token(value[1], value[2])
+            tok.pos_start, tok.pos_end = build(value[3]), build(value[4])
+            return tok
+        if tag == TUPLE:
+            return tuple(map(build, value[1:]))
+        if tag == DICT:
+            return dict(zip(build(value[1]), build(value[2])))
+        raise ValueError(f'Unknown tag {tag}')
+
+    return build(value), nodes
+
+
+# the parser's node classes and the optimizer's
+def node_class(name):
+    for module in (parser, optimizer):
+        cls = getattr(module, name, None)
+        if isinstance(cls, type) and issubclass(cls, parser.Node) and cls is not parser.Node:
+            return cls
+    raise TypeError(f'Cannot store {name} objects')
+
+
+# every code object reachable from code, code first
+def code_objects(code):
+    found, order = set(), []
+    pending = [code]
+    while pending:
+        item = pending.pop(0)
+        if id(item) not in found:
+            found.add(id(item))
+            order.append(item)
+            pending += item.functions
+    return order
+
+
+def write_sfc(path, tree, code, digest, stripped, static, level):
+    encoded, numbers = encode_tree(tree)
+    objects = code_objects(code)
+    index = {id(item): i for i, item in enumerate(objects)}
+    instructions = array('i')
+    table = []
+    for item in objects:
+        table.append((item.name, len(instructions), len(item.code),
+                      [numbers[id(node)] for node in item.nodes],
+                      [index[id(function)] for function in item.functions], item.slots))
+        instructions.extend(item.code)
+    sections = {'consts': marshal.dumps([item.consts for item in objects]),
+                'names': marshal.dumps([item.names for item in objects]),
+                'code': instructions.tobytes(),
+                'tree': marshal.dumps(encoded),
+                'objects': marshal.dumps(table)}
+
+    # sections start on 8-byte boundaries, so the code can be read as ints where it lies
+    offset, places, body = HEADER.size, [], b''
+    for name in SECTIONS:
+        padding = -offset % 8
+        body += bytes(padding) + sections[name]
+        places += [offset + padding, len(sections[name])]
+        offset += padding + len(sections[name])
+    data = HEADER.pack(SFC_MAGIC, SFC_VERSION, marshal.version, flags(stripped, static), level,
+                       digest, zlib.crc32(body), *places) + body
+
+    temp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# the sections of the .sfc at path as memoryviews of the mapped file, or None for a file of
+# another format, version or machine, one cut short or damaged, or one compiled with other
+# settings or from another source (any, when digest is None).  A file turned down is unmapped
+# before returning.
+def map_sfc(path, file_flags, level, digest):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    sections = None
+    try:
+        sections = mapped_sections(data, file_flags, level, digest)
+    finally:
+        if sections is None:
+            data.close()
+    return sections
+
+
+def mapped_sections(data, file_flags, level, digest):
+    if len(data) < HEADER.size:
+        return None
+    fields = HEADER.unpack_from(data)
+    magic, version, marshal_version, found_flags, found_level, found_digest, crc = fields[:7]
+    if magic != SFC_MAGIC or version != SFC_VERSION or marshal_version != marshal.version or \
+            bool(found_flags & 4) != (sys.byteorder == 'little'):
+        return None
+    if found_flags & 3 != file_flags & 3 or found_level != level or \
+            digest is not None and found_digest != digest:
+        return None
+    places = fields[7:]
+    if any(places[i] + places[i + 1] > len(data) for i in range(0, len(places), 2)):
+        return None
+    with memoryview(data) as view:
+        if zlib.crc32(view[HEADER.size:]) != crc:
+            return None
+    view = memoryview(data)
+    return {name: view[places[2 * i]:places[2 * i] + places[2 * i + 1]] for i, name in enumerate(SECTIONS)}
+
+
+# the tree and code stored at path, or None unless they were compiled from a source with the
+# given hash (any, when digest is None) with the given settings
+def read_sfc(path, digest, stripped, static, level, source):
+    try:
+        sections = map_sfc(path, flags(stripped, static), level, digest)
+        if sections is None:
+            return None
+        tree, nodes = decode_tree(marshal.loads(sections['tree']), source)
+        consts = marshal.loads(sections['consts'])
+        names = marshal.loads(sections['names'])
+        instructions = sections['code'].cast('i')
+        objects = []
+        for i, (name, start, length, node_numbers, functions, slots) in enumerate(marshal.loads(sections['objects'])):
+            code = CodeObject(name)
+            code.set_slots(slots)
+            code.code = instructions[start:start + length]
+            code.consts, code.names = consts[i], names[i]
+            code.nodes = [nodes[n] for n in node_numbers]
+            code.functions = functions
+            objects.append(code)
+        for code in objects:
+            code.functions = [objects[i] for i in code.functions]
+        return tree, objects[0]
+    except (OSError, EOFError, ValueError, TypeError):
+        # unreadable or otherwise corrupt: use the source instead
+        return None
+
+
+# the tree and code of the fresh .sfc for the .sfr file at path, or None
+def load_sfc(path, lexer, static, level):
+    target = sfc_path(path)
+    if not os.path.exists(target):
+        return None
+    digest = source_hash(path) if os.path.exists(path) else None
+    return read_sfc(target, digest, lexer.strip_debug, static, level, FileSource(path, lexer.name))
+
+
+# parse, optimize and compile the .sfr file at path into its .sfc; returns the parse error, if
+# there is one, in which case nothing is written
+def compile_file(path, lexer, static, level):
+    from interpreter import SymbolTable
+    from typedef import Number
+
+    symbol_table = SymbolTable()
+    symbol_table.set('static-typing', Number(static))
+    res = parse_file(path, lexer, symbol_table)
+    if res.error:
+        return res.error
+    tree = optimizer.optimize(res.node, level)
+    write_sfc(sfc_path(path), tree, Compiler().compile(tree), source_hash(path),
+              lexer.strip_debug, static, level)
+    return None
+
+
+def main(argv):
+    args = argparse.ArgumentParser(description='Compile every .sfr file in the given directories '
+                                               'to a .sfc file next to it.')
+    args.add_argument('directories', nargs='+')
+    args.add_argument('-O', dest='level', type=int, default=optimizer.OPT_NONE,
+                      help='optimization level, see optimizer.py (default %(default)s, as opt in shell.py)')
+    args.add_argument('--strip', action='store_true', help='strip source positions, as debug = 0')
+    args.add_argument('--static', action='store_true', help='compile in static mode, as static = 1')
+    args = args.parse_args(argv)
+
+    compiled = failed = 0
+    for directory in args.directories:
+        for folder, subfolders, files in os.walk(directory):
+            subfolders[:] = [d for d in subfolders if not d.startswith(('.', '__'))]
+            for name in sorted(files):
+                if not name.endswith('.sfr'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    error = compile_file(path, Lexer(strip_debug=args.strip), int(args.static), args.level)
+                except (SyntaxError, OSError, ValueError, TypeError, RecursionError) as e:
+                    error = e
+                if error:
+                    failed += 1
+                    print(f'{path}: {error}', file=sys.stderr)
+                else:
+                    compiled += 1
+    print(f'{compiled} compiled, {failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,25 @@
 from lexer import Lexer
 from parser import Parser
+from astcache import parse_file
+from optimizer import optimize
+from closures import ClosureEngine
+from direct import DirectInterpreter
+from vm import VM
+from tiering import Tiers
+from feedback import load_profile, save_profile
+from sfc import load_sfc, sfc_path
 from interpreter import *
 from sys import exit
 
 static = 0
+debug = 1     # set to 0 to strip source positions from tokens (errors then print no location)
+cache = 0     # set to 1 to load the trees of unchanged sources from __sfrcache__ instead of parsing them
+lazy = 0      # set to 1 to parse function and struct bodies only when they are first called
+opt = 0       # optimization level, see optimizer.py: 0 runs programs exactly as parsed, 1 to 3 rewrite them
+engine = 0    # 1 runs programs with the closure engine in closures.py, 2 with the bytecode VM in vm.py,
+              # 3 with the Interpreter returning values directly, in direct.py
+tier = 0      # set to 1 to compile hot loops and functions to Python, see tiering.py
+profile = 0   # set to 1 to keep type feedback across runs in __sfrcache__ (with tier = 1), see feedback.py
 
 class Shell:
 
@@ -18,6 +34,8 @@ class Shell:
         global_symbol_table.set("T", Number(1))
         global_symbol_table.set("F", Number(0))
         global_symbol_table.set('static-typing', Number(static))
+        global_symbol_table.set('opt-level', Number(opt))
+        global_symbol_table.set('ast-cache', Number(cache))
 
         global_symbol_table.set("print", BuiltInFunction.print)
         global_symbol_table.set("PRINT_RET", BuiltInFunction.print_ret)
@@ -55,36 +73,54 @@ class Shell:
             data = ''
             if cmd.startswith('run '):
                 cmd = cmd[4:]
-                if os.path.exists(cmd + '.sfr'):
-                    with open(cmd + '.sfr', 'r') as f:
-                        data = f.read()
-                        needsrun = True
+                if os.path.exists(cmd + '.sfr') or os.path.exists(sfc_path(cmd + '.sfr')):
+                    needsrun = True
                 else:
                     print(f'File not found: {cmd}')
             else:
                 data = cmd
 
             if needsrun:
-                lex = Lexer()
-                try:
-                    toks = lex.tokenize(data)
-                except Exception as e:
-                    print(f'Exception encountered in lexer:\n\t{e}')
-                    continue
-
-                par = Parser(toks, global_symbol_table)
-                try:
-                    ast = par.parse()
-                    if ast.error:
-                        print(f'Exception encountered in parser:\n\t{ast.error}')
-                except Exception as e:
-                    print(f'Exception encountered in parser:\n\t{e}')
-                    continue
+                lex = Lexer(strip_debug=not debug)
+                # a fresh .sfc (see sfc.py) holds the program parsed, optimized and compiled
+                compiled = load_sfc(cmd + '.sfr', lex, global_symbol_table.get('static-typing').value, opt)
+                if compiled is None:
+                    # tokens are streamed from the file into the parser, so lexer errors show up here too
+                    try:
+                        ast = parse_file(cmd + '.sfr', lex, global_symbol_table, use_cache=cache, lazy=lazy)
+                        if ast.error:
+                            print(f'Exception encountered in parser:\n\t{ast.error}')
+                    except (IllegalInputCharacterError, IllegalTokenFormatError, UnmatchedQuoteError) as e:
+                        print(f'Exception encountered in lexer:\n\t{e}')
+                        continue
+                    except Exception as e:
+                        print(f'Exception encountered in parser:\n\t{e}')
+                        continue
 
                 context = Context('<program>')
                 context.symbol_table = global_symbol_table
+                # what tiering counts and compiles is kept for this run only
+                Interpreter.tiering = Tiers() if tier and not engine else None
                 try:
-                    result = Interpreter().visit(ast.node, context)
+                    if compiled is not None:
+                        tree, code = compiled
+                    else:
+                        tree, code = optimize(ast.node, opt), None
+                    if engine == 2 and code is not None:
+                        result = VM().run_code(code, context)
+                    elif engine:
+                        result = (ClosureEngine, VM, DirectInterpreter)[engine - 1]().run(tree, context)
+                    elif Interpreter.tiering and profile:
+                        tiers = Interpreter.tiering
+                        tiers.profile = load_profile(cmd + '.sfr', tree, opt)
+                        try:
+                            result = Interpreter().visit(tree, context)
+                        finally:
+                            if tiers.profile:
+                                save_profile(cmd + '.sfr', tiers.profile)
+                            tiers.profile = None
+                    else:
+                        result = Interpreter().visit(tree, context)
                     if result.error:
                         print(f'Exception encountered in interpreter:\n\t{result.error}')
                         raise result.error
@@ -93,5 +129,7 @@ class Shell:
                     print(f'Exception encountered in interpreter:\n\t{e}')
                     raise e
                     continue
+                finally:
+                    Interpreter.tiering = None
 
                 result.value
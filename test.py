@@ -0,0 +1,871 @@
+# Tests for the Safyr toolchain.  bench.py only times things; what a change must not break is
+# checked here.
+# usage: pytest test.py
+
+import contextlib
+import io
+import marshal
+import mmap
+import os
+import random
+
+import pytest
+
+from bench import (ENGINE_PROGRAMS, TIERING_PROGRAMS, long_line_source, loop_program, program_context, program_outcome,
+                   random_program, run_program, synthetic_source)
+import astcache
+from bytecode import EVAL, Compiler, disassemble
+import interpreter
+import sfc
+from feedback import load_profile, profile_path, save_profile
+from tiering import Tiers
+from closures import ClosureEngine
+from interpreter import Interpreter
+from direct import DirectInterpreter
+import errors
+import lexer
+from lexer import Lexer, Token, build_rules, read_rules, write_rules
+from optimizer import OPT_FOLD, OPT_HOIST, OPT_INLINE, OPT_NONE, optimize
+from parser import LazyBlockNode, Node, Parser, TokenStream
+from vm import VM
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEVELS = (OPT_NONE, OPT_FOLD, OPT_HOIST, OPT_INLINE)
+
+
+# tokens are compared by type, value and offsets; line and column are derived from the offsets
+def token_key(tok):
+    return (tok.type, tok.value, tok.pos_start.idx, tok.pos_end.idx)
+
+
+# the sample programs shipped with the interpreter, by file name
+def samples():
+    programs = {}
+    for name in ('basic', 'lists', 'whentrigger'):
+        with open(os.path.join(HERE, f'{name}.sfr')) as f:
+            programs[f'{name}.sfr'] = f.read()
+    return programs
+
+
+# the engine programs, the samples and count random programs, by label
+def corpus(count):
+    programs = dict(ENGINE_PROGRAMS)
+    programs.update(samples())
+    r = random.Random(0)
+    for i in range(count):
+        programs[f'random {i}'] = random_program(r)
+    return programs
+
+
+# a tree as a short string: numbers, strings and names as they are written, other nodes as
+# (Kind field ...), leaving out positions; a lazy body is parsed and shown as its statements
+def shape(value):
+    if isinstance(value, LazyBlockNode):
+        res = value.parse()
+        return f'{type(res.error).__name__}: {res.error.details}' if res.error else shape(res.node)
+    if isinstance(value, Token):
+        return str(value.value) if value.value is not None else value.type
+    if isinstance(value, (list, tuple)):
+        return '[' + ' '.join(shape(v) for v in value) + ']'
+    if isinstance(value, Node):
+        kind = type(value).__name__
+        if kind in ('NumberNode', 'StringNode'):
+            return str(value.tok.value)
+        if kind == 'VarAccessNode':
+            return str(value.var_name_tok.value)
+        fields = [shape(getattr(value, name)) for name in type(value).__slots__
+                  if not name.startswith('pos_') and hasattr(value, name)]
+        return '(' + ' '.join([kind[:-len('Node')]] + fields) + ')'
+    return repr(value)
+
+
+# what parsing src gives: the shape of the tree, or the error; streamed feeds the parser from
+# Lexer.iter_tokens instead of a token list, and lazy leaves function and struct bodies to be
+# parsed when shape gets to them
+def parse(src, streamed=False, lazy=False):
+    tokens = Lexer().iter_tokens(io.StringIO(src)) if streamed else Lexer().tokenize(src)
+    res = Parser(tokens, lazy=lazy).parse()
+    if res.error:
+        return f'{type(res.error).__name__}: {res.error.details}'
+    return shape(res.node)
+
+
+# ---- lexer ----
+
+# the table a fresh process's first Lexer gets, with RULES_FILE at path
+def loaded_rules(monkeypatch, path):
+    monkeypatch.setattr(lexer, 'RULES_FILE', path)
+    monkeypatch.setattr(lexer, '_RULES', None)
+    return Lexer().t
+
+
+def test_rules_built_in_memory(tmp_path, monkeypatch):
+    path = str(tmp_path / 'lexer.rules')
+    # nothing written
+    assert loaded_rules(monkeypatch, path) == build_rules()
+    assert not os.path.exists(path)
+    # an exported table is not read back, even one that differs
+    t = build_rules()
+    t['new']['$'] = ('sym', 1)
+    write_rules(t, path)
+    assert loaded_rules(monkeypatch, path)['new']['$'] == ('xxx', 0)
+
+
+def test_rules_export(tmp_path):
+    path = str(tmp_path / 'lexer.rules')
+    write_rules(build_rules(), path)
+    assert read_rules(path) == build_rules()
+    # cut short
+    with open(path, 'ab') as f:
+        f.truncate(f.tell() - 1)
+    with pytest.raises(ValueError):
+        read_rules(path)
+    # exported by another lexer.py
+    write_rules(build_rules(), path)
+    with open(path, 'r+b') as f:
+        f.seek(len(lexer.RULES_HEADER))
+        f.write(bytes(16))
+    with pytest.raises(ValueError):
+        read_rules(path)
+
+
+# with pieces this small every source is split at as many line boundaries as it has processes
+@pytest.mark.parametrize('processes', (2, 3, 4))
+@pytest.mark.parametrize('label', ['basic.sfr', 'lists.sfr', 'whentrigger.sfr', 'many lines', 'long lines'])
+def test_parallel_tokenize(monkeypatch, label, processes):
+    src = dict(samples(), **{'many lines': synthetic_source(2000),
+                             'long lines': long_line_source(2000) * 8})[label]
+    monkeypatch.setattr('lexer.PARALLEL_MIN_PIECE', 64)
+    serial = Lexer().tokenize(src)
+    parallel = Lexer().tokenize_parallel(src, processes)
+    assert [token_key(t) for t in parallel] == [token_key(t) for t in serial]
+
+
+
+# retokenize after replacing the first match of old in RELEX_SOURCE (or appending, for old '')
+# with new, against a full tokenize of the edited text; a lexer error must be the same error
+# and leave the tokens as they were
+RELEX_SOURCE = 'a = 1\nb = "xy" + a ; note\n.f [x] <~ x * 2\nprint(f(b))\n'
+RELEX_EDITS = {
+    'start of the text': ('a = 1', 'z\na = 1'),
+    'start of a line': ('.f', 'c = 3\n.f'),
+    'end of a line': ('\nb', ' + 4\nb'),
+    'end of the text': ('', 'c = 2\n'),
+    'lines replaced': ('"xy" + a ; note\n.f', '1\nr = 2\n.f'),
+    'lines joined': ('note\n', 'note'),
+    'string opened and closed': ('x * 2', '"x * 2"'),
+    'comment opened': ('+ a', '; + a'),
+    'comment closed': ('; ', ''),
+    'string left open': ('"xy"', '"xy'),
+    'string closing quote deleted': ('xy"', 'xy'),
+    'bad number': ('1', '1b'),
+    'bad character': ('1', '$'),
+    'bad number across joined lines': ('2\n', '2'),
+}
+
+
+# the keys of the tokens scan() gives, or the error it raises with its offsets and its text
+def scanned(scan):
+    try:
+        return [token_key(t) for t in scan()]
+    except lexer.SyntaxError as e:
+        return type(e).__name__, e.details, e.pos_start.idx, e.pos_end.idx, str(e)
+
+
+@pytest.mark.parametrize('label', RELEX_EDITS)
+def test_retokenize(label):
+    old, text = RELEX_EDITS[label]
+    start = RELEX_SOURCE.index(old) if old else len(RELEX_SOURCE)
+    end = start + len(old)
+    new = RELEX_SOURCE[:start] + text + RELEX_SOURCE[end:]
+    tokens = Lexer().tokenize(RELEX_SOURCE)
+    before = [token_key(t) for t in tokens]
+    relexed = scanned(lambda: Lexer().retokenize(tokens, start, end, text))
+    assert relexed == scanned(lambda: Lexer().tokenize(new))
+    if not isinstance(relexed, list):
+        assert [token_key(t) for t in tokens] == before
+
+
+
+# inputs each engine must turn down the same way
+LEXER_ERRORS = {
+    'unclosed string at the end': 'a = "xy',
+    'unclosed string at a newline': 'b = 2\na = "xy\nb = 1\n',
+    'unclosed single quote': "a = 'x",
+    'lone quote': '"',
+    'quote inside a name': "x = 'it's'",
+    'letter in a number': 'b = 2\na = 1b\n',
+    'bad character': 'a = $\n',
+    'unsupported character': 'a = 1 \u00e9',
+}
+
+
+@pytest.mark.parametrize('label', ['basic.sfr', 'lists.sfr', 'whentrigger.sfr', 'many lines', 'long line', 'random']
+                         + list(LEXER_ERRORS))
+def test_lexer_engines(label):
+    src = dict(samples(), **LEXER_ERRORS, **{
+        'many lines': synthetic_source(500), 'long line': long_line_source(2000),
+        'random': '\n'.join(random_program(random.Random(0)) for _ in range(50))})[label]
+    assert scanned(lambda: Lexer(legacy=True).tokenize(src)) == scanned(lambda: Lexer().tokenize(src))
+
+
+# ---- parser ----
+# checked by hand against the grammar of the recursive-descent parser the Pratt loop replaced
+
+PARSES = [
+    ('1 + 2 * 3', '(Capsule [(BinOp 1 + (BinOp 2 * 3))])'),
+    ('1 - 2 - 3', '(Capsule [(BinOp (BinOp 1 - 2) - 3)])'),
+    ('2 ^ 3 ^ 2', '(Capsule [(BinOp 2 ^ (BinOp 3 ^ 2))])'),
+    ('-2 ^ 2', '(Capsule [(UnaryOp - (BinOp 2 ^ 2))])'),
+    ('(1 + 2) * 3', '(Capsule [(BinOp (BinOp 1 + 2) * 3)])'),
+    ('a == 1 & b < 2 | c', '(Capsule [(BinOp (BinOp (BinOp a == 1) & (BinOp b < 2)) | c)])'),
+    ('~a & b', '(Capsule [(BinOp (UnaryOp ~ a) & b)])'),
+    ('a </ 3', '(Capsule [(BinOp a </ 3)])'),
+    ('x = 1 + 2', "(Capsule [(VarAssign x = (BinOp 1 + 2) False 'default')])"),
+    ('const x = 5', "(Capsule [(VarAssign x = 5 True 'default')])"),
+    ('a += 1', "(Capsule [(VarAssign a += 1 False 'default')])"),
+    ('f(1 2) * 3', '(Capsule [(BinOp (Call f [1 2]) * 3)])'),
+    ('[1 2 3]', '(Capsule [(List [1 2 3])])'),
+    ('a @ 0', '(Capsule [(ReferenceAccess (ContainerAccess a 0))])'),
+    ('a.b', '(Capsule [(ReferenceAccess (PropertyAccess a b))])'),
+    ('? a: 1 !? b: 2 ! 3', '(Capsule [(If [[a 1 False] [b 2 False]] [3 False])])'),
+    ('for i = 0 .. 3:\n  print(i)\nend', '(Capsule [(For i 0 3 None (Capsule [(Call print [i])]) True)])'),
+    ('while a < 3:\n  a += 1\nend',
+     "(Capsule [(While (BinOp a < 3) (Capsule [(VarAssign a += 1 False 'default')]) True)])"),
+    ('.g [x] <~ x * 2', '(Capsule [(FunctionDefinition g [x] (BinOp x * 2) True)])'),
+    ('return 1\n', '(Capsule [(Return 1)])'),
+]
+
+PARSE_ERRORS = [
+    ('1 +', "InvalidSyntaxError: Expected int, float, identifier, '+', '-', '(', '[', IF', 'FOR', 'WHILE', 'FUN'"),
+    ('(1 + 2', "InvalidSyntaxError: Expected ')'"),
+    ('for i = 0 .. 3:\n  print(i)', "InvalidSyntaxError: Expected 'end'"),
+    ('x = = 1', 'InvalidSyntaxError: Expected keyword, identifier, or control flow structure.'),
+]
+
+
+@pytest.mark.parametrize('src, expected', PARSES + PARSE_ERRORS)
+def test_parse(src, expected):
+    assert parse(src) == expected
+
+
+# a failing statement inside a block makes the parser back up to the start of the statement
+# holding the block, which a stream committed past
+BACKUPS = [
+    'a = 1\nfor i = 0 .. 2:\n  a = 1\n  b = 2\n  x = = 1\nend\nc = 3',
+    'a = 1\n.f [x] <~\n  y = 1\n  while y < 3:\n    y += 1\n    z = = 2\n  end\nend\nb = 2',
+    'return ? a:\n - - .h [x] <~\n a += 1\n | <~',
+]
+
+
+@pytest.mark.parametrize('src', [src for src, _ in PARSES + PARSE_ERRORS] + BACKUPS)
+def test_parse_streamed(src):
+    assert parse(src, streamed=True) == parse(src)
+
+
+# bodies a lazy parse steps over, counting the blocks nested in them by their openers
+LAZY_BODIES = {
+    'nested blocks': '.f [n] <~\n  t = 0\n  while t < n:\n    t += 1\n    ? t == 2:\n      t += 1\n    end\n'
+                     '    !\n      t += 0\n    end\n  end\n  .g [x] <~\n    return x * 2\n  end\n'
+                     '  return g(t)\nend\nprint(f(3))\n',
+    'struct body': ':point [x y] {\n  m = {1: x}\n  .norm [] <~\n    for i = 0 .. 2:\n      x += i\n    end\n'
+                   '    return x\n  end\n}\np = point(1 2)\n',
+    'one-line function': '.f [x] <~\n  .g [y] <~ y + 1\n  return g(x)\nend\nf(1)\n',
+}
+
+
+@pytest.mark.parametrize('label', LAZY_BODIES)
+def test_parse_lazy(label):
+    assert parse(LAZY_BODIES[label], lazy=True) == parse(LAZY_BODIES[label])
+
+
+# a syntax error in a body a lazy parse stepped over comes from the first call, at the place an
+# eager parse reports it
+LAZY_ERRORS = {
+    'in the body': '.f [x] <~\n  y = 1\n  z = = 2\nend\nprint(1)\nf(1)\n',
+    'in a nested block': '.f [x] <~\n  while x < 3:\n    ? x == 1:\n      x = (2\n    end\n  end\nend\n'
+                         'print(1)\nf(1)\n',
+    'in a struct body': ':s [x] {\n  .g [] <~\n    return ]\n  end\n}\nprint(1)\ns(1)\n',
+    'empty function body': '.f [] <~\nend\nprint(1)\nf()\n',
+    'empty struct body': ':s [] {\n}\nprint(1)\ns()\n',
+}
+
+
+@pytest.mark.parametrize('label', LAZY_ERRORS)
+def test_lazy_error(label):
+    src = LAZY_ERRORS[label]
+    eager = Parser(Lexer().tokenize(src)).parse()
+    lazy = Parser(Lexer().tokenize(src), lazy=True).parse()
+    assert eager.error and not lazy.error
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        res = Interpreter().visit(lazy.node, program_context(builtins=True))
+    assert out.getvalue() == '1\n'
+    assert str(res.error) == str(eager.error)
+
+
+def test_stream_releases_committed_tokens():
+    tokens = TokenStream(iter(Lexer().tokenize('a = 1\nb = 2\n')))
+    tokens.get(4)
+    tokens.commit(4)
+    assert len(tokens.buffer) == 1
+    with pytest.raises(IndexError):
+        tokens.get(0)
+
+
+# ---- optimizer ----
+
+# the shape of the tree of src at an optimization level
+def optimized(src, level):
+    return shape(optimize(Parser(Lexer().tokenize(src)).parse().node, level))
+
+
+# operations that fail, and string operators other than +, are left to the interpreter
+FOLDS = [
+    ('x = 1 + 2 * 3', "(Capsule [(VarAssign x = 7 False 'default')])"),
+    ('a + 1 * 2', '(Capsule [(BinOp a + 2)])'),
+    ('-2 ^ 2', '(Capsule [-4])'),
+    ('1 < 2 & 3 > 4', '(Capsule [0])'),
+    ('~0', '(Capsule [1])'),
+    ('"a" + "b"', '(Capsule [ab])'),
+    ('"a" * 3', '(Capsule [(BinOp a * 3)])'),
+    ('1 / 0', '(Capsule [(BinOp 1 / 0)])'),
+    ('2 ^ 5000', '(Capsule [(BinOp 2 ^ 5000)])'),
+]
+
+
+@pytest.mark.parametrize('src, expected', FOLDS)
+def test_fold(src, expected):
+    assert optimized(src, OPT_FOLD) == expected
+
+
+def test_folded_program_runs_the_same():
+    src = ('total = 0\nfor i = 0 .. 20:\n  total = total + 2 * 3 + 1 - 10 / 5 + (4 ^ 2) % 7\n'
+           '  ? i % 2 == 0 & 1 < 2: total = total - (3 * -1)\nend\ntotal\n1 / (2 - 2)\n')
+    # the variables differ in opt-level
+    assert program_outcome(src, OPT_FOLD)[:2] == program_outcome(src, OPT_NONE)[:2]
+
+
+# loop programs each giving invariant expressions the chance to go wrong
+HOISTING_PROGRAMS = {
+    'invariant arithmetic': 'n = 7\nm = 3\nt = 0\nfor i = 0 .. 50:\n  t = t + n * m - (n + m) / 2\nend\nt\n',
+    'repeated subexpression': 't = 0\nfor i = 0 .. 50:\n  t = (i * i + 1) + (i * i + 1) * 2\nend\nt\n',
+    'assigned in loop': 'n = 1\nt = 0\nfor i = 0 .. 20:\n  t = t + n * 2\n  n = n + 1\nend\nt\n',
+    'assigned in branch': 'n = 1\nt = 0\nfor i = 0 .. 20:\n  t = t + n * 2\n  ? i == 10: n = 5\nend\nt\n',
+    'nested loops': 'n = 2\nt = 0\nfor i = 0 .. 10:\n  for j = 0 .. 10:\n    t = t + n * i + j * n\n  end\nend\nt\n',
+    'while condition': 'n = 4\nk = 0\nwhile k < n * n + 1:\n  k = k + 1\nend\nk\n',
+    'loop run again': 'n = 1\nt = 0\nfor r = 0 .. 3:\n  for i = 0 .. 5:\n    t = t + n * 10\n  end\n  n = n + 1\nend\nt\n',
+    'when trigger': 'n = 1\nc = 0\nwhen c == 5:\n  n = 100\nend\nt = 0\nfor i = 0 .. 10:\n  c = i\n  t = t + n * 2\nend\nt\n',
+    'function call': '.f [x] <~\n  n = x * 3\n  return n\nend\nn = 2\nt = 0\nfor i = 0 .. 10:\n  t = t + f(i) + n * 5\nend\nt\n',
+    'defined in loop': 't = 0\nfor i = 0 .. 3:\n  .g [x] <~ x * 3\n  t = t + g(i) * 2\nend\nt\n',
+    'comparison results': 'n = 3\nt = 0\nfor i = 0 .. 10:\n  t = t + (n > 2) + (n < 2) * 5\nend\nt\n',
+    'strings': 's = "ab"\nt = ""\nfor i = 0 .. 5:\n  t = t + s + "c"\nend\nt\n',
+}
+
+
+# run the tree of src at opt_level, counting the nodes visited on the way; returns the value of
+# the program and the count
+def count_visits(src, opt_level):
+    visits = 0
+    visit = Interpreter.visit
+
+    def counted(self, node, context):
+        nonlocal visits
+        visits += 1
+        return visit(self, node, context)
+
+    Interpreter.visit = counted
+    try:
+        value = run_program(src, opt_level)
+    finally:
+        Interpreter.visit = visit
+    return value, visits
+
+
+# the programs above in which something is hoisted or shared
+HOISTED = ['invariant arithmetic', 'repeated subexpression', 'nested loops', 'while condition',
+           'loop run again', 'when trigger', 'function call', 'comparison results']
+
+
+@pytest.mark.parametrize('label', HOISTING_PROGRAMS)
+def test_hoisting(label):
+    folded, folded_visits = count_visits(HOISTING_PROGRAMS[label], OPT_FOLD)
+    hoisted, hoisted_visits = count_visits(HOISTING_PROGRAMS[label], OPT_HOIST)
+    assert repr(hoisted) == repr(folded)
+    if label in HOISTED:
+        assert hoisted_visits < folded_visits
+    else:
+        assert hoisted_visits == folded_visits
+
+
+# programs whose calls are inlined, and calls whose guard has to fall back
+INLINING_PROGRAMS = {
+    'arithmetic': '.add [x y] <~ x + y\nt = 0\nfor i = 0 .. 20:\n  t = add(t i * 2)\nend\nt\n',
+    'nested calls': '.sq [x] <~ x * x\n.add [x y] <~ x + y\nt = add(sq(3) sq(add(1 2)))\nt\n',
+    'list result': '.pair [x] <~ [x x + 1]\nt = pair(4) + pair(5)\nt\n',
+    'error in body': '.inv [x] <~ 1 / x\nt = 0\nfor i = 2 .. -1:\n  t = t + inv(i)\nend\nt\n',
+    'called before definition': 't = sq(2)\n.sq [x] <~ x * x\nsq(3)\n',
+    'defined twice': '.sq [x] <~ x * x\nt = sq(3)\n.sq [x] <~ x + x\nt + sq(3)\n',
+    'reassigned': '.sq [x] <~ x * x\nt = sq(3)\n? t > 0: sq = 4\nt + sq\n',
+    'in a function body': '.f [n] <~\n  .twice [x] <~ x * 2\n  return twice(n) + twice(n + 1)\nend\nf(3)\n',
+    'wrong argument count': '.add [x y] <~ x + y\nt = add(1 2)\nadd(1)\n',
+}
+
+
+@pytest.mark.parametrize('label', INLINING_PROGRAMS)
+def test_inlining(label):
+    src = INLINING_PROGRAMS[label]
+    assert program_outcome(src, OPT_INLINE)[:2] == program_outcome(src, OPT_HOIST)[:2]
+
+
+# only calls with as many arguments as the function has parameters are inlined
+def test_inline_argument_count():
+    assert optimized(INLINING_PROGRAMS['wrong argument count'], OPT_INLINE) == \
+        "(Capsule [(FunctionDefinition add [x y] (BinOp x + y) True) " \
+        "(VarAssign t = (InlineCall (Call add [1 2]) 'add' (BinOp x + y) ['x' 'y']) False 'default') " \
+        "(Call add [1])])"
+    _, ending, _ = program_outcome(INLINING_PROGRAMS['wrong argument count'], OPT_INLINE)
+    assert 'RuntimeError: 1 too few args passed into <function add>' in ending[1]
+
+
+# a when trigger declared by an earlier program in the same context, as in the shell, redefines
+# the function an inlined call refers to halfway through the loop: the guard falls back to a call
+@pytest.mark.parametrize('level', (OPT_HOIST, OPT_INLINE))
+def test_inline_guard(level):
+    context = program_context(level)
+    for src in ('c = 0\nwhen c == 3:\n  .f [x] <~ x * 10\nend\n',
+                '.f [x] <~ x + 1\nt = 0\nfor i = 0 .. 5:\n  c = i\n  t = t + f(i)\nend\nt\n'):
+        res = Interpreter().visit(optimize(Parser(Lexer().tokenize(src)).parse().node, level), context)
+        assert not res.error
+    assert repr(context.symbol_table.get('t')) == '76'
+
+
+# ---- engines ----
+# each engine runs every program exactly as the Interpreter does, at each optimization level
+
+ENGINES = {'closures': ClosureEngine, 'vm': VM, 'direct': DirectInterpreter}
+PROGRAMS = corpus(300)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('label', PROGRAMS)
+def test_engine(engine, label):
+    src = PROGRAMS[label]
+    for level in LEVELS:
+        assert program_outcome(src, level, ENGINES[engine]) == program_outcome(src, level)
+
+
+def test_empty_return_runs_on():
+    printed, ending, _ = program_outcome(ENGINE_PROGRAMS['empty return in a loop'], OPT_NONE)
+    assert printed == '"after"\n0\n' and ending[1] is None
+
+
+
+# with debug = 0 the shell strips positions from the tokens: errors name no line, and tracebacks
+# show '?' for it.  The scanner still has the text, so its own errors keep their place.
+STRIPPED_ERRORS = {
+    'syntax error': ('(1 + 2', "InvalidSyntaxError: Expected ')'\n  (no debug info)"),
+    'lexer error': ('a = 1b', 'IllegalTokenFormatError: Encountered character [b] in state [int]\n'
+                              '  File , line 1, col 6\n  ~>   a = 1b\n           ^^'),
+    'undefined name': ('print(q)', "VariableAccessError: 'q' is not defined\n  (no debug info)"),
+    'static type': ('int b = 1\nb = "x"\n', 'StaticViolationError: Cannot convert b [INT] to STR\n  (no debug info)'),
+    'runtime error': ('a = 1\nb = a / 0\n', 'Traceback (most recent call last):\n  File , line ?, in <program>\n'
+                                           'RuntimeError: Division by zero\n  (no debug info)'),
+    'runtime error in a function': ('.f [x] <~\n  y = 2\n  return y / x\nend\nf(0)\n',
+                                    'Traceback (most recent call last):\n  File , line ?, in <program>\n'
+                                    '  File , line ?, in f\nRuntimeError: Division by zero\n  (no debug info)'),
+}
+
+
+@pytest.mark.parametrize('engine', [None] + list(ENGINES))
+@pytest.mark.parametrize('label', STRIPPED_ERRORS)
+def test_stripped_errors(engine, label):
+    src, expected = STRIPPED_ERRORS[label]
+    try:
+        res = Parser(Lexer(strip_debug=True).tokenize(src)).parse()
+        if not res.error:
+            context = program_context(builtins=True)
+            res = ENGINES[engine]().run(res.node, context) if engine else Interpreter().visit(res.node, context)
+    except lexer.SyntaxError as e:
+        assert str(e) == expected
+    else:
+        assert str(res.error) == expected
+
+
+# ---- tiering ----
+
+# the Interpreter with hot loops and functions compiled, from a threshold of this many back
+# edges or calls
+@pytest.fixture
+def tiered():
+    def tiers(threshold):
+        Interpreter.tiering = Tiers(threshold, threshold)
+        return Interpreter.tiering
+    try:
+        yield tiers
+    finally:
+        Interpreter.tiering = None
+
+
+TIERED = dict(TIERING_PROGRAMS, **corpus(300))
+
+
+# with thresholds low enough to compile nearly everything
+@pytest.mark.parametrize('label', TIERED)
+def test_tiering(tiered, label):
+    src = TIERED[label]
+    for level in LEVELS:
+        expected = program_outcome(src, level)
+        for threshold in (1, 3):
+            tiered(threshold)
+            assert program_outcome(src, level) == expected, (level, threshold)
+            Interpreter.tiering = None
+
+
+# the compiled code runs an inlined call itself unless the calling context is a struct's, as the
+# Interpreter does, whatever the function is called
+def test_tiered_inline_call(tiered, monkeypatch):
+    src = '.structure [x] <~ x * 2\nt = 0\nfor i = 0 .. 20:\n  t = t + structure(i)\nend\nt\n'
+    expected = program_outcome(src, OPT_INLINE)
+    visit = Interpreter.visit_InlineCallNode
+    walked = []
+    monkeypatch.setattr(Interpreter, 'visit_InlineCallNode',
+                        lambda self, node, context: walked.append(node) or visit(self, node, context))
+    tiers = tiered(3)
+    assert program_outcome(src, OPT_INLINE) == expected
+    assert tiers.units and len(walked) <= 3
+
+
+# ---- values ----
+# A read lends out the value a variable holds.  Assigning it, passing it to a function and
+# putting it in a list or map copy it, and a copied list shares its elements with the original
+# until APPEND, POP, EXTEND, += or a reference assignment changes one of them.  A list held by
+# two lists is copied when it is changed through either of them.
+
+# programs pinning down what a read shares, each with what it prints
+VALUES = {
+    'APPEND to an assigned list': ('xs = [1 2]\nys = xs\nAPPEND(ys 3)\nprint([xs ys])\n',
+                                   '[[1, 2], [1, 2, 3]]\n'),
+    'POP from an assigned list': ('xs = [1 2 3]\nys = xs\nPOP(ys 0)\nprint([xs ys])\n',
+                                  '[[1, 2, 3], [2, 3]]\n'),
+    'EXTEND both ways': ('xs = [1]\nys = xs\nEXTEND(ys [2 3])\nEXTEND(xs ys)\nprint([xs ys])\n',
+                         '[[1, 1, 2, 3], [1, 2, 3]]\n'),
+    '+= on a list': ('xs = [1 2]\nys = xs\nys += 3\nxs += 4\nprint([xs ys])\n',
+                     '[[1, 2, 4], [1, 2, 3]]\n'),
+    '+= in a loop': ('xs = []\nfor i = 0 .. 5:\n  xs += i\n  ys = xs\nend\nAPPEND(ys 9)\nprint([xs ys])\n',
+                     '[[0, 1, 2, 3, 4], [0, 1, 2, 3, 4, 9]]\n'),
+    '+ and - make new lists': ('xs = [1 2 1]\nys = xs + 3\nzs = xs - 1\nprint([xs ys zs])\n',
+                               '[[1, 2, 1], [1, 2, 1, 3], [2]]\n'),
+    'reference assignment': ('xs = [1 2 3]\nys = xs\nys @ 1 = 5\nprint([xs ys])\n',
+                             '[[1, 2, 3], [1, 5, 3]]\n'),
+    'nested reference assignment': ('xs = [[1 2] [3 4]]\nys = xs\nys @ 1 @ 0 = 7\nprint([xs ys])\n',
+                                    '[[[1, 2], [3, 4]], [[1, 2], [7, 4]]]\n'),
+    'argument appended to': ('.f [l] <~\n  APPEND(l 9)\n  return l\nend\nxs = [1]\nys = f(xs)\nprint([xs ys])\n',
+                             '[[1], [1, 9]]\n'),
+    'argument assigned into': ('.f [l] <~\n  l @ 0 = 9\n  return l\nend\nxs = [1 2]\nys = f(xs)\nprint([xs ys])\n',
+                               '[[1, 2], [9, 2]]\n'),
+    'inlined argument appended to': ('.f [l] <~ l + 9\nxs = [1]\nys = f(xs)\nAPPEND(ys 2)\nprint([xs ys])\n',
+                                     '[[1], [1, 9, 2]]\n'),
+    'list literal of a list': ('xs = [1]\nys = [xs xs]\nAPPEND(xs 2)\nAPPEND(ys @ 0 3)\nprint([xs ys])\n',
+                               '[[1, 2], [[1, 3], [1]]]\n'),
+    'element read out': ('xs = [[1] 2]\ny = xs @ 0\nAPPEND(y 5)\nprint([xs y])\n',
+                         '[[[1], 2], [1, 5]]\n'),
+    'APPEND to an element': ('xs = [[1] [2]]\nys = xs\nPOP(ys 0)\nAPPEND(ys @ 0 5)\nprint([xs ys])\n',
+                             '[[[1], [2]], [[2, 5]]]\n'),
+    'APPEND, POP and EXTEND on elements': ('xs = [[1 2] [3 4]]\nys = xs\nAPPEND(ys @ 1 7)\nPOP(ys @ 0 0)\n'
+                                           'EXTEND(ys @ 0 [8])\nprint([xs ys])\n',
+                                           '[[[1, 2], [3, 4]], [[2, 8], [3, 4, 7]]]\n'),
+    'elements of a slice': ('xs = [[1]]\nys = xs </1\nAPPEND(xs @ 0 2)\nAPPEND(ys @ 0 3)\nprint([xs ys])\n',
+                            '[[[1, 2]], [[1, 3]]]\n'),
+    'elements of an extended list': ('xs = [[1]]\nys = []\nEXTEND(ys xs)\nAPPEND(xs @ 0 2)\nAPPEND(ys @ 0 3)\n'
+                                     'print([xs ys])\n', '[[[1, 2]], [[1, 3]]]\n'),
+    'element assigned into, then appended to': ('xs = [[1]]\nys = xs\nys @ 0 @ 0 = 4\nAPPEND(xs @ 0 2)\n'
+                                                'print([xs ys])\n', '[[[1, 2]], [[4]]]\n'),
+    'element popped': ('xs = [[1]]\nys = xs\nz = POP(xs 0)\nAPPEND(z 2)\nprint([xs ys z])\n',
+                       '[[], [[1]], [1, 2]]\n'),
+    'map of a list': ('xs = [1]\nm = {1: xs}\nAPPEND(xs 2)\nprint(m)\n', '{1: [1]}\n'),
+    'numbers and strings': ('a = 1\nb = a\nb += 1\ns = "x"\nt = s\nt += "y"\nprint([a b s t])\n',
+                            '[1, 2, "x", "xy"]\n'),
+    'loop appending': ('xs = []\nfor i = 0 .. 30:\n  APPEND(xs i % 3)\nend\nys = xs\nPOP(xs 0)\nprint(ys @ 0)\n',
+                       '0\n'),
+}
+
+# programs failing on an operation between two reads of a variable, each with the line that
+# marks where: each read has a position of its own
+VALUE_ERRORS = {
+    'the same string twice': ('s = "ab"\nt = s / s\n', '           ^^^^^'),
+    'the same list twice': ('xs = [1]\nys = xs / xs\n', '            ^^^^^^^'),
+    'the same number in a chain': ('xs = [1]\na = 2\nb = 3\nc = 1\nAPPEND(xs -b != a - a == c)\n',
+                                   '              ^^^^^^^^^^'),
+    'a returned list': ('.f [l] <~ l\nxs = [1]\ny = f(xs) / f(xs)\n', '           ^^^^^^^^^^^^'),
+    'a read inside the right operand': ('xs = [1]\nys = xs / (xs - 1)\n', '            ^^^^^^^^'),
+}
+
+
+@pytest.mark.parametrize('label', VALUES)
+def test_values(label):
+    src, printed = VALUES[label]
+    assert program_outcome(src, OPT_NONE)[0] == printed
+
+
+@pytest.mark.parametrize('label', VALUE_ERRORS)
+def test_value_error_marks(label):
+    src, marks = VALUE_ERRORS[label]
+    assert program_outcome(src, OPT_NONE)[1][1].endswith(marks)
+
+
+# on every engine and tiered, at each optimization level, as on the Interpreter
+@pytest.mark.parametrize('label', list(VALUES) + list(VALUE_ERRORS))
+def test_values_everywhere(tiered, label):
+    src = (VALUES.get(label) or VALUE_ERRORS[label])[0]
+    for level in LEVELS:
+        expected = program_outcome(src, level)
+        for engine in ENGINES:
+            assert program_outcome(src, level, ENGINES[engine]) == expected, (engine, level)
+        tiered(1)
+        assert program_outcome(src, level) == expected, level
+        Interpreter.tiering = None
+
+
+# a read gives the value the variable holds, not a copy of it, and assigning it copies it
+def test_read_lends():
+    context = program_context(OPT_NONE)
+    Interpreter().visit(Parser(Lexer().tokenize('xs = [1 2]\n')).parse().node, context)
+    stored = context.symbol_table.get('xs')
+    read = Parser(Lexer().tokenize('xs')).parse().node.elements[0]
+    assert Interpreter().visit(read, context).value is stored
+    assert ClosureEngine().run(read, context).value is stored
+    Interpreter().visit(Parser(Lexer().tokenize('ys = xs\n')).parse().node, context)
+    assert context.symbol_table.get('ys') is not stored
+    assert context.symbol_table.get('ys').elements is stored.elements
+
+
+# ---- feedback ----
+
+FED = dict(TIERING_PROGRAMS, **corpus(0))
+
+
+# each program run three times from one profile, tiered with low thresholds, runs as the
+# Interpreter alone runs it
+@pytest.mark.parametrize('label', FED)
+def test_feedback(tiered, tmp_path, label):
+    src = FED[label]
+    path = str(tmp_path / 'p.sfr')
+    with open(path, 'w') as f:
+        f.write(src)
+    for level in LEVELS:
+        expected = program_outcome(src, level)
+        if os.path.exists(profile_path(path)):
+            os.remove(profile_path(path))
+        for run in range(3):
+            tiered(3)
+            assert program_outcome(src, level, profiled=path) == expected, (level, run)
+            Interpreter.tiering = None
+
+
+# a profile that is cut short, of another shape or not marshal data at all is started over
+@pytest.mark.parametrize('stored', [b'\x00', b'junk', marshal.dumps([1, 2, 3]), marshal.dumps(({}, {}, {})),
+                                    marshal.dumps(({}, [], {('BinOpNode', 1, 2): 5})),
+                                    marshal.dumps(({('ForNode', 1, 2): 'x'}, [], {}))])
+def test_feedback_corrupt(tmp_path, stored):
+    path = str(tmp_path / 'p.sfr')
+    with open(path, 'w') as f:
+        f.write(ENGINE_PROGRAMS['functions'])
+    tree = Parser(Lexer().tokenize(ENGINE_PROGRAMS['functions'])).parse().node
+    save_profile(path, load_profile(path, tree, OPT_NONE))
+    with open(profile_path(path), 'ab') as f:
+        f.truncate(f.tell() - len(marshal.dumps(({}, [], {}))))
+        f.write(stored)
+    profile = load_profile(path, tree, OPT_NONE)
+    assert (profile.counts, profile.given_up, profile.sites) == ({}, set(), {})
+
+
+# ---- vm ----
+
+def test_disassemble():
+    code = Compiler().compile(loop_program(10))
+    assert len(disassemble(code).split('\n')) > len(code)
+
+
+# the nodes of code and of the function bodies it holds that the VM leaves to the Interpreter
+def evaluated(code):
+    nodes = [type(code.nodes[code.code[i * 3 + 2]]).__name__ for i in range(len(code))
+             if code.code[i * 3] == EVAL]
+    for function in code.functions:
+        nodes += evaluated(function)
+    return nodes
+
+
+# the random programs that parse compile whole at each level: the VM runs none of them in the
+# Interpreter
+def test_random_programs_compiled():
+    for label, src in PROGRAMS.items():
+        if not label.startswith('random'):
+            continue
+        for level in LEVELS:
+            try:
+                tree = optimize(Parser(Lexer().tokenize(src)).parse().node, level)
+            except errors.SyntaxError:
+                break
+            assert evaluated(Compiler().compile(tree)) == [], (label, level)
+
+
+# the VM runs every engine program the same with function variables in dicts as in slots
+@pytest.mark.parametrize('label', ENGINE_PROGRAMS)
+def test_vm_dict_frames(label):
+    src = ENGINE_PROGRAMS[label]
+    tree = Parser(Lexer().tokenize(src)).parse().node
+    outcomes = [program_outcome(src, OPT_NONE, VM, (tree, Compiler(resolved=resolved).compile(tree)))
+                for resolved in (False, True)]
+    assert outcomes[0] == outcomes[1]
+
+
+# the VM keeps Safyr calls off the Python stack, so it goes deeper than the Interpreter can
+def test_vm_deep_recursion():
+    src = '.down [self n] <~ ? n == 0: 0 ! self(self n - 1) + 1\ndown(down 5000)\n'
+    res = VM().run(Parser(Lexer().tokenize(src)).parse().node, program_context(OPT_NONE))
+    assert repr(res.value) == '[<function down>, 5000]'
+
+
+# ---- ast cache ----
+
+# the path of a file in folder holding src
+def written(folder, src, name='p.sfr'):
+    path = os.path.join(folder, name)
+    with open(path, 'w') as f:
+        f.write(src)
+    return path
+
+
+# what parse_file gives for path, as a shape, with the cache on
+def cached_shape(path):
+    res = astcache.parse_file(path, use_cache=True)
+    return shape(res.node)
+
+
+# the cached tree of an unchanged source is loaded without parsing
+def test_ast_cache_hit(tmp_path, monkeypatch):
+    path = written(str(tmp_path), ENGINE_PROGRAMS['functions'])
+    parsed = cached_shape(path)
+    assert os.path.exists(astcache.cache_path(path))
+    monkeypatch.setattr(astcache, 'Parser', None)
+    assert cached_shape(path) == parsed
+
+
+# a changed source no longer matches the hash its tree was cached with: it is parsed again and
+# the cache rewritten
+def test_ast_cache_stale(tmp_path, monkeypatch):
+    path = written(str(tmp_path), ENGINE_PROGRAMS['functions'])
+    cached_shape(path)
+    src = ENGINE_PROGRAMS['functions'] + 'x = 1\n'
+    written(str(tmp_path), src)
+    assert cached_shape(path) == parse(src)
+    monkeypatch.setattr(astcache, 'Parser', None)
+    assert cached_shape(path) == parse(src)
+
+
+# a cache file that is damaged in any way is ignored and replaced by a good one
+def test_ast_cache_damaged(tmp_path, monkeypatch):
+    src = ENGINE_PROGRAMS['functions']
+    path = written(str(tmp_path), src)
+    cached_shape(path)
+    with open(astcache.cache_path(path), 'rb') as f:
+        data = f.read()
+    for damaged in (b'', data[:10], data[:-8], b'XXXX' + data[4:], data[:-1] + bytes([data[-1] ^ 1])):
+        with open(astcache.cache_path(path), 'wb') as f:
+            f.write(damaged)
+        assert cached_shape(path) == parse(src)
+        with open(astcache.cache_path(path), 'rb') as f:
+            assert f.read() == data
+
+
+# with the cache off nothing is written, for a program or a module it uses
+@pytest.mark.parametrize('cache', (0, 1))
+def test_ast_cache_off(tmp_path, monkeypatch, cache):
+    folder = str(tmp_path)
+    path = written(folder, ENGINE_PROGRAMS['functions'])
+    astcache.parse_file(path)
+    assert not os.path.exists(os.path.join(folder, astcache.CACHE_DIR))
+
+    module = written(folder, '.inc [x] <~ x + 1\n', 'module.sfr')
+    monkeypatch.setattr(interpreter, 'load_sfc', lambda *args: None)
+    monkeypatch.setattr(interpreter, 'parse_file', lambda _, **kwargs: astcache.parse_file(module, **kwargs))
+    context = program_context(OPT_NONE)
+    context.symbol_table.set('ast-cache', interpreter.Number(cache))
+    res = Interpreter().visit(Parser(Lexer().tokenize('use module\ninc(1)\n')).parse().node, context)
+    assert repr(res.value) == '[<function inc>, 2]'
+    assert os.path.exists(astcache.cache_path(module)) == bool(cache)
+
+
+# ---- sfc ----
+
+# compile the programs of the engine corpus to .sfc files at a level, returning the paths of
+# those that compiled (those that do not parse do not), by label
+def compiled_corpus(folder, level):
+    paths = {}
+    for i, (label, src) in enumerate(corpus(100).items()):
+        paths[label] = os.path.join(folder, f'p{i}.sfr')
+        with open(paths[label], 'w') as f:
+            f.write(src)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        sfc.main(['-O', str(level), folder])
+    return {label: path for label, path in paths.items() if os.path.exists(sfc.sfc_path(path))}
+
+
+@pytest.mark.parametrize('level', LEVELS)
+def test_sfc_runs_as_source(tmp_path, level):
+    paths = compiled_corpus(str(tmp_path), level)
+    assert len(paths) > 100
+    for label, path in paths.items():
+        with open(path) as f:
+            src = f.read()
+        expected = program_outcome(src, level)
+        for engine in (None, VM):
+            compiled = sfc.load_sfc(path, Lexer(), 0, level)
+            assert isinstance(compiled[1].code.obj, mmap.mmap)
+            assert program_outcome(src, level, engine, compiled) == expected, label
+
+
+# every file mapped while a test runs
+@pytest.fixture
+def mapped(monkeypatch):
+    mappings = []
+
+    class Mapping(mmap.mmap):
+        def __init__(self, *args, **kwargs):
+            mappings.append(self)
+
+    monkeypatch.setattr(mmap, 'mmap', Mapping)
+    return mappings
+
+
+# a .sfc compiled with other settings or from another source is turned down, and unmapped
+def test_sfc_stale(tmp_path, mapped):
+    path = str(tmp_path / 'p.sfr')
+    with open(path, 'w') as f:
+        f.write(ENGINE_PROGRAMS['functions'])
+    sfc.compile_file(path, Lexer(), 0, OPT_INLINE)
+    assert sfc.load_sfc(path, Lexer(), 1, OPT_INLINE) is None
+    assert sfc.load_sfc(path, Lexer(strip_debug=True), 0, OPT_INLINE) is None
+    assert sfc.load_sfc(path, Lexer(), 0, OPT_HOIST) is None
+    with open(path, 'a') as f:
+        f.write('\n')
+    assert sfc.load_sfc(path, Lexer(), 0, OPT_INLINE) is None
+    assert len(mapped) == 4 and all(m.closed for m in mapped)
+    os.remove(path)
+    assert sfc.load_sfc(path, Lexer(), 0, OPT_INLINE) is not None
+
+
+# files of another format or damaged are turned down, and unmapped
+def test_sfc_damaged(tmp_path, mapped):
+    path = str(tmp_path / 'p.sfr')
+    with open(path, 'w') as f:
+        f.write(ENGINE_PROGRAMS['functions'])
+    sfc.compile_file(path, Lexer(), 0, OPT_INLINE)
+    with open(sfc.sfc_path(path), 'rb') as f:
+        data = f.read()
+    for damaged in (data[:10], b'XXXX' + data[4:], data[:-1] + bytes([data[-1] ^ 1]), data[:-8]):
+        with open(sfc.sfc_path(path), 'wb') as f:
+            f.write(damaged)
+        assert sfc.load_sfc(path, Lexer(), 0, OPT_INLINE) is None
+    assert len(mapped) == 4 and all(m.closed for m in mapped)
@@ -0,0 +1,794 @@
+# Tiered execution for the Interpreter.  Each loop counts its back edges and each function body
+# its calls; past a threshold the loop or body is translated into the source of one Python
+# function, compiled once with compile() and run from then on, in place of Interpreter.visit.
+# A loop is promoted in the middle of a run: the Interpreter hands the function the state of
+# its loop (the counter, the bound and step, the elements so far) and the rest of the loop runs
+# compiled.
+#
+# The translation is specialized on what the values looked like when the code became hot.
+# Arithmetic and comparisons on variables holding Numbers (INT or FLT) and on number literals
+# are computed on Python numbers in one go, with one Number made for the result, and a call of
+# a variable holding a Function goes straight into its body.  Guards check those speculations
+# where they are made: the operands' types, and the callee's identity.  A guard that fails runs
+# that node as the Interpreter does, marks the node to be translated without speculating, and
+# drops the unit: a promoted loop hands its state back to the Interpreter at its next back edge,
+# a function body is run by the Interpreter from its next call on.  Code that becomes hot again
+# is translated again, at most MAX_DEOPTS times.
+#
+# Everything else is translated as Interpreter does it, and the nodes that are rare or run
+# elsewhere (structs, maps, references, property and container access, use, when, function
+# definitions) are handed to the Interpreter.  Assignments other than the plain replacement of
+# a plain variable go through Interpreter.assign, so static and constant checks and when
+# triggers work as before; errors, break, continue and return are the signals in interpreter.py.
+#
+# With a Profile (see feedback.py) in Tiers.profile, counting and speculating also go by what
+# earlier runs of the program met, and specialized sites count their runs and what their guards
+# found.
+#
+# usage: Interpreter.tiering = Tiers() for the run of a program, as the shell does with tier = 1
+
+import itertools
+import math
+
+from errors import BuiltinViolationError, VariableAccessError
+from interpreter import (BreakSignal, Context, ContinueSignal, ErrorSignal, Function, Interpreter,
+                         ReturnSignal, SymbolTable, settle)
+from lexer import KWDS
+from optimizer import InlineCallNode, InvariantNode, ResetNode
+from parser import (BinOpNode, BreakNode, CallNode, CapsuleNode, ContinueNode, ForNode, IfNode,
+                    LazyBlockNode, ListNode, NumberNode, ReturnNode, StringNode, UnaryOpNode,
+                    VarAccessNode, VarAssignNode, WhileNode)
+from quicken import OPERATOR_METHODS, apart, derived, fresh, fresh_list, lent, placed, read_at
+from typedef import List, Number, String, Struct, kept
+
+LOOP_THRESHOLD = 200    # back edges of a loop before it is compiled
+CALL_THRESHOLD = 50     # calls of a function body before it is compiled
+MAX_DEOPTS = 4          # units of one loop or body dropped before it stays interpreted
+
+# the Python the operators Numbers are computed with in place turn into; {} are the operands
+ARITHMETIC = {'PLS': '{} + {}', 'MNS': '{} - {}', 'MUL': '{} * {}', 'DIV': '{} / {}',
+              'MOD': '{} % {}', 'POW': '{} ** {}'}
+TESTS = {'EQ': 'int({} == {})', 'NE': 'int({} != {})', 'LT': 'int({} < {})', 'GT': 'int({} > {})',
+         'LE': 'int({} <= {})', 'GE': 'int({} >= {})', 'AND': 'int({} and {})',
+         'OR': 'int({} or {})', 'NAND': 'int(not ({} and {}))', 'NOR': 'int(not ({} or {}))',
+         'XOR': 'int(({0} and not {1}) or (not {0} and {1}))'}
+
+
+# raised at the back edge of a promoted loop whose unit was dropped, with the loop's state
+class Deopt(Exception):
+    def __init__(self, state):
+        self.state = state
+
+
+# a variable's value as reading it gives it, outside a struct
+def read(value, context, pos_start, pos_end):
+    if isinstance(value, Struct):
+        return value.copy().set_pos(pos_start, pos_end)
+    return lent(value, context, pos_start, pos_end)
+
+
+# the value a call gives, from the value the function returned
+def returned(value, context, pos_start, pos_end):
+    if isinstance(value, Struct):
+        return value.copy().set_pos(pos_start, pos_end)
+    return placed(value, context, pos_start, pos_end)
+
+
+# the right operand of a binary operation whose left one is the struct left
+def struct_operand(walker, node, left):
+    try:
+        return walker.visit(node.right_node, left.context).unwrap()
+    except VariableAccessError:
+        raise VariableAccessError(node.pos_start, node.pos_end,
+                                  f"Struct has no property '{node.right_node.var_name_tok}'")
+
+
+# a loop or function body compiled to Python; function is what the source defines
+class Unit:
+    def __init__(self, tiers, node, source, function):
+        self.tiers = tiers
+        self.node = node
+        self.source = source
+        self.function = function
+        self.valid = True
+        self.profile = tiers.profile
+
+    # a guard at node failed on values: node is translated without speculating from now on,
+    # and the unit is dropped.  record is the site's in the profile, if there is one.
+    def fail(self, node, record=None, *values):
+        self.tiers.generic.add(node)
+        self.valid = False
+        if record is not None:
+            record[1].update(self.profile.describe(value) for value in values if value is not None)
+
+    # run the rest of a promoted loop from its state (a for loop's counter, bound and step);
+    # returns None and the loop's RTResult, or the counter to go on from and None when the unit
+    # was dropped
+    def resume(self, walker, context, elements, *state):
+        try:
+            return None, settle(self.function, walker, context, elements, *state)
+        except Deopt as deopt:
+            self.tiers.drop(self)
+            return deopt.state, None
+
+
+class Tiers:
+    def __init__(self, loop_threshold=LOOP_THRESHOLD, call_threshold=CALL_THRESHOLD):
+        self.loop_threshold = loop_threshold
+        self.call_threshold = call_threshold
+        # node -> back edges or calls counted since it last got a unit
+        self.counts = {}
+        self.units = {}
+        self.deopts = {}
+        # nodes to translate without speculating, and loops and bodies left to the Interpreter
+        self.generic = set()
+        self.given_up = set()
+        # the Profile of the program running, or None
+        self.profile = None
+
+    # called at each back edge of the loop node: the unit to run the rest of the loop in, once
+    # the loop is hot
+    def loop(self, node, context):
+        return self.unit(node, context, self.loop_threshold)
+
+    # the result of running the function body node in context, compiled once it is hot
+    def run_body(self, walker, node, context):
+        unit = self.unit(node, context, self.call_threshold)
+        if unit is None:
+            return walker.visit(node, context)
+        return settle(unit.function, walker, context)
+
+    def unit(self, node, context, threshold):
+        unit = self.units.get(node)
+        if unit is not None and not unit.valid:
+            self.drop(unit)
+            unit = None
+        if unit is None:
+            count = self.counts[node] = self.counts.get(node, 0) + 1
+            if self.profile is not None:
+                # code that was hot in earlier runs is compiled when it is first met
+                count = max(count, self.profile.count(node))
+            if count < threshold or node in self.given_up:
+                return None
+        if context.display_name.startswith('struct') or type(context.symbol_table) is not SymbolTable:
+            return None
+        return unit or self.promote(node, context)
+
+    def promote(self, node, context):
+        if self.profile is not None and self.profile.gave_up(node):
+            self.given_up.add(node)
+            return None
+        try:
+            unit = Translator(self, context).unit(node)
+        except (SyntaxError, RecursionError, MemoryError):
+            # nested deeper than Python compiles
+            self.given_up.add(node)
+            return None
+        self.units[node] = unit
+        return unit
+
+    def drop(self, unit):
+        node = unit.node
+        if self.units.get(node) is unit:
+            del self.units[node]
+            self.counts[node] = 0
+            self.deopts[node] = self.deopts.get(node, 0) + 1
+            if self.deopts[node] >= MAX_DEOPTS:
+                self.given_up.add(node)
+                if self.profile is not None:
+                    self.profile.give_up(node)
+
+    # Function.execute for a function read from a variable and called at pos_start..pos_end
+    # in context, without the copies the call makes of it
+    def call(self, function, args, context, pos_start, pos_end):
+        if len(args) != len(function.arg_names):
+            return function.copy().set_context(context).set_pos(pos_start, pos_end).execute(args).unwrap()
+        exec_ctx = Context(function.name, context, pos_start)
+        exec_ctx.symbol_table = SymbolTable(context.symbol_table)
+        function.populate_args(function.arg_names, args, exec_ctx)
+        res = self.run_body(Interpreter(), function.body_node, exec_ctx)
+        if res.error: raise ErrorSignal(res.error)
+        if res.func_return_value is None:
+            if res.loop_should_continue: raise ContinueSignal()
+            if res.loop_should_break: raise BreakSignal()
+        return (res.value if function.auto_return else None) or res.func_return_value or Number.null
+
+
+# Translates one loop or function body to Python source.  Each node adds the statements that
+# compute its value to the source and gives back the Python expression holding the value;
+# values are Values made exactly as the Interpreter makes them.
+class Translator:
+    def __init__(self, tiers, context):
+        self.tiers = tiers
+        # the variables as they are when the code becomes hot, which the code is specialized on
+        self.variables = context.symbol_table
+        self.profile = tiers.profile
+        self.lines = []
+        self.indent = 1
+        self.names = itertools.count()
+        self.namespace = {'Number': Number, 'String': String, 'Struct': Struct, 'Function': Function,
+                          'Context': Context, 'SymbolTable': SymbolTable, 'Interpreter': Interpreter,
+                          'ErrorSignal': ErrorSignal, 'ReturnSignal': ReturnSignal,
+                          'BreakSignal': BreakSignal, 'ContinueSignal': ContinueSignal,
+                          'VariableAccessError': VariableAccessError,
+                          'BuiltinViolationError': BuiltinViolationError, 'Deopt': Deopt,
+                          'fresh': fresh, 'derived': derived, 'fresh_list': fresh_list, 'kept': kept,
+                          'lent': lent, 'read': read, 'returned': returned, 'read_at': read_at,
+                          'apart': apart, 'struct_operand': struct_operand, 'tiers': tiers}
+        self.constants = {}
+        # the Python names of the context and table the code runs in, and whether it is in the
+        # body of a loop it compiles, where break and continue are Python's
+        self.context, self.table, self.symbols = 'context', 'table', 'symbols'
+        self.in_loop = False
+
+    def unit(self, node):
+        if isinstance(node, ForNode):
+            self.emit('def resume(walker, context, elements, i, end, step):')
+        elif isinstance(node, WhileNode):
+            self.emit('def resume(walker, context, elements):')
+        else:
+            self.emit('def run(walker, context):')
+        self.indent += 1
+        self.emit('table = context.symbol_table')
+        self.emit('symbols = table.symbols')
+        if isinstance(node, ForNode):
+            self.for_loop(node, 'i', 'end', 'step', 'elements', promoted=True)
+            self.emit(f'return fresh_list(elements, context, {self.const(node.pos_start)}, {self.const(node.pos_end)})')
+        elif isinstance(node, WhileNode):
+            self.while_loop(node, 'elements', promoted=True)
+            self.emit(f'return fresh_list(elements, context, {self.const(node.pos_start)}, {self.const(node.pos_end)})')
+        else:
+            self.emit(f'return {self.value(node)}')
+        source = '\n'.join(self.lines) + '\n'
+        unit = Unit(self.tiers, node, source, None)
+        self.namespace['unit'] = unit
+        exec(compile(source, f'<tier {type(node).__name__}>', 'exec'), self.namespace)
+        unit.function = self.namespace['resume' if isinstance(node, (ForNode, WhileNode)) else 'run']
+        return unit
+
+    ###################################
+
+    def emit(self, line):
+        self.lines.append('    ' * (self.indent - 1) + line)
+
+    def name(self, prefix='v'):
+        return f'{prefix}{next(self.names)}'
+
+    # a name in the code's globals for obj
+    def const(self, obj):
+        if obj is None:
+            return 'None'
+        name = self.constants.get(id(obj))
+        if name is None:
+            name = self.constants[id(obj)] = f'K{len(self.constants)}'
+            self.namespace[name] = obj
+        return name
+
+    def number(self, value):
+        if type(value) is int or type(value) is float and math.isfinite(value):
+            return f'({value!r})'
+        return self.const(value)
+
+    # whether earlier runs met nothing but what description describes at the site node
+    def settled(self, node, description):
+        return self.profile is None or self.profile.stable(node, description)
+
+    # the profile's record of the specialized site node as a name in the code's globals, 'None'
+    # without one
+    def record(self, node, description):
+        return self.const(self.profile.site(node, description) if self.profile else None)
+
+    def pos(self, node):
+        return self.const(node.pos_start), self.const(node.pos_end)
+
+    # the statements of a block, indented under a line already emitted
+    def block(self, emit_body):
+        self.indent += 1
+        emit_body()
+        self.indent -= 1
+
+    # node's value computed by the Interpreter
+    def walked(self, node, target, context=None):
+        self.emit(f'{target} = walker.visit({self.const(node)}, {context or self.context}).unwrap()')
+
+    # a Number or String built in one go from the fields given
+    def box(self, target, cls, fields):
+        fields = dict(fields)
+        self.emit(f"{target} = fresh({cls}, {fields['value']}, {fields['type']}, {fields['context']}, "
+                  f"{fields['pos_start']}, {fields['pos_end']}, {fields['static']}, {fields['const']}, "
+                  f"{fields['triggers']})")
+
+    # the variable name as SymbolTable.get finds it
+    def lookup(self, name, table=None, symbols=None):
+        return f'{symbols or self.symbols}.get({name!r}) or {table or self.table}.get({name!r})'
+
+    ###################################
+
+    def value(self, node):
+        method = getattr(self, f'value_{type(node).__name__}', None)
+        if method is None:
+            target = self.name()
+            self.walked(node, target)
+            return target
+        return method(node)
+
+    # whether node's value is true, as a Python expression
+    def truth(self, node):
+        if self.fusable(node):
+            result, origin = self.fused(node)
+            target = self.name('c')
+            self.emit(f'if {result} is None:')
+            self.block(lambda: self.emit(
+                f'{target} = walker.visit({self.const(node)}, {self.context}).unwrap().is_true()'))
+            self.emit('else:')
+            self.block(lambda: self.emit(f'{target} = {result} != 0'))
+            return target
+        return f'{self.value(node)}.is_true()'
+
+    def value_NumberNode(self, node):
+        target = self.name()
+        start, end = self.pos(node)
+        self.box(target, 'Number', [('pos_start', start), ('pos_end', end), ('context', self.context),
+                                    ('value', self.number(node.tok.value)), ('type', repr(node.tok.type)),
+                                    ('static', 'False'), ('const', 'False'), ('triggers', '[]')])
+        return target
+
+    def value_StringNode(self, node):
+        target = self.name()
+        start, end = self.pos(node)
+        self.box(target, 'String', [('pos_start', start), ('pos_end', end), ('context', self.context),
+                                    ('value', repr(node.tok.value)), ('type', "'STR'"),
+                                    ('static', 'False'), ('const', 'False'), ('triggers', '[]')])
+        return target
+
+    def value_CapsuleNode(self, node):
+        values = [self.value(el) for el in node.elements]
+        target = self.name()
+        start, end = self.pos(node)
+        if len(values) == 1:
+            self.emit(f'{target} = {values[0]}.set_context({self.context}).set_pos({start}, {end})')
+        else:
+            self.emit(f'{target} = fresh_list([{", ".join(values)}], {self.context}, {start}, {end})')
+        return target
+
+    def value_ListNode(self, node):
+        values = [self.value(el) for el in node.elements]
+        target = self.name()
+        start, end = self.pos(node)
+        self.emit(f'{target} = fresh_list([{", ".join(f"kept({v})" for v in values)}], {self.context}, {start}, {end})')
+        return target
+
+    def value_VarAccessNode(self, node):
+        name = node.var_name_tok.value
+        stored, target = self.name('s'), self.name()
+        start, end = self.pos(node)
+        self.emit(f'{stored} = {self.lookup(name)}')
+        self.emit(f'if {stored} is None:')
+        message = f"'{name}' is not defined"
+        self.block(lambda: self.emit(f'raise VariableAccessError({start}, {end}, {message!r})'))
+        self.emit(f'{target} = read({stored}, {self.context}, {start}, {end})')
+        return target
+
+    def value_VarAssignNode(self, node):
+        name = node.var_name_tok.value
+        start, end = self.pos(node)
+        if name in KWDS + ['T', 'F']:
+            self.emit(f'raise BuiltinViolationError({start}, {end}, {f"Cannot overwrite keyword {name}."!r})')
+            return 'None'
+        target = self.name()
+        self.emit(f'{target} = kept({self.value(node.value_node)})')
+        assign = f'{target} = walker.assign({self.const(node)}, {target}, {self.context}).unwrap()'
+        if node.op_tok.value != '=' or node.statictype != 'default' or node.const:
+            self.emit(assign)
+            return target
+
+        # what assign does to create a variable, or to replace one that is neither static nor
+        # constant and has no triggers, with a value that is not a struct
+        stored = self.name('s')
+        self.emit(f'if isinstance({target}, Struct):')
+        self.block(lambda: self.emit(assign))
+        self.emit('else:')
+        self.indent += 1
+        self.emit(f'{stored} = {self.lookup(name)}')
+        self.emit(f'if {stored} is None:')
+        self.block(lambda: [
+            self.emit(f"{target}.static = True if {self.table}.get('static-typing').is_true() else False"),
+            self.emit(f'{self.symbols}[{name!r}] = {target}')])
+        self.emit(f'elif not {stored}.static and not {stored}.const and not {stored}.triggers:')
+        self.block(lambda: [
+            self.emit(f'{target}.const = {stored}.const'),
+            self.emit(f'{target}.triggers = {stored}.triggers'),
+            self.emit(f'{self.symbols}[{name!r}] = {target}')])
+        self.emit('else:')
+        self.block(lambda: self.emit(assign))
+        self.indent -= 1
+        return target
+
+    ###################################
+    # arithmetic
+
+    # whether node is an operation on Numbers that can be computed in place: arithmetic,
+    # comparisons and logic over number literals and variables, the variables holding Numbers
+    # or nothing yet when the code became hot, and no guard of it failed before
+    def fusable(self, node):
+        if node in self.tiers.generic or not self.settled(node, 'Number'):
+            return False
+        if isinstance(node, BinOpNode):
+            if node.op_tok.type not in ARITHMETIC and node.op_tok.type not in TESTS:
+                return False
+            operands = (node.left_node, node.right_node)
+        elif isinstance(node, UnaryOpNode):
+            if node.op_tok.type not in ('MNS', 'NOT'):
+                return False
+            operands = (node.node,)
+        else:
+            return False
+        return all(self.fusable(operand) or self.number_leaf(operand) for operand in operands)
+
+    def number_leaf(self, node):
+        if isinstance(node, NumberNode):
+            return type(node.tok.value) in (int, float)
+        if isinstance(node, VarAccessNode):
+            value = self.variables.get(node.var_name_tok.value)
+            return value is None or type(value) is Number
+        return False
+
+    # Compute the fusable node on Python numbers: the variables it reads are read once, guarded
+    # to hold Numbers and their values combined.  Gives the name holding the result, None when
+    # the Interpreter has to compute it (a guard failed, or a division by zero or Python error
+    # is for it to report), and the fields of the Number the Interpreter would make for it.
+    def fused(self, node):
+        stored = {}
+
+        def leaves(node):
+            if isinstance(node, VarAccessNode):
+                name = node.var_name_tok.value
+                if name not in stored:
+                    stored[name] = self.name('s')
+                    self.emit(f'{stored[name]} = {self.lookup(name)}')
+            elif isinstance(node, BinOpNode):
+                leaves(node.left_node)
+                leaves(node.right_node)
+            elif isinstance(node, UnaryOpNode):
+                leaves(node.node)
+        leaves(node)
+
+        steps = []
+
+        def compute(node):
+            if isinstance(node, NumberNode):
+                return self.number(node.tok.value)
+            if isinstance(node, VarAccessNode):
+                return f'{stored[node.var_name_tok.value]}.value'
+            target = self.name('n')
+            if isinstance(node, UnaryOpNode):
+                operand = compute(node.node)
+                if node.op_tok.type == 'MNS':
+                    steps.append(f'{target} = {operand} * -1')
+                else:
+                    steps.append(f'{target} = 1 if {operand} == 0 else 0')
+                return target
+            left, right = compute(node.left_node), compute(node.right_node)
+            op = node.op_tok.type
+            steps.append(f'{target} = ' + (ARITHMETIC.get(op) or TESTS[op]).format(left, right))
+            return target
+        result = compute(node)
+        record = self.record(node, 'Number')
+
+        def body():
+            if record != 'None':
+                self.emit(f'{record}[0] += 1')
+            self.emit('try:')
+            self.block(lambda: [self.emit(step) for step in steps])
+            self.emit('except ZeroDivisionError:')
+            self.block(lambda: self.emit(f'{result} = None'))
+        if stored:
+            self.emit('if ' + ' and '.join(f'type({s}) is Number' for s in stored.values()) + ':')
+            self.block(body)
+            self.emit('else:')
+            self.block(lambda: [self.emit(f'unit.fail({self.const(node)}, {record}, {", ".join(stored.values())})'),
+                                self.emit(f'{result} = None')])
+        else:
+            body()
+        return result, self.origin(node, stored)
+
+    # the fields of the Number the Interpreter gives for the fusable node, but for its value:
+    # arithmetic copies its left operand, comparisons make a new Number
+    def origin(self, node, stored):
+        if isinstance(node, NumberNode):
+            start, end = self.pos(node)
+            return [('pos_start', start), ('pos_end', end), ('context', self.context),
+                    ('type', repr(node.tok.type)), ('static', 'False'), ('const', 'False'),
+                    ('triggers', '[]')]
+        if isinstance(node, VarAccessNode):
+            start, end = self.pos(node)
+            s = stored[node.var_name_tok.value]
+            return [('pos_start', start), ('pos_end', end), ('context', self.context),
+                    ('type', "'INT'"), ('static', f'{s}.static'), ('const', f'{s}.const'),
+                    ('triggers', f'{s}.triggers')]
+        if isinstance(node, UnaryOpNode):
+            start, end = self.pos(node)
+            if node.op_tok.type == 'MNS':
+                fields = dict(self.origin(node.node, stored))
+                fields.update(pos_start=start, pos_end=end, type="'INT'")
+                return list(fields.items())
+            return [('pos_start', start), ('pos_end', end), ('context', self.context), ('type', "'INT'"),
+                    ('static', 'False'), ('const', 'False'), ('triggers', '[]')]
+        if node.op_tok.type in ARITHMETIC:
+            fields = dict(self.origin(node.left_node, stored))
+            fields['type'] = "'INT'"
+            return list(fields.items())
+        return [('pos_start', 'None'), ('pos_end', 'None'), ('context', self.context), ('type', "'INT'"),
+                ('static', 'False'), ('const', 'False'), ('triggers', '[]')]
+
+    def fused_value(self, node):
+        result, origin = self.fused(node)
+        target = self.name()
+        self.emit(f'if {result} is None:')
+        self.block(lambda: self.walked(node, target))
+        self.emit('else:')
+        self.block(lambda: self.box(target, 'Number', origin[:3] + [('value', result)] + origin[3:]))
+        return target
+
+    def value_BinOpNode(self, node):
+        if self.fusable(node):
+            return self.fused_value(node)
+        op = node.op_tok.type
+        left, right, target = self.value(node.left_node), self.name(), self.name()
+        self.emit(f'if isinstance({left}, Struct):')
+        self.block(lambda: self.emit(f'{right} = struct_operand(walker, {self.const(node)}, {left})'))
+        self.emit('else:')
+        if isinstance(node.right_node, (NumberNode, StringNode)):
+            self.block(lambda: self.emit(f'{right} = {self.value(node.right_node)}'))
+        else:
+            # the left operand put back where it was read, if the right one reads it again
+            at = self.name()
+            self.block(lambda: [self.emit(f'{at} = read_at({left})'),
+                                self.emit(f'{right} = {self.value(node.right_node)}'),
+                                self.emit(f'{left} = apart({left}, {at})')])
+        if op == 'DOT':
+            return right
+
+        generic = [f'{target}, error = {left}.{OPERATOR_METHODS[op]}({right})',
+                   'if error: raise ErrorSignal(error)']
+        if op in ARITHMETIC or op in TESTS:
+            test = f'type({left}) is Number and type({right}) is Number'
+            if op in ('DIV', 'MOD'):
+                test += f' and {right}.value != 0'
+            self.emit(f'if {test}:')
+            if op in ARITHMETIC:
+                self.block(lambda: self.emit(
+                    f'{target} = derived({left}, ' + ARITHMETIC[op].format(f'{left}.value', f'{right}.value') + ')'))
+            else:
+                self.block(lambda: self.box(target, 'Number', [
+                    ('pos_start', 'None'), ('pos_end', 'None'), ('context', f'{left}.context'),
+                    ('value', TESTS[op].format(f'{left}.value', f'{right}.value')), ('type', "'INT'"),
+                    ('static', 'False'), ('const', 'False'), ('triggers', '[]')]))
+            if op == 'PLS':
+                self.emit(f'elif type({left}) is String and type({right}) is String:')
+                self.block(lambda: self.box(target, 'String', [
+                    ('pos_start', 'None'), ('pos_end', 'None'), ('context', f'{left}.context'),
+                    ('value', f'{left}.value + {right}.value'), ('type', "'STR'"),
+                    ('static', 'False'), ('const', 'False'), ('triggers', '[]')]))
+            self.emit('else:')
+            self.block(lambda: [self.emit(line) for line in generic])
+        else:
+            for line in generic:
+                self.emit(line)
+        return target
+
+    def value_UnaryOpNode(self, node):
+        if self.fusable(node):
+            return self.fused_value(node)
+        number, target = self.value(node.node), self.name()
+        start, end = self.pos(node)
+        if node.op_tok.type == 'MNS':
+            self.emit(f'{target}, error = {number}.mul(Number(-1))')
+        elif node.op_tok.type == 'NOT':
+            self.emit(f'{target}, error = {number}.lognot(Number(-1))')
+        else:
+            self.emit(f'{target}, error = {number}, None')
+        self.emit('if error: raise ErrorSignal(error)')
+        self.emit(f'{target}.set_pos({start}, {end})')
+        return target
+
+    ###################################
+    # control flow
+
+    def value_IfNode(self, node):
+        target = self.name()
+
+        def cases(rest):
+            if not rest:
+                if node.else_case:
+                    self.emit(f'{target} = {self.value(node.else_case[0])}')
+                else:
+                    self.emit(f'{target} = None')
+                return
+            condition, expr, ret = rest[0]
+            self.emit(f'if {self.truth(condition)}:')
+            self.block(lambda: self.emit(f'{target} = {self.value(expr)}'))
+            self.emit('else:')
+            self.block(lambda: cases(rest[1:]))
+        cases(list(node.cases))
+        return target
+
+    def value_ForNode(self, node):
+        start, end = self.value(node.start_value_node), self.value(node.end_value_node)
+        i, bound, step, elements = self.name('i'), self.name('e'), self.name('d'), self.name('l')
+        if node.step_value_node:
+            self.emit(f'{step} = {self.value(node.step_value_node)}.value')
+        else:
+            self.emit(f'{step} = 1 if {start}.value < {end}.value else -1')
+        self.emit(f'{i} = {start}.value')
+        self.emit(f'{bound} = {end}.value')
+        self.emit(f'{elements} = []')
+        self.for_loop(node, i, bound, step, elements)
+        target = self.name()
+        start, end = self.pos(node)
+        self.emit(f'{target} = fresh_list({elements}, {self.context}, {start}, {end})')
+        return target
+
+    # the loop of node from counter i to bound by step, appending the body's values to elements;
+    # the promoted loop of a unit checks at each back edge that the unit is still valid
+    def for_loop(self, node, i, bound, step, elements, promoted=False):
+        forwards = self.name('f')
+        self.emit(f'{forwards} = {step} >= 0')
+        self.emit(f'while {i} < {bound} if {forwards} else {i} > {bound}:')
+        self.indent += 1
+        if promoted:
+            self.emit('if not unit.valid:')
+            self.block(lambda: self.emit(f'raise Deopt({i})'))
+        self.emit(f"{self.symbols}[{node.var_name_tok.value!r}] = fresh(Number, {i}, 'INT', None)")
+        self.emit(f'{i} += {step}')
+        self.loop_body(node.body_node, elements)
+        self.indent -= 1
+
+    def value_WhileNode(self, node):
+        elements = self.name('l')
+        self.emit(f'{elements} = []')
+        self.while_loop(node, elements)
+        target = self.name()
+        start, end = self.pos(node)
+        self.emit(f'{target} = fresh_list({elements}, {self.context}, {start}, {end})')
+        return target
+
+    def while_loop(self, node, elements, promoted=False):
+        self.emit('while True:')
+        self.indent += 1
+        if promoted:
+            self.emit('if not unit.valid:')
+            self.block(lambda: self.emit('raise Deopt(None)'))
+        self.emit(f'if not {self.truth(node.condition_node)}:')
+        self.block(lambda: self.emit('break'))
+        self.loop_body(node.body_node, elements)
+        self.indent -= 1
+
+    # one run of a loop's body; break and continue in it are Python's, and those raised by the
+    # calls it makes are caught
+    def loop_body(self, body, elements):
+        in_loop, self.in_loop = self.in_loop, True
+        self.emit('try:')
+        result = []
+        self.block(lambda: result.append(self.value(body)))
+        self.emit('except ContinueSignal:')
+        self.block(lambda: self.emit('continue'))
+        self.emit('except BreakSignal:')
+        self.block(lambda: self.emit('break'))
+        self.emit(f'{elements}.append({result[0]})')
+        self.in_loop = in_loop
+
+    def value_ContinueNode(self, node):
+        self.emit('continue' if self.in_loop else 'raise ContinueSignal()')
+        return 'None'
+
+    def value_BreakNode(self, node):
+        self.emit('break' if self.in_loop else 'raise BreakSignal()')
+        return 'None'
+
+    # a return with no value to return (an if without else) returns nothing, and running goes on
+    def value_ReturnNode(self, node):
+        if not node.return_node:
+            self.emit('raise ReturnSignal(Number.null)')
+            return 'None'
+        value = self.value(node.return_node)
+        self.emit(f'if {value} is not None:')
+        self.block(lambda: self.emit(f'raise ReturnSignal({value})'))
+        return 'None'
+
+    ###################################
+    # calls
+
+    def value_CallNode(self, node):
+        start, end = self.pos(node)
+        callee = node.node_to_call
+        function = self.variables.get(callee.var_name_tok.value) if isinstance(callee, VarAccessNode) else None
+        description = self.profile and self.profile.describe(function)
+        speculated = type(function) is Function and not isinstance(function.body_node, LazyBlockNode) and \
+            node not in self.tiers.generic and self.settled(node, description)
+        to_call, result = self.name('f'), self.name()
+
+        if speculated:
+            # the variable still holds the function: call it as it is
+            stored, direct = self.name('s'), self.name('g')
+            record = self.record(node, description)
+            self.emit(f'{stored} = {self.lookup(callee.var_name_tok.value)}')
+            self.emit(f'{direct} = type({stored}) is Function and {stored}.body_node is '
+                      f'{self.const(function.body_node)}')
+            self.emit(f'if not {direct}:')
+            self.block(lambda: [self.emit(f'unit.fail({self.const(node)}, {record}, {stored})'),
+                                self.emit(f'{to_call} = {self.value(callee)}.copy().set_pos({start}, {end})')])
+        else:
+            self.emit(f'{to_call} = {self.value(callee)}.copy().set_pos({start}, {end})')
+        args = ', '.join(self.value(a) for a in node.arg_nodes)
+
+        if speculated:
+            self.emit(f'if {direct}:')
+            self.indent += 1
+            if record != 'None':
+                self.emit(f'{record}[0] += 1')
+            self.emit(f'{result} = tiers.call({stored}, [{args}], {self.context}, {start}, {end})')
+            self.indent -= 1
+            self.emit('else:')
+            self.block(lambda: self.emit(f'{result} = {to_call}.execute([{args}]).unwrap()'))
+        else:
+            self.emit(f'{result} = {to_call}.execute([{args}]).unwrap()')
+        self.emit(f'{result} = returned({result}, {self.context}, {start}, {end})')
+        return result
+
+    # the inlined body runs here while the variable still holds the function inlined
+    def value_InlineCallNode(self, node):
+        function, target = self.name('s'), self.name()
+        start, end = self.pos(node)
+        self.emit(f'{function} = {self.table}.get({node.name!r})')
+        self.emit(f'if type({function}) is not Function or {function}.body_node is not {self.const(node.body)}:')
+        self.block(lambda: [self.emit(f'unit.fail({self.const(node)})'), self.walked(node.call, target)])
+        self.emit(f'elif {self.context}.display_name.startswith("struct"):')
+        self.block(lambda: self.walked(node, target))
+        self.emit('else:')
+        self.indent += 1
+        args = [self.value(a) for a in node.call.arg_nodes]
+        context, table, symbols = self.name('x'), self.name('t'), self.name('y')
+        self.emit(f'{context} = Context({function}.name, {self.context}, {start})')
+        self.emit(f'{table} = {context}.symbol_table = SymbolTable({self.table})')
+        self.emit(f'{symbols} = {table}.symbols')
+        self.emit(f'{function}.populate_args({self.const(node.arg_names)}, [{", ".join(args)}], {context})')
+        outer = self.context, self.table, self.symbols, self.in_loop
+        self.context, self.table, self.symbols, self.in_loop = context, table, symbols, False
+        value = self.value(node.body)
+        self.context, self.table, self.symbols, self.in_loop = outer
+        self.emit(f'{target} = returned({value} or Number.null, {self.context}, {start}, {end})')
+        self.indent -= 1
+        return target
+
+    ###################################
+    # hoisted expressions, see optimizer.py
+
+    def value_InvariantNode(self, node):
+        stored, target = self.name('s'), self.name()
+        self.emit(f'{stored} = walker.invariants.get({node.key!r})')
+        self.emit(f'if {stored} is None or {stored}[1] != Interpreter.trigger_epoch:')
+        self.indent += 1
+        self.emit(f'{target} = {self.value(node.expr)}')
+        self.emit(f'if isinstance({target}, (Number, String)):')
+        self.block(lambda: self.emit(
+            f'walker.invariants[{node.key!r}] = ({target}.copy(), Interpreter.trigger_epoch)'))
+        self.indent -= 1
+        self.emit('else:')
+        self.indent += 1
+        self.emit(f'{target} = {stored}[0].copy()')
+        self.emit(f'if {target}.pos_start is not None:')
+        anchor = self.const(node.anchor)
+        self.block(lambda: self.emit(f'{target}.set_pos({anchor}.pos_start, {anchor}.pos_end)'))
+        if node.shared:
+            self.emit(f'if not isinstance({target}, Number):')
+            self.block(lambda: self.emit(f'{target}.triggers = []'))
+        else:
+            self.emit(f'{target}.triggers = []')
+        self.indent -= 1
+        return target
+
+    def value_ResetNode(self, node):
+        for key in node.keys:
+            self.emit(f'walker.invariants.pop({key!r}, None)')
+        return self.value(node.node)
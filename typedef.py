@@ -1,6 +1,13 @@
 from errors import RuntimeError, InvalidSyntaxError
 
 class Value:
+    # whether the value may be held in more than one place: a variable read lends out the
+    # value the variable holds instead of a copy of it (see Interpreter.visit_VarAccessNode),
+    # and what keeps a value copies one that is lent (see kept)
+    shared = False
+    # the mark of the List that made the value its own to change in place (see List.owned)
+    owner = None
+
     def __init__(self, t=None, static=False, const=False):
         self.set_pos()
         self.set_context()
@@ -275,6 +282,8 @@ class Number(Value):
 Number.null = Number(0)
 Number.false = Number(0)
 Number.true = Number(1)
+# returned by everyone who needs them, so never kept as they are
+Number.null.shared = Number.false.shared = Number.true.shared = True
 
 class String(Value):
     def __init__(self, value):
@@ -361,17 +370,45 @@ class String(Value):
         return self.value == other.value if other is not None else False
 
 class List(Value):
+    # whether the elements are a list another List holds too, as copy() leaves them; whatever
+    # changes them in place calls unshare() first
+    shares_elements = False
+    # what the elements this List made its own are marked with (see owned); dropped whenever
+    # another list may come to hold them too
+    mark = None
+
     def __init__(self, elements):
         super().__init__(t='LST')
         self.elements = elements
 
+    # make the list of elements this List's own, by copying it if it is shared; the element
+    # values are then held by both lists, and neither has them as its own
+    def unshare(self):
+        if self.shares_elements:
+            self.elements = list(self.elements)
+            self.shares_elements = False
+
+    # the element at index, made this List's own to be changed in place (see List.at and
+    # Interpreter.visit_ReferenceAssignNode): a copy of it, of the same type, which
+    # Number.copy does not keep, unless this List made it its own before
+    def owned(self, index):
+        self.unshare()
+        element = self.elements[index]
+        if self.mark is None:
+            self.mark = object()
+        if element.owner is not self.mark:
+            copy = element.copy()
+            copy.type = element.type
+            copy.owner = self.mark
+            element = self.elements[index] = copy
+        return element
+
     def add(self, other):
-        newlist = self.copy()
-        newlist.elements.append(other)
+        newlist = self.holding(self.elements + [kept(other)])
         return newlist, None
 
     def sub(self, other):
-        newlist = self.copy()
+        newlist = self.holding(list(self.elements))
         while other in newlist.elements:
             newlist.elements.remove(other)
         return newlist, None
@@ -383,9 +420,17 @@ class List(Value):
         elif other.value >= len(self.elements):
             return None, InvalidSyntaxError(self.pos_start, self.pos_end,
                                      "Index out of range")
-        elem = self.elements[other.value]
-        # elem = self.elements[other.value].copy()
-        return elem, None
+        return self.element(other.value), None
+
+    # the element at index, lent out: a list is made this List's own first, as what is done
+    # to it in place, by APPEND for one, must not change it where other lists hold it
+    def element(self, index):
+        elem = self.elements[index]
+        if type(elem) is List:
+            elem = self.owned(index)
+        if elem is not None:
+            elem.shared = True
+        return elem
 
     def sliceleft(self, other):
         val = other.value
@@ -394,8 +439,7 @@ class List(Value):
                                             "Input to '@' must be INT")
         elif other.value >= len(self.elements):
             val = len(self.elements)
-        newlist = self.copy()
-        newlist.elements = newlist.elements[:val]
+        newlist = self.holding(self.elements[:val])
         return newlist, None
 
     def sliceright(self, other):
@@ -405,12 +449,18 @@ class List(Value):
                                             "Input to '@' must be INT")
         elif other.value >= len(self.elements):
             val = len(self.elements)
-        newlist = self.copy()
-        newlist.elements = newlist.elements[-val:]
+        newlist = self.holding(self.elements[-val:])
         return newlist, None
 
     def copy(self):
-        copy = List(self.elements)
+        copy = self.holding(self.elements)
+        copy.shares_elements = self.shares_elements = True
+        return copy
+
+    # a copy of this List with elements in place of its own, which may hold its elements
+    def holding(self, elements):
+        self.mark = None
+        copy = List(elements)
         copy.static = self.static
         copy.const = self.const
         copy.triggers = self.triggers
@@ -449,6 +499,13 @@ class Map(Value):
         return str(self.elements)
     
 
+# value as a variable, an argument, a list or a map keeps it: a copy if it is lent out
+def kept(value):
+    if value is not None and value.shared:
+        return value.copy()
+    return value
+
+
 # I want to get rid of this, but it gets the job done for now.
 # All copying should be handled in house.
 from copy import deepcopy
@@ -0,0 +1,628 @@
+# A stack-based virtual machine running the bytecode bytecode.py compiles, in place of
+# Interpreter.visit.  One loop runs every instruction; a call pushes a frame onto a list and a
+# return pops it, so Safyr recursion no longer nests Python calls and is bounded only by memory.
+#
+# A call of a body with slots (see resolver.py) keeps its variables in a SlotTable, read and
+# written by index; names without a slot are looked up as before, the check of whether the
+# global table shows a name cached in the instruction for as long as its globals stay the same.
+#
+# It computes exactly what Interpreter does: values are created, copied and positioned the same
+# way, and what the bytecode leaves to an Interpreter (EVAL, the property read after a struct,
+# the body of a struct or a when trigger, assignments that check static types or constants or
+# run triggers) runs in one whose stored invariants are the frame's.  break and continue leave
+# the innermost loop of the running frame, and like in Interpreter pass out of functions that
+# have none; errors, and signals raised by the Interpreter, are the ones in interpreter.py.
+#
+# usage: VM().run(tree, context) -> RTResult, like Interpreter().visit(tree, context)
+
+from bytecode import *
+from errors import VariableAccessError
+from interpreter import (BreakSignal, Context, ContinueSignal, ErrorSignal, Function, Interpreter,
+                         ReturnSignal, StructGenerator, SymbolTable, settle)
+from parser import ContainerAccessNode, LazyBlockNode, NumberNode, StringNode
+from quicken import (ARITHMETIC_OPS, DIVISION_OPS, OPERATOR_METHODS, TEST_OPS, apart, derived, fresh,
+                     fresh_list, lent, placed, read_at)
+from typedef import List, Number, String, Struct, kept
+
+# how BINARY computes each operator on two Numbers: as a copy of the left one, the same unless
+# the right one is 0, as a new 0 or 1, only through the Value method, and the property operator
+BY_COPY, BY_DIVISION, BY_TEST, BY_METHOD, BY_DOT = range(5)
+
+# what a frame gives back when its code ends: nothing, its value, or its value as an inlined call
+PLAIN, AUTO, INLINED = range(3)
+
+
+# the Python objects each instruction works with, read from the pools once per code object
+def link(code):
+    if code.linked is None:
+        ops, operands = [], []
+        for i in range(len(code)):
+            op, arg, index = code.code[i * 3:i * 3 + 3]
+            ops.append(op)
+            operands.append(operand(code, op, arg, code.nodes[index] if index >= 0 else None))
+        code.linked = ops, operands
+    return code.linked
+
+
+def operand(code, op, arg, node):
+    if op == NUMBER:
+        value, t = code.consts[arg]
+        return value, t, node.pos_start, node.pos_end
+    if op == STRING:
+        return code.consts[arg], node.pos_start, node.pos_end
+    if op in (LOAD_NAME, LOAD_CALLEE):
+        # and the version of the globals the name was last looked up in, and whether they held it
+        return code.names[arg], node.pos_start, node.pos_end, [-1, False]
+    if op in (LOAD_FAST, LOAD_CALLEE_FAST):
+        return arg, code.slots[arg], node.pos_start, node.pos_end
+    if op in (STORE, STORE_FAST):
+        plain = node.op_tok.value == '=' and node.statictype == 'default' and not node.const
+        return node, node.var_name_tok.value, plain, arg
+    if op == BINARY:
+        op_type = code.consts[arg]
+        # and whether STRUCT_OPERAND or LIST_OPERAND ran before the right operand, leaving where
+        # the left one was read under it
+        left = node.root_var if type(node) is ContainerAccessNode else node.left_node
+        checked = not isinstance(left, (NumberNode, StringNode))
+        if op_type in ARITHMETIC_OPS: return BY_COPY, ARITHMETIC_OPS[op_type], OPERATOR_METHODS[op_type], checked
+        if op_type in DIVISION_OPS: return BY_DIVISION, DIVISION_OPS[op_type], OPERATOR_METHODS[op_type], checked
+        if op_type in TEST_OPS: return BY_TEST, TEST_OPS[op_type], OPERATOR_METHODS[op_type], checked
+        if op_type == 'DOT': return BY_DOT, None, None, checked
+        return BY_METHOD, None, OPERATOR_METHODS[op_type], checked
+    if op == STRUCT_OPERAND:
+        if type(node) is ContainerAccessNode:
+            # the positions of the BinOpNode the Interpreter makes for it
+            return arg, node.specifier, node.root_var.pos_start, node.specifier.pos_end
+        return arg, node.right_node, node.pos_start, node.pos_end
+    if op == PROPERTY:
+        name = node.specifier
+        return code.names[arg], name.pos_start, name.pos_end
+    if op == UNARY:
+        return code.consts[arg], node.pos_start, node.pos_end
+    if op in (LIST, CAPSULE, CALL, CALL_NAME):
+        return arg, node.pos_start, node.pos_end
+    if op == FOR_SETUP:
+        # the loop variable's slot, for FOR_ITER_FAST, or its name
+        name = node.var_name_tok.value
+        return arg, code.layout.get(name, name), node.step_value_node is not None
+    if op == END_LOOP:
+        return node.pos_start, node.pos_end
+    if op == MAKE_FUNCTION:
+        name = node.var_name_tok.value if node.var_name_tok else None
+        return (name, node.body_node, [a.value for a in node.arg_name_toks], node.auto_return,
+                node.pos_start, node.pos_end, code.functions[arg] if arg >= 0 else None)
+    if op == INLINE_GUARD:
+        return arg, node.name, node.body
+    if op == INLINE_CALL:
+        return node.arg_names, code.functions[arg], node.name, node.pos_start, node.pos_end
+    if op == INVARIANT:
+        return arg, node
+    if op in (MAKE_STRUCT, INVARIANT_STORE, RESET, WHEN, EVAL):
+        return node
+    return arg
+
+
+# The symbol table of a call whose body resolver.py gave slots: the variables with a slot are
+# kept in slots, the others in symbols.  Lookups by name find either, so to the Interpreter the
+# VM leaves work to, and to everything else that uses get and set, it is the SymbolTable it
+# replaces.
+class SlotTable(SymbolTable):
+    def __init__(self, parent, layout):
+        self.symbols = {}
+        self.parent = parent
+        self._globals = []
+        # variable name -> slot, shared by every call of the body
+        self.layout = layout
+        self.slots = [None] * len(layout)
+
+    def get(self, name):
+        slot = self.layout.get(name)
+        if slot is not None:
+            value = self.slots[slot]
+            if value is not None:
+                return value
+        # SymbolTable.get
+        value = self.symbols.get(name)
+        if value is None and self.parent and name in self.parent.global_names:
+            return self.parent.get(name)
+        return value
+
+    def set(self, name, value):
+        slot = self.layout.get(name)
+        if slot is None:
+            self.symbols[name] = value
+        else:
+            self.slots[slot] = value
+
+    def holds(self, name):
+        slot = self.layout.get(name)
+        return (slot is not None and self.slots[slot] is not None) or name in self.symbols
+
+    def remove(self, name):
+        slot = self.layout.get(name)
+        if slot is None or self.slots[slot] is None:
+            del self.symbols[name]
+        else:
+            self.slots[slot] = None
+
+
+# the symbol table of a call of code made from the context whose table is parent
+def frame_table(parent, code):
+    return SlotTable(parent, code.layout) if code.slots else SymbolTable(parent)
+
+
+# the value a call gives its caller, from the value the function gave back
+def returned(value, context, pos_start, pos_end):
+    if isinstance(value, Struct):
+        return value.copy().set_pos(pos_start, pos_end)
+    return placed(value, context, pos_start, pos_end)
+
+
+class VM:
+    def __init__(self):
+        self.walker = Interpreter()
+        # function body node -> CodeObject, for every body compiled or loaded so far
+        self.bodies = {}
+
+    def run(self, node, context):
+        return self.run_code(Compiler(self.bodies).compile(node), context)
+
+    # run code compiled beforehand, such as the code of a .sfc file (see sfc.py)
+    def run_code(self, code, context):
+        return settle(self.execute, code, context)
+
+    def execute(self, code, context):
+        walker, bodies = self.walker, self.bodies
+        # the frames of the calls under way, each the state of the running frame below
+        frames = []
+        ops, operands = link(code)
+        pc = 0
+        stack = []
+        push, pop = stack.append, stack.pop
+        ctx = context
+        table = ctx.symbol_table
+        # the running frame's SlotTable slots, if it has any
+        slots = getattr(table, 'slots', None)
+        in_struct = ctx.display_name.startswith('struct')
+        blocks = []
+        # the references being read: the frame depth, the instruction after and the stack height
+        references = []
+        invariants = walker.invariants
+        mode = None
+
+        while True:
+            try:
+                while True:
+                    op = ops[pc]
+                    arg = operands[pc]
+                    pc += 1
+
+                    if op == LOAD_FAST or op == LOAD_CALLEE_FAST:
+                        slot, name, ps, pe = arg
+                        value = slots[slot]
+                        if value is None:
+                            value = table.get(name)
+                            if value is None:
+                                raise VariableAccessError(ps, pe, f"'{name}' is not defined")
+                        if in_struct:
+                            push(value.copy().set_pos(ps, pe) if isinstance(value, Struct) else value.set_pos(ps, pe))
+                        elif op == LOAD_CALLEE_FAST and type(value) is Function:
+                            push(value)
+                        elif isinstance(value, Struct):
+                            push(value.copy().set_pos(ps, pe))
+                        else:
+                            push(lent(value, ctx, ps, pe))
+
+                    elif op == LOAD_NAME or op == LOAD_CALLEE:
+                        name, ps, pe, cache = arg
+                        value = table.symbols.get(name)
+                        if value is None:
+                            # SymbolTable.get, with the check of the parent's globals cached
+                            parent = table.parent
+                            if parent:
+                                if cache[0] != parent.version:
+                                    cache[0], cache[1] = parent.version, name in parent.global_names
+                                if cache[1]:
+                                    value = parent.get(name)
+                        if value is None:
+                            raise VariableAccessError(ps, pe, f"'{name}' is not defined")
+                        if in_struct:
+                            push(value.copy().set_pos(ps, pe) if isinstance(value, Struct) else value.set_pos(ps, pe))
+                        elif op == LOAD_CALLEE and type(value) is Function:
+                            # CALL_NAME makes the one copy a call needs
+                            push(value)
+                        elif isinstance(value, Struct):
+                            push(value.copy().set_pos(ps, pe))
+                        else:
+                            push(lent(value, ctx, ps, pe))
+
+                    elif op == NUMBER:
+                        push(fresh(Number, arg[0], arg[1], ctx, arg[2], arg[3]))
+
+                    elif op == STRUCT_OPERAND:
+                        lhs = stack[-1]
+                        if isinstance(lhs, Struct):
+                            target, right_node, ps, pe = arg
+                            try: rhs = walker.visit(right_node, lhs.context).unwrap()
+                            except VariableAccessError:
+                                raise VariableAccessError(ps, pe, f"Struct has no property '{right_node.var_name_tok}'")
+                            push(None)
+                            push(rhs)
+                            pc = target
+                        else:
+                            # for BINARY to put the left operand back if the right one reads it again
+                            push(read_at(lhs))
+
+                    elif op == LIST_OPERAND:
+                        lhs = stack[-1]
+                        if not isinstance(lhs, List):
+                            # the Interpreter makes a BinOpNode of any other value, which reads its
+                            # positions, then visits the value as if it were a node, and fails
+                            lhs.pos_start
+                            walker.no_visit_method(lhs, ctx)
+                        push(read_at(lhs))
+
+                    elif op == PROPERTY:
+                        # Interpreter.visit_VarAccessNode in the context of the value below
+                        name, ps, pe = arg
+                        owner = pop().context
+                        value = owner.symbol_table.get(name)
+                        if value is None:
+                            raise VariableAccessError(ps, pe, f"'{name}' is not defined")
+                        if isinstance(value, Struct):
+                            push(value.copy().set_pos(ps, pe))
+                        elif owner.display_name.startswith('struct'):
+                            push(value.set_pos(ps, pe))
+                        else:
+                            push(lent(value, owner, ps, pe))
+
+                    elif op == BINARY:
+                        kind, compute, method, checked = arg
+                        rhs = pop()
+                        if checked:
+                            at = pop()
+                            lhs = pop()
+                            if at is not None:
+                                lhs = apart(lhs, at)
+                        else:
+                            lhs = pop()
+                        if kind < BY_METHOD and type(lhs) is Number and type(rhs) is Number and \
+                                (kind != BY_DIVISION or rhs.value != 0):
+                            if kind == BY_TEST:
+                                push(fresh(Number, int(compute(lhs.value, rhs.value)), 'INT', lhs.context))
+                            else:
+                                push(derived(lhs, compute(lhs.value, rhs.value)))
+                        elif kind == BY_DOT:
+                            push(rhs)
+                        else:
+                            result, error = getattr(lhs, method)(rhs)
+                            if error: raise ErrorSignal(error)
+                            push(result)
+
+                    elif op == STORE_FAST:
+                        node, name, plain, slot = arg
+                        value = kept(pop())
+                        if plain and not isinstance(value, Struct):
+                            # as STORE
+                            og_val = slots[slot]
+                            if og_val is None:
+                                og_val = table.get(name)
+                            if og_val is None:
+                                value.static = True if table.get('static-typing').is_true() else False
+                                slots[slot] = value
+                                push(value)
+                                continue
+                            if not og_val.static and not og_val.const and not og_val.triggers:
+                                if 'static-typing' not in table.symbols:
+                                    table.get('static-typing').is_true()
+                                value.const = og_val.const
+                                value.triggers = og_val.triggers
+                                slots[slot] = value
+                                push(value)
+                                continue
+                        push(walker.assign(node, value, ctx).unwrap())
+
+                    elif op == STORE:
+                        node, name, plain, slot = arg
+                        value = kept(pop())
+                        if plain and not isinstance(value, Struct):
+                            # what Interpreter.assign does to create a variable, or to replace one
+                            # that is neither static nor constant and has no triggers
+                            og_val = table.symbols.get(name)
+                            if og_val is None and table.parent:
+                                og_val = table.get(name)
+                            if og_val is None:
+                                value.static = True if table.get('static-typing').is_true() else False
+                                table.symbols[name] = value
+                                push(value)
+                                continue
+                            if not og_val.static and not og_val.const and not og_val.triggers:
+                                if 'static-typing' not in table.symbols:
+                                    table.get('static-typing').is_true()
+                                value.const = og_val.const
+                                value.triggers = og_val.triggers
+                                table.symbols[name] = value
+                                push(value)
+                                continue
+                        push(walker.assign(node, value, ctx).unwrap())
+
+                    elif op == JUMP_IF_FALSE:
+                        if not pop().is_true():
+                            pc = arg
+
+                    elif op == JUMP:
+                        pc = arg
+
+                    elif op == LOOP_APPEND:
+                        blocks[-1][3].append(pop())
+
+                    elif op == FOR_ITER:
+                        block = blocks[-1]
+                        i = block[4]
+                        if i < block[5].value if block[7] else i > block[5].value:
+                            table.symbols[block[8]] = fresh(Number, i, 'INT', None)
+                            block[4] = i + block[6]
+                        else:
+                            pc = arg
+
+                    elif op == FOR_ITER_FAST:
+                        block = blocks[-1]
+                        i = block[4]
+                        if i < block[5].value if block[7] else i > block[5].value:
+                            slots[block[8]] = fresh(Number, i, 'INT', None)
+                            block[4] = i + block[6]
+                        else:
+                            pc = arg
+
+                    elif op == CALL or op == CALL_NAME:
+                        argc, ps, pe = arg
+                        if argc:
+                            args = stack[-argc:]
+                            del stack[-argc:]
+                        else:
+                            args = []
+                        callee = pop()
+                        if op == CALL_NAME and type(callee) is Function and not in_struct:
+                            function = callee.copy().set_context(ctx).set_pos(ps, pe)
+                        else:
+                            function = callee.copy().set_pos(ps, pe)
+                        if type(function) is not Function:
+                            push(returned(function.execute(args).unwrap(), ctx, ps, pe))
+                            continue
+
+                        # Function.execute, with the body run in a new frame; the arguments are
+                        # stored once the body is compiled, as that gives the table its slots
+                        exec_ctx = Context(function.name, function.context, function.pos_start)
+                        if len(args) != len(function.arg_names):
+                            function.check_args(function.arg_names, args).unwrap()
+                        body = function.body_node
+                        if isinstance(body, LazyBlockNode):
+                            body = function.load_body().unwrap()
+                        body_code = bodies.get(body)
+                        if body_code is None:
+                            body_code = bodies[body] = Compiler(bodies).compile(body, function.name,
+                                                                                function.arg_names)
+                        exec_ctx.symbol_table = frame_table(function.context.symbol_table, body_code)
+                        function.populate_args(function.arg_names, args, exec_ctx)
+
+                        frames.append((ops, operands, pc, stack, ctx, table, in_struct, blocks,
+                                       invariants, mode, ps, pe))
+                        ops, operands = link(body_code)
+                        pc = 0
+                        stack = []
+                        push, pop = stack.append, stack.pop
+                        ctx = exec_ctx
+                        table = exec_ctx.symbol_table
+                        slots = getattr(table, 'slots', None)
+                        in_struct = exec_ctx.display_name.startswith('struct')
+                        blocks = []
+                        invariants = walker.invariants = {}
+                        mode = AUTO if function.auto_return else PLAIN
+
+                    elif op == END or op == RETURN:
+                        if op == END:
+                            value = pop()
+                            if not frames:
+                                return value
+                            value = (value if mode != PLAIN else None) or Number.null
+                        else:
+                            value = pop() if arg else Number.null
+                            if value is None:
+                                # a return of nothing (an if without else) returns nothing
+                                push(None)
+                                continue
+                            if not frames:
+                                raise ReturnSignal(value)
+                        ops, operands, pc, stack, ctx, table, in_struct, blocks, invariants, mode, ps, pe = frames.pop()
+                        slots = getattr(table, 'slots', None)
+                        push, pop = stack.append, stack.pop
+                        walker.invariants = invariants
+                        push(returned(value, ctx, ps, pe))
+
+                    elif op == INVARIANT:
+                        target, node = arg
+                        stored = invariants.get(node.key)
+                        if stored is not None and stored[1] == Interpreter.trigger_epoch and not in_struct:
+                            value = stored[0].copy()
+                            if value.pos_start is not None:
+                                value.set_pos(node.anchor.pos_start, node.anchor.pos_end)
+                            if not node.shared or not isinstance(value, Number):
+                                value.triggers = []
+                            push(value)
+                            pc = target
+
+                    elif op == INVARIANT_STORE:
+                        value = stack[-1]
+                        # lists may be changed in place, so only numbers and strings are kept
+                        if isinstance(value, (Number, String)) and not in_struct:
+                            invariants[arg.key] = (value.copy(), Interpreter.trigger_epoch)
+
+                    elif op == RESET:
+                        for key in arg.keys:
+                            invariants.pop(key, None)
+
+                    elif op == LIST:
+                        n, ps, pe = arg
+                        if n:
+                            values = stack[-n:]
+                            del stack[-n:]
+                        else:
+                            values = []
+                        push(fresh_list([kept(value) for value in values], ctx, ps, pe))
+
+                    elif op == SETUP_LOOP:
+                        blocks.append([arg, pc, len(stack), []])
+
+                    elif op == FOR_SETUP:
+                        target, name, has_step = arg
+                        step_value = pop() if has_step else None
+                        end_value = pop()
+                        start_value = pop()
+                        if not has_step:
+                            step_value = Number(1) if start_value.value < end_value.value else Number(-1)
+                        blocks.append([target, pc, len(stack), [], start_value.value, end_value,
+                                       step_value.value, step_value.value >= 0, name])
+
+                    elif op == END_LOOP:
+                        push(fresh_list(blocks.pop()[3], ctx, arg[0], arg[1]))
+
+                    elif op == BREAK or op == CONTINUE:
+                        if not blocks:
+                            raise BreakSignal() if op == BREAK else ContinueSignal()
+                        block = blocks[-1]
+                        del stack[block[2]:]
+                        pc = block[0] if op == BREAK else block[1]
+
+                    elif op == UNARY:
+                        op_type, ps, pe = arg
+                        number = pop()
+                        if type(number) is Number and op_type == 'MNS':
+                            push(derived(number, number.value * -1).set_pos(ps, pe))
+                        elif type(number) is Number and op_type == 'NOT':
+                            push(fresh(Number, 1 if number.value == 0 else 0, 'INT', number.context, ps, pe))
+                        else:
+                            error = None
+                            if op_type == 'MNS':
+                                number, error = number.mul(Number(-1))
+                            if op_type == 'NOT':
+                                number, error = number.lognot(Number(-1))
+                            if error: raise ErrorSignal(error)
+                            push(number.set_pos(ps, pe))
+
+                    elif op == STRING:
+                        push(fresh(String, arg[0], 'STR', ctx, arg[1], arg[2]))
+
+                    elif op == NONE:
+                        push(None)
+
+                    elif op == CAPSULE:
+                        n, ps, pe = arg
+                        values = stack[-n:] if n else []
+                        del stack[len(stack) - n:]
+                        if n == 1:
+                            push(values[0].set_context(ctx).set_pos(ps, pe))
+                        else:
+                            push(fresh_list(values, ctx, ps, pe))
+
+                    elif op == INLINE_GUARD:
+                        target, name, body = arg
+                        function = table.get(name)
+                        if type(function) is not Function or function.body_node is not body or in_struct:
+                            pc = target
+
+                    elif op == INLINE_CALL:
+                        # Interpreter.visit_InlineCallNode, with the body run in a new frame that
+                        # shares this one's invariants
+                        arg_names, body_code, name, ps, pe = arg
+                        n = len(arg_names)
+                        args = stack[-n:] if n else []
+                        del stack[len(stack) - n:]
+                        exec_ctx = Context(name, ctx, ps)
+                        exec_ctx.symbol_table = frame_table(table, body_code)
+                        for arg_name, value in zip(arg_names, args):
+                            value = kept(value)
+                            if not isinstance(value, Struct):
+                                value.set_context(exec_ctx)
+                            exec_ctx.symbol_table.set(arg_name, value)
+
+                        frames.append((ops, operands, pc, stack, ctx, table, in_struct, blocks,
+                                       invariants, mode, ps, pe))
+                        ops, operands = link(body_code)
+                        pc = 0
+                        stack = []
+                        push, pop = stack.append, stack.pop
+                        ctx = exec_ctx
+                        table = exec_ctx.symbol_table
+                        slots = getattr(table, 'slots', None)
+                        in_struct = exec_ctx.display_name.startswith('struct')
+                        blocks = []
+                        mode = INLINED
+
+                    elif op == MAKE_FUNCTION:
+                        name, body_node, arg_names, auto_return, ps, pe, body_code = arg
+                        func_val = Function(name, body_node, arg_names, auto_return).set_context(ctx).set_pos(ps, pe)
+                        if name:
+                            table.set(name, func_val)
+                        if body_code is not None:
+                            bodies.setdefault(body_node, body_code)
+                        push(func_val)
+
+                    elif op == MAKE_STRUCT:
+                        name = arg.var_name_tok.value if arg.var_name_tok else None
+                        struct_val = StructGenerator(name, arg.body_node, [a.value for a in arg.arg_name_toks],
+                                                     arg.auto_return).set_context(ctx).set_pos(arg.pos_start, arg.pos_end)
+                        if name:
+                            table.set(name, struct_val)
+                        push(struct_val)
+
+                    elif op == WHEN:
+                        if table.get(arg.target) is None:
+                            raise VariableAccessError(arg.left_node.pos_start, arg.left_node.pos_end,
+                                                      f'Variable {arg.target} does not exist')
+                        table.symbols[arg.target].triggers.append(arg)
+                        push(fresh_list([], ctx, arg.pos_start, arg.pos_end))
+
+                    elif op == REFERENCE:
+                        references.append((len(frames), arg, len(stack)))
+
+                    elif op == END_REFERENCE:
+                        references.pop()
+
+                    elif op == EVAL:
+                        push(walker.visit(arg, ctx).unwrap())
+
+                    else:
+                        raise Exception(f'Unknown opcode {op}')
+
+            # an error in a reference's head leaves nothing in its place, as in the Interpreter
+            except ErrorSignal:
+                if not references:
+                    raise
+                depth, pc, height = references.pop()
+                while len(frames) > depth:
+                    ops, operands, _, stack, ctx, table, in_struct, blocks, invariants, mode, ps, pe = frames.pop()
+                slots = getattr(table, 'slots', None)
+                push, pop = stack.append, stack.pop
+                walker.invariants = invariants
+                del stack[height:]
+                push(None)
+            # a signal raised by the Interpreter or by break or continue outside a loop
+            except ReturnSignal as signal:
+                if not frames:
+                    raise
+                ops, operands, pc, stack, ctx, table, in_struct, blocks, invariants, mode, ps, pe = frames.pop()
+                slots = getattr(table, 'slots', None)
+                push, pop = stack.append, stack.pop
+                walker.invariants = invariants
+                push(returned(signal.value, ctx, ps, pe))
+            except (BreakSignal, ContinueSignal) as signal:
+                while not blocks:
+                    if not frames:
+                        raise
+                    ops, operands, pc, stack, ctx, table, in_struct, blocks, invariants, mode, ps, pe = frames.pop()
+                slots = getattr(table, 'slots', None)
+                push, pop = stack.append, stack.pop
+                walker.invariants = invariants
+                block = blocks[-1]
+                del stack[block[2]:]
+                pc = block[0] if isinstance(signal, BreakSignal) else block[1]